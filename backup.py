@@ -0,0 +1,192 @@
+"""
+backup.py
+Export and import of profiles, conferences, sessions and wishlists
+    as JSON Lines.
+
+Each line is one entity:
+    {"kind": ..., "key": [[kind, id], ...], "properties": {...}}
+Keys are written as their ancestor paths, Profile -> Conference -> Session,
+    and properties holding websafe keys as paths too, so a dump can be
+    imported into another application.
+
+Export is read one chunk per request, continuing from the cursor
+    of the previous chunk, so memory stays flat whatever the dataset size:
+        GET /admin/export?kind=Conference&cursor=...
+    The cursor of the next chunk is returned in the X-Next-Cursor header.
+Import takes JSON Lines in the request body:
+        POST /admin/import
+    Entities keep their key paths. Their numeric IDs are reserved
+    with allocate_ids, so new entities never get an imported ID.
+"""
+
+import json
+from datetime import datetime
+
+from google.appengine.api import memcache
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+from conference import ConferenceApi
+from core import EXPORT_CHUNK_SIZE, PUT_BATCH_SIZE
+from models.conference import Conference
+from models.profile import Profile
+from models.session import Session
+from models.wishlist import WishlistEntry
+from settings import MEMCACHE_CONFERENCE_VERSION_KEY
+
+
+# Models which are exported and imported, by kind
+MODELS = {
+    'Profile': Profile,
+    'Conference': Conference,
+    'Session': Session,
+    'WishlistEntry': WishlistEntry,
+}
+
+# Properties holding websafe keys, by kind
+KEY_FIELDS = {
+    'Profile': ['conferenceKeysToAttend', 'sessionKeysInWhishlist'],
+    'Session': ['conferenceKeyBelongTo'],
+    'WishlistEntry': ['sessionKey'],
+}
+
+
+def exportChunk(kind, cursor=None, size=EXPORT_CHUNK_SIZE):
+    """
+    Export one chunk of the entities of a kind
+    :param kind: one of MODELS
+    :param cursor: websafe cursor returned with the previous chunk
+    :param size: number of entities in the chunk
+    :return: (iterator of JSON lines, websafe cursor of the next chunk,
+        or None after the last chunk)
+    """
+    model = MODELS[kind]
+    entities, next_cursor, more = model.query().fetch_page(
+        size, start_cursor=Cursor(urlsafe=cursor) if cursor else None)
+    lines = (json.dumps(entityToJson(entity)) + '\n' for entity in entities)
+    return lines, next_cursor.urlsafe() if more and next_cursor else None
+
+
+def entityToJson(entity):
+    """Convert an entity into a JSON serializable dict."""
+    kind = entity._get_kind()
+    properties = {}
+    # computed properties are recomputed on import
+    computed = [name for name, prop in entity._properties.items()
+                if isinstance(prop, ndb.ComputedProperty)]
+    for name, value in entity.to_dict(exclude=computed).items():
+        if name in KEY_FIELDS.get(kind, ()):
+            value = _keyPaths(value)
+        elif hasattr(value, 'isoformat'):
+            value = value.isoformat()
+        properties[name] = value
+    return {
+        'kind': kind,
+        'key': [list(pair) for pair in entity.key.pairs()],
+        'properties': properties,
+    }
+
+
+def _keyPaths(value):
+    """Replace websafe keys by key paths, in a value or list of values."""
+    if isinstance(value, list):
+        return [_keyPaths(v) for v in value]
+    if not value:
+        return value
+    return [list(pair) for pair in ndb.Key(urlsafe=value).pairs()]
+
+
+def jsonToEntity(data):
+    """Convert a dict of entityToJson back into an entity."""
+    kind = data['kind']
+    model = MODELS[kind]
+    values = {}
+    for name, value in data['properties'].items():
+        prop = model._properties.get(name)
+        if prop is None or isinstance(prop, ndb.ComputedProperty):
+            continue
+        if name in KEY_FIELDS.get(kind, ()):
+            value = _websafeKeys(value)
+        elif isinstance(prop, ndb.DateProperty) and value:
+            value = datetime.strptime(value[:10], "%Y-%m-%d").date()
+        values[name] = value
+    key = ndb.Key(pairs=[tuple(pair) for pair in data['key']])
+    return model(key=key, **values)
+
+
+def _websafeKeys(value):
+    """Replace key paths by websafe keys of this application."""
+    if value and isinstance(value[0], list) and isinstance(value[0][0], list):
+        return [_websafeKeys(v) for v in value]
+    if not value:
+        return value
+    return ndb.Key(pairs=[tuple(pair) for pair in value]).urlsafe()
+
+
+def importLines(lines):
+    """
+    Import entities from JSON lines
+    Entities are written with put_multi in batches of PUT_BATCH_SIZE.
+    Imported entities replace existing entities with the same key.
+    :param lines: iterable of JSON lines, blank lines are skipped
+    :return: number of entities imported by kind
+    """
+    counts = dict((kind, 0) for kind in MODELS)
+    batch = []
+    for line in lines:
+        if not line.strip():
+            continue
+        batch.append(jsonToEntity(json.loads(line)))
+        if len(batch) >= PUT_BATCH_SIZE:
+            _importBatch(batch, counts)
+            batch = []
+    if batch:
+        _importBatch(batch, counts)
+    ConferenceApi._invalidateConference()
+    return counts
+
+
+def _importBatch(entities, counts):
+    """Reserve the IDs of a batch of entities and write it."""
+    # reserve the highest numeric ID under each parent,
+    #     so allocate_ids never hands out an imported ID
+    max_ids = {}
+    for entity in entities:
+        c_id = entity.key.id()
+        if isinstance(c_id, (int, long)):
+            group = (type(entity), entity.key.parent())
+            max_ids[group] = max(max_ids.get(group, 0), c_id)
+    futures = [model.allocate_ids_async(max=c_id, parent=parent)
+               for (model, parent), c_id in max_ids.items()]
+
+    # seat shards are keyed by the websafe key of their conference,
+    #     so they are created anew for another application. Shards
+    #     already in this one hold the live count: the exported
+    #     seatsAvailable may predate the last fold, so it is folded
+    #     from them instead, and no shard is reset
+    conferences = [entity for entity in entities
+                   if isinstance(entity, Conference)]
+    new_shards = [ConferenceApi._createSeatShards(conf)
+                  for conf in conferences]
+    found = iter(ndb.get_multi([shard.key for conf_shards in new_shards
+                                for shard in conf_shards]))
+    shards = []
+    for conf, conf_shards in zip(conferences, new_shards):
+        existing = [shard for shard in [next(found) for _ in conf_shards]
+                    if shard]
+        if existing:
+            conf.seatsAvailable = sum(shard.seatsAvailable
+                                      for shard in existing)
+        else:
+            shards.extend(conf_shards)
+    ndb.Future.wait_all(futures)
+    entities_and_shards = entities + shards
+    for i in range(0, len(entities_and_shards), PUT_BATCH_SIZE):
+        ndb.put_multi(entities_and_shards[i:i + PUT_BATCH_SIZE])
+
+    # outdate cached responses of replaced conferences
+    memcache.offset_multi(dict(
+        (MEMCACHE_CONFERENCE_VERSION_KEY % entity.key.urlsafe(), 1)
+        for entity in entities if isinstance(entity, Conference)))
+    for entity in entities:
+        counts[entity._get_kind()] += 1
@@ -0,0 +1,397 @@
+"""
+benchmarks.py
+Benchmarks of the APIs against the local App Engine stubs.
+
+Each benchmark runs in a fresh testbed (see testing.py), with the
+    answers of the datastore and memcache stubs delayed to simulate the
+    round trips of production, and returns its report as text.
+    PYTHONPATH=path/to/google_appengine python benchmarks.py [name...]
+"""
+
+import logging
+import random
+import threading
+import time
+from datetime import date, timedelta
+from timeit import repeat as timeRepeat
+
+# sets up the path of the SDK, before importing from it
+import testing
+from google.appengine.api import datastore_errors, memcache
+from google.appengine.ext import ndb
+from protorpc import message_types
+
+from conference import ConferenceApi, CONF_GET_REQUEST
+from core import OPERATOR_LOOKUP
+from models import ConflictException
+from models.conference import Conference
+from models.profile import Profile
+from models.session import Session, SessionForm, TypeOfSession
+from models.wishlist import WishlistEntry, wishlistEntryId
+from planner import compileFilters
+from schedule import conferenceInterval, conflictGroups, sessionInterval
+from serializers import recoverIntToTime, sessionToForm
+from session import SessionApi
+
+
+def _registerAll(wsck, emails, threads):
+    """Register the users of the given emails for a conference,
+        from the given number of concurrent threads.
+    Return the number of registrations by outcome."""
+    outcomes = {'registered': 0, 'sold out': 0, 'failed': 0}
+    lock = threading.Lock()
+    pending = list(emails)
+
+    def register():
+        api = ConferenceApi()
+        while True:
+            with lock:
+                if not pending:
+                    return
+                email = pending.pop()
+            testing.actAs(email)
+            request = CONF_GET_REQUEST.combined_message_class(
+                websafeConferenceKey=wsck)
+            try:
+                api._conferenceRegistration(request)
+                outcome = 'registered'
+            except ConflictException:
+                outcome = 'sold out'
+            except datastore_errors.TransactionFailedError:
+                outcome = 'failed'
+            with lock:
+                outcomes[outcome] += 1
+
+    workers = [threading.Thread(target=register) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return outcomes
+
+
+def registrationBenchmark(seats=50, users=100, threads=20, shards=(0, 10),
+                          delay=0.005):
+    """
+    Register more users than there are seats for a single conference
+        from concurrent threads, keeping the seats on the Conference
+        entity and on SeatShards
+    Every run checks that no seat was sold twice: the registered users,
+        the Profiles attending the conference and the seats taken
+        after folding the shards all agree, and don't exceed the seats.
+    :param seats: seats of the conference
+    :param users: users trying to register
+    :param threads: concurrent requests
+    :param shards: seatShards of the conference, 0 for the entity
+    :param delay: seconds per datastore and memcache RPC
+    :return: report as text
+    """
+    lines = ['%d seats, %d users, %d threads, %.1f ms per RPC' % (
+        seats, users, threads, delay * 1000)]
+    for seat_shards in shards:
+        tb = testing.activateStubs()
+        try:
+            testing.delayRpcs(delay)
+            conf = Conference(
+                parent=ndb.Key(Profile, 'organizer@example.com'),
+                name='Contended', maxAttendees=seats, seatsAvailable=seats,
+                seatShards=seat_shards)
+            conf.put()
+            ndb.put_multi(ConferenceApi._createSeatShards(conf))
+            wsck = conf.key.urlsafe()
+            emails = ['user%d@example.com' % i for i in range(users)]
+
+            start = time.time()
+            outcomes = _registerAll(wsck, emails, threads)
+            elapsed = time.time() - start
+
+            # the fold task runs in a request of its own
+            ndb.get_context().clear_cache()
+            ConferenceApi._foldSeatShards(wsck)
+            attending = Profile.query(
+                Profile.conferenceKeysToAttend == wsck).count()
+            taken = seats - conf.key.get().seatsAvailable
+            registered = outcomes['registered']
+            assert registered == attending == taken <= seats, (
+                registered, attending, taken)
+            lines.append(
+                '%-9s %3d registered, %3d sold out, %3d failed, '
+                '%3d attending, %3d seats taken, %6.0f ms' % (
+                    '%d shards' % seat_shards if seat_shards else 'entity',
+                    registered, outcomes['sold out'], outcomes['failed'],
+                    attending, taken, elapsed * 1000))
+        finally:
+            tb.deactivate()
+    return '\n'.join(lines)
+
+
+def _serialConferencesToAttend(email):
+    """Read the conferences a user has registered for and the names of
+        their organizers one after another, as before the tasklets."""
+    prof = ndb.Key(Profile, email).get()
+    conferences = ndb.get_multi([ndb.Key(urlsafe=wsck)
+                                 for wsck in prof.conferenceKeysToAttend])
+    profiles = ndb.get_multi([ndb.Key(Profile, conf.organizerUserId)
+                              for conf in conferences])
+    names = dict((profile.key.id(), profile.displayName)
+                 for profile in profiles)
+    return conferences, names
+
+
+def readPathBenchmark(conferences=10, repeat=20, delay=0.005):
+    """
+    Time reading the conferences a user has registered for and their
+        organizers, serially against _conferencesToAttendAsync,
+        and count the RPCs of each
+    Both read cold: the context cache and memcache are cleared first.
+    :param conferences: conferences of the user, each by another organizer
+    :param repeat: runs of each variant, the median one is reported
+    :param delay: seconds per datastore and memcache RPC
+    :return: report as text
+    """
+    tb = testing.activateStubs()
+    try:
+        email = 'attendee@example.com'
+        organizers = [Profile(id='organizer%d@example.com' % i,
+                              displayName='Organizer %d' % i)
+                      for i in range(conferences)]
+        confs = [Conference(parent=organizer.key, name='Conference %d' % i,
+                            organizerUserId=organizer.key.id())
+                 for i, organizer in enumerate(organizers)]
+        ndb.put_multi(organizers + confs)
+        Profile(id=email, displayName='Attendee',
+                conferenceKeysToAttend=[conf.key.urlsafe()
+                                        for conf in confs]).put()
+        api = ConferenceApi()
+        testing.delayRpcs(delay)
+        counter = testing.RpcCounter().install()
+
+        def tasklets():
+            return api._conferencesToAttendAsync().get_result()
+
+        lines = ['%d conferences, %.1f ms per RPC' % (
+            conferences, delay * 1000)]
+        for label, read in (('serial', lambda: _serialConferencesToAttend(
+                                email)),
+                            ('tasklets', tasklets)):
+            times = []
+            for run in range(repeat):
+                ndb.get_context().clear_cache()
+                memcache.flush_all()
+                testing.actAs(email, 'read-path-%s-%d' % (label, run))
+                counter.reset()
+                start = time.time()
+                found, names = read()
+                times.append(time.time() - start)
+                assert len(found) == len(names) == conferences
+            times.sort()
+            lines.append('%-9s %6.1f ms, %2d RPCs (%s)' % (
+                label, times[len(times) // 2] * 1000, counter.total(),
+                ', '.join('%s %d' % call
+                          for call in sorted(counter.calls.items()))))
+        counter.uninstall()
+        return '\n'.join(lines)
+    finally:
+        tb.deactivate()
+
+
+def _syntheticSessions(rows):
+    """Return sessions of varied speakers, types, dates and start times."""
+    types = ['WORKSHOP', 'LECTURE', 'KEYNOTE', 'NOT_SPECIFIED']
+    return [Session(name='Session %d' % i,
+                    highlights=['intro', 'demo'],
+                    speaker='Speaker %d' % (i % 500),
+                    duration='1h30m',
+                    typeOfSession=[types[i % 4], types[i % 3]],
+                    date=date(2016, 1 + i % 12, 1 + i % 28),
+                    startTime=(i * 7) % 1440)
+            for i in range(rows)]
+
+
+def filtersBenchmark(rows=100000, repeat=3):
+    """
+    Time in-memory filtering of synthetic sessions, per row,
+        interpreting the filters on every row against compileFilters
+    :param rows: number of synthetic sessions
+    :param repeat: runs of each variant, the fastest one is reported
+    :return: report as text
+    """
+    sessions = _syntheticSessions(rows)
+    filters = [
+        {"field": "startTime", "operator": "<", "value": 720},
+        {"field": "date", "operator": ">=", "value": date(2016, 6, 1)},
+        {"field": "typeOfSession", "operator": "!=", "value": 'WORKSHOP'},
+    ]
+
+    def interpreted(entity, filtr):
+        value = getattr(entity, filtr["field"])
+        if isinstance(value, list):
+            return filtr["value"] not in value
+        return OPERATOR_LOOKUP[filtr["operator"]](value, filtr["value"])
+
+    def runInterpreted():
+        return sum(1 for entity in sessions
+                   if all(interpreted(entity, filtr) for filtr in filters))
+
+    predicate = compileFilters(Session, filters)
+
+    def runCompiled():
+        return sum(1 for entity in sessions if predicate(entity))
+
+    assert runInterpreted() == runCompiled()
+    lines = ['%d sessions, %d filters, %d pass' % (
+        rows, len(filters), runCompiled())]
+    for label, fn in (('interpreted', runInterpreted),
+                      ('compiled', runCompiled)):
+        best = min(timeRepeat(fn, number=1, repeat=repeat))
+        lines.append('%-12s %8.3f us/row' % (label, best * 1e6 / rows))
+    return '\n'.join(lines)
+
+
+def _seedSchedule(email, sessions, conferences, rnd):
+    """Store a user registered for the given number of conferences,
+        with the given number of their sessions in the wishlist."""
+    prof = Profile(id=email, displayName='Attendee', mainEmail=email)
+    organizer = ndb.Key(Profile, 'organizer@example.com')
+    confs = []
+    for i in range(conferences):
+        start = date(2016, 1, 1) + timedelta(days=rnd.randrange(360))
+        confs.append(Conference(parent=organizer, name='Conference %d' % i,
+                                startDate=start,
+                                endDate=start + timedelta(days=4)))
+    ndb.put_multi(confs)
+    prof.conferenceKeysToAttend = [conf.key.urlsafe() for conf in confs]
+    entities = []
+    for i in range(sessions):
+        conf = confs[i % conferences]
+        # sessions of 30 to 120 minutes, on the quarter hour, 8am to 6pm
+        session = Session(
+            parent=conf.key, name='Session %d' % i,
+            duration=rnd.choice(['30m', '45m', '1h', '2h']),
+            date=conf.startDate + timedelta(days=rnd.randrange(5)),
+            startTime=rnd.randrange(8 * 60, 18 * 60, 15))
+        session.key = ndb.Key(Session, i + 1, parent=conf.key)
+        entities.append(session)
+        entities.append(WishlistEntry(
+            id=wishlistEntryId(session.key), parent=prof.key,
+            sessionKey=session.key.urlsafe()))
+    for i in range(0, len(entities), 500):
+        ndb.put_multi(entities[i:i + 500])
+    prof.put()
+
+
+def scheduleBenchmark(sizes=(1000, 5000), conferences=20, repeat=3,
+                      delay=0.005):
+    """
+    Time getScheduleConflicts for users holding thousands of sessions
+        in their wishlist, then its reads (_scheduleAsync) and its
+        grouping of the conflicts (conflictGroups) alone
+    Both read cold: the context cache and memcache are cleared first.
+    Reads dominate, mostly the datastore stub decoding the entities.
+    :param sizes: wishlist sizes, a user each
+    :param conferences: conferences each user registered for,
+        the sessions are spread over them
+    :param repeat: runs of each size, the median one is reported
+    :param delay: seconds per datastore and memcache RPC
+    :return: report as text
+    """
+    lines = ['%d conferences, %.1f ms per RPC' % (conferences, delay * 1000)]
+    for size in sizes:
+        tb = testing.activateStubs()
+        try:
+            email = 'attendee@example.com'
+            _seedSchedule(email, size, conferences, random.Random(0))
+            api = SessionApi()
+            testing.delayRpcs(delay)
+            counter = testing.RpcCounter().install()
+            results = {}
+            for label, run in (
+                    ('read', lambda: api._scheduleAsync().get_result()),
+                    ('endpoint', lambda: api.getScheduleConflicts(
+                        message_types.VoidMessage()))):
+                times = []
+                for i in range(repeat):
+                    ndb.get_context().clear_cache()
+                    memcache.flush_all()
+                    testing.actAs(email, 'schedule-%s-%d' % (label, i))
+                    counter.reset()
+                    start = time.time()
+                    results[label] = run()
+                    times.append(time.time() - start)
+                times.sort()
+                results[label + ' ms'] = times[len(times) // 2] * 1000
+                results[label + ' RPCs'] = counter.total()
+            counter.uninstall()
+            sessions, confs = results['read']
+            assert len(sessions) == size and len(confs) == conferences
+            grouping = min(timeRepeat(lambda: (
+                conflictGroups(api._intervals(sessions, sessionInterval)) +
+                conflictGroups(api._intervals(confs, conferenceInterval))),
+                number=1, repeat=repeat))
+            lines.append(
+                '%6d sessions: %4d conflict groups, endpoint %7.1f ms '
+                '(%2d RPCs), reads %7.1f ms (%2d RPCs), grouping %5.1f ms'
+                % (size, len(results['endpoint'].items),
+                   results['endpoint ms'], results['endpoint RPCs'],
+                   results['read ms'], results['read RPCs'],
+                   grouping * 1000))
+        finally:
+            tb.deactivate()
+    return '\n'.join(lines)
+
+
+def _reflectiveSessionForm(session):
+    """Copy a Session into a SessionForm field by field,
+        as before the precompiled copiers."""
+    sf = SessionForm()
+    for field in sf.all_fields():
+        if hasattr(session, field.name):
+            if field.name == "date":
+                setattr(sf, field.name, str(getattr(session, field.name)))
+            elif field.name == "startTime":
+                setattr(sf, field.name, recoverIntToTime(
+                    getattr(session, field.name)))
+            elif field.name == "typeOfSession":
+                setattr(sf, field.name,
+                        [getattr(TypeOfSession, str(t))
+                         for t in getattr(session, field.name)])
+            else:
+                setattr(sf, field.name, getattr(session, field.name))
+    return sf
+
+
+def serializersBenchmark(rows=10000, repeat=3):
+    """
+    Time copying synthetic sessions into SessionForms, per entity,
+        looping over the fields of the form against sessionToForm
+    :param rows: number of synthetic sessions
+    :param repeat: runs of each variant, the fastest one is reported
+    :return: report as text
+    """
+    sessions = _syntheticSessions(rows)
+    assert all(_reflectiveSessionForm(s) == sessionToForm(s)
+               for s in sessions[:100])
+    lines = ['%d sessions' % rows]
+    for label, copy in (('reflective', _reflectiveSessionForm),
+                        ('precompiled', sessionToForm)):
+        best = min(timeRepeat(lambda: [copy(s) for s in sessions],
+                              number=1, repeat=repeat))
+        lines.append('%-12s %8.2f us/entity' % (label, best * 1e6 / rows))
+    return '\n'.join(lines)
+
+
+BENCHMARKS = {
+    'filters': filtersBenchmark,
+    'read_path': readPathBenchmark,
+    'registration': registrationBenchmark,
+    'schedule': scheduleBenchmark,
+    'serializers': serializersBenchmark,
+}
+
+
+if __name__ == '__main__':
+    import sys
+    # ndb logs every transaction failing on contention
+    logging.getLogger().setLevel(logging.ERROR)
+    for name in sys.argv[1:] or sorted(BENCHMARKS):
+        print(BENCHMARKS[name]())
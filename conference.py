@@ -10,26 +10,50 @@ created by wesc on 2014 apr 21
 
 """
 
+import hashlib
+import json
+import logging
+import random
+import time
 from datetime import datetime
 
 import endpoints
 
 from protorpc import messages
 from protorpc import message_types
+from protorpc import protojson
 from protorpc import remote
 
-from google.appengine.api import memcache, taskqueue
+from google.appengine.api import datastore_errors, memcache, taskqueue
+from google.appengine.datastore.datastore_query import Cursor
 from google.appengine.ext import ndb
 
-from models import BooleanMessage, ConflictException, StringMessage
-from models.profile import Profile
+from models import BooleanMessage, CacheStatsMessage, ConflictException,\
+    StringMessage
+from models.search import SearchForm
 from models.conference import Conference, ConferenceForm,\
-    ConferenceForms, ConferenceQueryForms
-
-from core import DEFAULTS, OPERATORS, CONF_FIELDS,\
-    EMAIL_SCOPE, API_EXPLORER_CLIENT_ID
-from settings import WEB_CLIENT_ID, MEMCACHE_ANNOUNCEMENTS_KEY
-from utils import getUserId, getProfileFromUser
+    ConferenceForms, ConferenceQueryForms, ConferenceSummaryForm,\
+    ConferenceSummaryForms, NearlySoldOut, SeatShard, weekOf,\
+    ConferenceFacetsForm, FacetCount, FacetCounts
+from models.migration import MigrationState
+
+from core import DEFAULTS, OPERATORS, CONF_FIELDS, CONF_SUMMARY_FIELDS,\
+    CONF_SUMMARY_MIGRATION,\
+    DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, MAX_SEAT_SHARDS, SEAT_FOLD_INTERVAL,\
+    MAX_CREATE_BATCH, PUT_BATCH_SIZE, CONFIRMATION_QUEUE,\
+    LONG_CONFERENCE_WEEK, MAX_RANGE_WEEKS,\
+    FACET_FIELDS, FACET_SHARDS, FACET_CACHE_TTL,\
+    CONFERENCE_CACHE_TTL, QUERY_CACHE_TTL, NEARLY_SOLD_OUT_SEATS,\
+    NEARLY_SOLD_OUT_ID, EMAIL_SCOPE, API_EXPLORER_CLIENT_ID
+from settings import WEB_CLIENT_ID, MEMCACHE_ANNOUNCEMENTS_KEY,\
+    MEMCACHE_CONFERENCE_KEY, MEMCACHE_CONFERENCE_VERSION_KEY,\
+    MEMCACHE_QUERY_KEY, MEMCACHE_QUERY_VERSION_KEY,\
+    MEMCACHE_QUERY_HITS_KEY, MEMCACHE_QUERY_MISSES_KEY, MEMCACHE_FACETS_KEY
+from index_advisor import recordQueryShape
+from planner import planQuery, compileFilters, fetchFilteredPage
+from search import postingsFor, reindex, search
+from serializers import conferenceToForm
+from utils import currentContext
 
 
 # - - - - Request messages - - - - - - - - - - - - - - - - - - -
@@ -69,8 +93,13 @@ class ConferenceApi(remote.Service):
         @endpoints
             - getConference(websafeConferenceKey): retrieve data of
                 the given conference key and return it as a response
+                The response is cached in memcache.
+                See also: _conferenceVersion
             - createConference(): create a new conference
                 with ```request.fields``` and return the result
+            - createConferences(): create up to MAX_CREATE_BATCH conferences
+                with ```request.items``` in one batch
+                See also: _createConferenceObjects
             - updateConference(websafeConferenceKey):
                 update the given conference
                     with ```request.fields``` and return the result
@@ -79,6 +108,26 @@ class ConferenceApi(remote.Service):
                     of field operator, and value.
                 Example:
                     CITY = London and TOPIC = Technology
+                Results are paged: pass ```pageSize``` and the
+                    ```nextPageToken``` of the previous response
+                    as ```pageToken``` to get the next page.
+                Pages are cached in memcache by their normalized filters.
+                With ```fromDate``` and/or ```toDate```, only conferences
+                    running on a day of that range are returned.
+                See also: _queryCacheKey, _formatDateRange
+            - queryConferenceSummaries(),
+                getConferenceSummariesCreated(),
+                getConferenceSummariesToAttend():
+                same as the endpoints above, returning only the fields
+                    conference lists show, read with projection queries.
+                See also: CONF_SUMMARY_FIELDS, _copyConferenceToSummaryForm
+            - searchConferences():
+                full-text search of conference names and descriptions,
+                    ranked by relevance and paged. A term ending with *
+                    matches as a prefix.
+                See also: search.search
+            - getQueryCacheStats():
+                return hit and miss counters of the queryConferences cache
             - getConferencesCreated(): retrieve all conferences
                 which are created by a current user
             - getConferencesToAttend(): retrieve all conferences
@@ -87,31 +136,94 @@ class ConferenceApi(remote.Service):
                 a current user register the given conference
             - unregisterFromConference(websafeConferenceKey):
                 a current user unregister the given conference
+            - getConferenceFacets():
+                return the number of conferences by city, topic and month,
+                    summed from the FacetCounts shards and cached
+                See also: _applyFacetDelta, _rebuildFacetCounts
             - getAnnouncement():
                 return an announcement about conferences
+                See also: _trackNearlySoldOut
 
         helper:
             _conferenceRegistration: Handles data data base transaction.
                 Appends a conference key
                     to conferenceKeysToAttend list in Profile model object,
-                Decrements seatsAvailable attr. in Conference model object
+                Decrements seatsAvailable attr. in Conference model object,
+                    or in one of its SeatShard objects
+                    if the conference has seatShards
+            _shardedRegistration:
+                register against a random SeatShard with seats left,
+                    so registrations do not contend on one entity group.
+                See also: _shardRegistration, _scheduleSeatFold
+            _refreshSeats:
+                set seatsAvailable of sharded conferences
+                    to the sum across their shards
+                See also: _shardedSeats
+            _foldSeatShards:
+                copy the sum across the shards to Conference.seatsAvailable,
+                    so datastore queries and the announcement see it
+            _conferenceVersion:
+                return the cache version of a conference.
+                getConference caches its response under this version
+            _invalidateConference:
+                bump the cache version of a conference after a write,
+                    so cached responses of older versions are never read.
+                Also bumps the version of the cached query results
+            _invalidateConferences:
+                bump the cache versions of many conferences at once
+            _invalidateOrganizer:
+                bump the cache versions of the conferences of an organizer,
+                    whose cached responses hold their display name
             _getQuery: retrieve data from database using formatted filters.
-                See also: _formatFilters
+                Inequality filters on more than one field are split
+                    between the datastore and memory by the query planner.
+                See also: _formatFilters, planner.planQuery,
+                    planner.compileFilters
+            _fetchPage: fetch a single page of a query with ndb cursors,
+                applying the in-memory filters while streaming.
+            _queryCacheKey: memcache key of a queryConferences page,
+                built from the sorted, typed filters, the page
+                    and the version of the cached query results
             _formatFilters:
                 Format multiple filters into a list of python dictionary.
                 The method _getQuery takes this return list.
+            _formatDateRange:
+                turn the date range of a query into the weeks it covers,
+                    matched against Conference.weeks by the datastore,
+                    and an exact overlap check applied in memory
+                    along with the filters of the query
             _copyConferenceToForm:
                 convert data from database into Conference form message
+                with the copier serializers.conferenceToForm
+            _copyConferenceToSummaryForm:
+                convert a (projected) conference
+                    into Conference summary form message
             _createConferenceObject:
                 convert data from inbound from message,
                     so it fits in conference model.
                     Create a new conference entity
+            _createConferenceObjects:
+                validate all inbound messages, then create their entities
+                    with one ID allocation and batched writes and tasks.
+                See also: _conferenceData
             _updateConferenceObject:
                 convert data from inbound from message,
                     so it fits in conference model.
                     Update the given conference entity
+            _trackNearlySoldOut:
+                add or remove a conference from the NearlySoldOut set
+                    when its seats change, and rebuild the announcement.
+                Called by registration, updates and _foldSeatShards
+            _conferenceFacets, _facetDelta, _applyFacetDelta:
+                add the changes of the facet values of created
+                    and updated conferences to a random FacetCounts shard
+            _rebuildFacetCounts:
+                recount the facets with projection queries;
+                    used by the cron job to repair drift
             _cacheAnnouncement:
                 return an announcement of available seats are less then five.
+                Used by the cron job to check the NearlySoldOut set
+                    against the datastore
     """
 
     # - - - - API endpoints - - - - - - - - - - - - - - - - - - - - - - - - - -
@@ -120,15 +232,34 @@ class ConferenceApi(remote.Service):
                       http_method='GET', name='getConference')
     def getConference(self, request):
         """Return requested conference (by websafeConferenceKey)."""
+        wsck = request.websafeConferenceKey
+        # read the version before the datastore, so a response built
+        #     from an entity older than a concurrent write is stored
+        #     under a version which is already outdated
+        version = self._conferenceVersion(wsck)
+        cache_key = MEMCACHE_CONFERENCE_KEY % (wsck, version)
+        if version is not None:
+            cached = memcache.get(cache_key)
+            if cached:
+                return protojson.decode_message(ConferenceForm, cached)
+
         # get Conference object from request; bail if not found
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
+        conf = ndb.Key(urlsafe=wsck).get()
         if not conf:
             raise endpoints.NotFoundException(
-                'No conference found with key: %s'
-                % request.websafeConferenceKey)
+                'No conference found with key: %s' % wsck)
         prof = conf.key.parent().get()
+        self._refreshSeats([conf])
+        cf = self._copyConferenceToForm(conf,
+                                        getattr(prof, 'displayName', None))
+
+        # an organizer without a Profile gets a display name when it is
+        #     created, which doesn't outdate the cached responses
+        if version is not None and prof:
+            memcache.set(cache_key, protojson.encode_message(cf),
+                         time=CONFERENCE_CACHE_TTL)
         # return ConferenceForm
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        return cf
 
     @endpoints.method(ConferenceForm, ConferenceForm,
                       path='conference',
@@ -137,6 +268,14 @@ class ConferenceApi(remote.Service):
         """Create new conference."""
         return self._createConferenceObject(request)
 
+    @endpoints.method(ConferenceForms, ConferenceForms,
+                      path='conferences',
+                      http_method='POST', name='createConferences')
+    def createConferences(self, request):
+        """Create new conferences in one batch."""
+        return ConferenceForms(
+            items=self._createConferenceObjects(request.items))
+
     @endpoints.method(CONF_POST_REQUEST, ConferenceForm,
                       path='conference/{websafeConferenceKey}',
                       http_method='PUT', name='updateConference')
@@ -148,60 +287,109 @@ class ConferenceApi(remote.Service):
                       path='queryConferences',
                       http_method='POST', name='queryConferences')
     def queryConferences(self, request):
-        """Query for conferences."""
-        conferences = self._getQuery(request)
-
-        # return individual ConferenceForm object per Conference
+        """Query for conferences, one page at a time."""
+        return self._cachedQueryPage(request, ConferenceForms)
+
+    @endpoints.method(SearchForm, ConferenceForms,
+                      path='searchConferences',
+                      http_method='POST', name='searchConferences')
+    def searchConferences(self, request):
+        """Search conference names and descriptions, best matches first."""
+        keys, next_token = search('Conference', request.query or '',
+                                  request.pageSize, request.pageToken)
+        conferences = [conf for conf in ndb.get_multi(keys) if conf]
+        self._refreshSeats(conferences)
         return ConferenceForms(
             items=[self._copyConferenceToForm(conf, "")
-                   for conf in conferences]
+                   for conf in conferences],
+            nextPageToken=next_token
         )
 
+    @endpoints.method(ConferenceQueryForms, ConferenceSummaryForms,
+                      path='queryConferences/summary',
+                      http_method='POST', name='queryConferenceSummaries')
+    def queryConferenceSummaries(self, request):
+        """Query for conference summaries, one page at a time."""
+        return self._cachedQueryPage(request, ConferenceSummaryForms)
+
+    @endpoints.method(message_types.VoidMessage, CacheStatsMessage,
+                      path='queryConferences/cacheStats',
+                      http_method='GET', name='getQueryCacheStats')
+    def getQueryCacheStats(self, request):
+        """Return hit and miss counters of the queryConferences cache."""
+        stats = memcache.get_multi([MEMCACHE_QUERY_HITS_KEY,
+                                    MEMCACHE_QUERY_MISSES_KEY])
+        return CacheStatsMessage(
+            hits=int(stats.get(MEMCACHE_QUERY_HITS_KEY, 0)),
+            misses=int(stats.get(MEMCACHE_QUERY_MISSES_KEY, 0)))
+
     @endpoints.method(message_types.VoidMessage, ConferenceForms,
                       path='getConferencesCreated',
                       http_method='GET', name='getConferencesCreated')
     def getConferencesCreated(self, request):
         """Get a list of conference which the current user has created"""
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-        p_key = ndb.Key(Profile, getUserId(user))
-        conferences = Conference.query(ancestor=p_key)
-        prof = p_key.get()
-        displayName = getattr(prof, 'displayName')
+        context = currentContext()
+        p_key = context.profileKey
+        prof_future = context.getProfileAsync()
+        conferences = Conference.query(ancestor=p_key).fetch()
+        self._refreshSeats(conferences)
+        displayName = getattr(prof_future.get_result(), 'displayName')
 
         return ConferenceForms(
             items=[self._copyConferenceToForm(conf, displayName)
                    for conf in conferences]
         )
 
+    @endpoints.method(message_types.VoidMessage, ConferenceSummaryForms,
+                      path='getConferencesCreated/summary',
+                      http_method='GET', name='getConferenceSummariesCreated')
+    def getConferenceSummariesCreated(self, request):
+        """Get summaries of the conferences the current user has created"""
+        context = currentContext()
+        p_key = context.profileKey
+        prof_future = context.getProfileAsync()
+        try:
+            conferences = Conference.query(
+                ancestor=p_key,
+                projection=self._summaryProjection([], [])).fetch()
+        except datastore_errors.NeedIndexError:
+            # no index serves the projection; read whole entities
+            conferences = Conference.query(ancestor=p_key).fetch()
+        seats = self._shardedSeats(conferences)
+        displayName = getattr(prof_future.get_result(), 'displayName')
+
+        return ConferenceSummaryForms(
+            items=[self._copyConferenceToSummaryForm(conf, displayName, seats)
+                   for conf in conferences]
+        )
+
     @endpoints.method(message_types.VoidMessage, ConferenceForms,
                       path='conferences/attending',
                       http_method='GET', name='getConferencesToAttend')
     def getConferencesToAttend(self, request):
         """Get list of conferences that user has registered for."""
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-        prof = getProfileFromUser(user)
-
-        conf_keys = [ndb.Key(urlsafe=wsck)
-                     for wsck in prof.conferenceKeysToAttend]
-        conferences = ndb.get_multi(conf_keys)
-
-        # get organizers
-        organisers = [ndb.Key(Profile, conf.organizerUserId)
-                      for conf in conferences]
-        profiles = ndb.get_multi(organisers)
-
-        # put display names in a dict for easier fetching
-        names = {}
-        for profile in profiles:
-            names[profile.key.id()] = profile.displayName
+        conferences, names = self._conferencesToAttendAsync().get_result()
+        self._refreshSeats(conferences)
 
         # return set of ConferenceForm objects per Conference
         return ConferenceForms(items=[
-            self._copyConferenceToForm(conf, names[conf.organizerUserId])
+            self._copyConferenceToForm(conf, names.get(conf.organizerUserId))
+            for conf in conferences
+            ])
+
+    @endpoints.method(message_types.VoidMessage, ConferenceSummaryForms,
+                      path='conferences/attending/summary',
+                      http_method='GET', name='getConferenceSummariesToAttend')
+    def getConferenceSummariesToAttend(self, request):
+        """Get summaries of the conferences the user has registered for."""
+        # conferences are read by key, which projection cannot do;
+        #     the summary still trims the response
+        conferences, names = self._conferencesToAttendAsync().get_result()
+        seats = self._shardedSeats(conferences)
+
+        return ConferenceSummaryForms(items=[
+            self._copyConferenceToSummaryForm(
+                conf, names.get(conf.organizerUserId), seats)
             for conf in conferences
             ])
 
@@ -219,25 +407,125 @@ class ConferenceApi(remote.Service):
         """Unregister user for selected conference."""
         return self._conferenceRegistration(request, reg=False)
 
+    @endpoints.method(message_types.VoidMessage, ConferenceFacetsForm,
+                      path='conferences/facets',
+                      http_method='GET', name='getConferenceFacets')
+    def getConferenceFacets(self, request):
+        """Return the number of conferences by city, topic and month."""
+        counts = memcache.get(MEMCACHE_FACETS_KEY)
+        if counts is None:
+            counts = self._sumFacetCounts()
+            memcache.add(MEMCACHE_FACETS_KEY, counts, time=FACET_CACHE_TTL)
+        # most common values first
+        return ConferenceFacetsForm(**dict(
+            (field, [FacetCount(value=value, count=count)
+                     for value, count in sorted(
+                         counts.get(field, {}).items(),
+                         key=lambda item: (-item[1], item[0]))])
+            for field in FACET_FIELDS))
+
     @endpoints.method(message_types.VoidMessage, StringMessage,
                       path='conference/announcement/get',
                       http_method='GET', name='getAnnouncement')
     def getAnnouncement(self, request):
         """Return Announcement from memcache."""
-        # return an existing announcement from Memcache or an empty string.
+        # return an existing announcement from Memcache,
+        #     or rebuild it from the NearlySoldOut set if evicted
         announcement = memcache.get(MEMCACHE_ANNOUNCEMENTS_KEY)
+        if announcement is None:
+            nearly = NearlySoldOut.get_by_id(NEARLY_SOLD_OUT_ID)
+            announcement = self._setAnnouncement(
+                nearly.conferences.values() if nearly else [])
         return StringMessage(data=announcement)
     # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
     # - - - - Helper methods - - - - - - - - - - - - - - - - - - - - - -
-    @ndb.transactional(xg=True)
+    @ndb.tasklet
+    def _conferencesToAttendAsync(self):
+        """Return a future of the conferences the current user
+            has registered for, and the display names of their organizers
+            by user id."""
+        prof = yield currentContext().getProfileAsync()
+
+        conf_keys = [ndb.Key(urlsafe=wsck)
+                     for wsck in prof.conferenceKeysToAttend]
+        # organizers are the parents of the conference keys,
+        #     so they are read together with the conferences
+        organisers = list(set(c_key.parent() for c_key in conf_keys))
+        results = yield (ndb.get_multi_async(conf_keys) +
+                         ndb.get_multi_async(organisers))
+        conferences = [conf for conf in results[:len(conf_keys)] if conf]
+
+        # put display names in a dict for easier fetching
+        names = {}
+        for profile in results[len(conf_keys):]:
+            if profile:
+                names[profile.key.id()] = profile.displayName
+        raise ndb.Return((conferences, names))
+
+    def _cachedQueryPage(self, request, message_type):
+        """
+        Return a page of queryConferences results, cached in memcache
+        :param request: ConferenceQueryForms
+        :param message_type: ConferenceForms,
+            or ConferenceSummaryForms for summaries
+        :return: message_type message
+        """
+        cache_key = self._queryCacheKey(request, message_type)
+        if cache_key:
+            cached = memcache.get(cache_key)
+            if cached:
+                memcache.incr(MEMCACHE_QUERY_HITS_KEY, initial_value=0)
+                return protojson.decode_message(message_type, cached)
+            memcache.incr(MEMCACHE_QUERY_MISSES_KEY, initial_value=0)
+
+        if message_type is ConferenceSummaryForms:
+            result = self._querySummaryPage(request)
+        else:
+            query, memory_filters = self._getQuery(request)
+            conferences, next_token = self._fetchPage(
+                query, request.pageSize, request.pageToken, memory_filters)
+            self._refreshSeats(conferences)
+
+            # return individual ConferenceForm object per Conference
+            result = ConferenceForms(
+                items=[self._copyConferenceToForm(conf, "")
+                       for conf in conferences],
+                nextPageToken=next_token
+            )
+        if cache_key:
+            memcache.set(cache_key, protojson.encode_message(result),
+                         time=QUERY_CACHE_TTL)
+        return result
+
+    def _querySummaryPage(self, request):
+        """Return a page of conference summaries,
+            read with a projection query where an index serves it."""
+        try:
+            query, memory_filters = self._getQuery(request, summary=True)
+            conferences, next_token = self._fetchPage(
+                query, request.pageSize, request.pageToken, memory_filters)
+        except datastore_errors.NeedIndexError:
+            # no index serves the projection; read whole entities
+            query, memory_filters = self._getQuery(request)
+            conferences, next_token = self._fetchPage(
+                query, request.pageSize, request.pageToken, memory_filters)
+        seats = self._shardedSeats(conferences)
+
+        # projection cannot return fields filtered by equality,
+        #     their values are the filter values
+        equality = dict((filtr["field"], filtr["value"])
+                        for filtr in self._formatFilters(request.filters)
+                        if filtr["operator"] == "=")
+        return ConferenceSummaryForms(
+            items=[self._copyConferenceToSummaryForm(
+                conf, "", seats, equality) for conf in conferences],
+            nextPageToken=next_token
+        )
+
     def _conferenceRegistration(self, request, reg=True):
         """Register or unregister user for selected conference."""
-        retval = None
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-        prof = getProfileFromUser(user)
+        currentContext().requireUser()
 
         # check if conf exists given websafeConfKey
         # get conference; check that it exists
@@ -247,6 +535,27 @@ class ConferenceApi(remote.Service):
             raise endpoints.NotFoundException(
                 'No conference found with key: %s' % wsck)
 
+        if conf.seatShards:
+            # the seat count is summed up by _foldSeatShards,
+            #     which also tracks the nearly sold out set
+            retval = self._shardedRegistration(conf, reg)
+        else:
+            retval, seats = self._entityRegistration(wsck, reg)
+            if retval:
+                self._trackNearlySoldOut(conf.key, conf.name, seats)
+        if retval:
+            self._invalidateConference(wsck)
+        return BooleanMessage(data=retval)
+
+    @ndb.transactional(xg=True)
+    def _entityRegistration(self, wsck, reg):
+        """Register or unregister user,
+            keeping the seats on the Conference entity.
+        Return the result and the seats left."""
+        retval = None
+        prof = currentContext().reloadProfile()
+        conf = ndb.Key(urlsafe=wsck).get()
+
         # register
         if reg:
             # check if user already registered otherwise add
@@ -279,12 +588,150 @@ class ConferenceApi(remote.Service):
         # write things back to the datastore & return
         prof.put()
         conf.put()
-        return BooleanMessage(data=retval)
+        return retval, conf.seatsAvailable
 
-    def _getQuery(self, request):
-        """Return formatted query from the submitted filters."""
-        q = Conference.query()
-        inequality_filter, filters = self._formatFilters(request.filters)
+    def _shardedRegistration(self, conf, reg):
+        """Register or unregister user,
+            keeping the seats on a random SeatShard of the conference."""
+        wsck = conf.key.urlsafe()
+        shard_keys = self._seatShardKeys(conf)
+        if reg:
+            # only try shards which still have seats left
+            shard_keys = [shard.key for shard in ndb.get_multi(shard_keys)
+                          if shard and shard.seatsAvailable > 0]
+        random.shuffle(shard_keys)
+
+        for s_key in shard_keys:
+            retval = self._shardRegistration(wsck, s_key, reg)
+            # None: the shard ran out of seats meanwhile, try the next one
+            if retval is not None:
+                if retval:
+                    self._scheduleSeatFold(wsck)
+                return retval
+        raise ConflictException(
+            "There are no seats available.")
+
+    @ndb.transactional(xg=True)
+    def _shardRegistration(self, wsck, s_key, reg):
+        """Register or unregister user against a single SeatShard.
+        Return None if the shard has no seats left to register with.
+        A shard never goes below zero, so the sum cannot oversell."""
+        prof = currentContext().reloadProfile()
+        shard = s_key.get() or SeatShard(key=s_key)
+
+        if reg:
+            if wsck in prof.conferenceKeysToAttend:
+                raise ConflictException(
+                    "You have already registered for this conference")
+            if shard.seatsAvailable <= 0:
+                return None
+            prof.conferenceKeysToAttend.append(wsck)
+            shard.seatsAvailable -= 1
+        else:
+            if wsck not in prof.conferenceKeysToAttend:
+                return False
+            prof.conferenceKeysToAttend.remove(wsck)
+            shard.seatsAvailable += 1
+
+        ndb.put_multi([prof, shard])
+        return True
+
+    @staticmethod
+    def _seatShardKeys(conf):
+        """Return the keys of the seat shards of the given conference."""
+        wsck = conf.key.urlsafe()
+        return [ndb.Key(SeatShard, '%s-%d' % (wsck, i))
+                for i in range(conf.seatShards or 0)]
+
+    @staticmethod
+    def _createSeatShards(conf):
+        """Split seatsAvailable of a new conference across its shards."""
+        if not conf.seatShards:
+            return []
+        seats, extra = divmod(conf.seatsAvailable or 0, conf.seatShards)
+        return [SeatShard(key=s_key,
+                          seatsAvailable=seats + (1 if i < extra else 0))
+                for i, s_key in enumerate(
+                    ConferenceApi._seatShardKeys(conf))]
+
+    @staticmethod
+    def _refreshSeats(conferences):
+        """Set seatsAvailable of sharded conferences
+            to the sum across their shards, with a single batch get."""
+        seats = ConferenceApi._shardedSeats(conferences)
+        for conf in conferences:
+            if conf and conf.key in seats:
+                conf.seatsAvailable = seats[conf.key]
+
+    @staticmethod
+    @ndb.non_transactional
+    def _shardedSeats(conferences):
+        """Return the sum across the shards of sharded conferences
+            by conference key, read with a single batch get."""
+        sharded = [conf for conf in conferences if conf and conf.seatShards]
+        if not sharded:
+            return {}
+        shard_keys = [ConferenceApi._seatShardKeys(conf) for conf in sharded]
+        shards = iter(ndb.get_multi([s_key for keys in shard_keys
+                                     for s_key in keys]))
+        return dict(
+            (conf.key, sum(getattr(next(shards), 'seatsAvailable', 0)
+                           for _ in keys))
+            for conf, keys in zip(sharded, shard_keys))
+
+    @staticmethod
+    def _scheduleSeatFold(wsck):
+        """Enqueue _foldSeatShards for the given conference,
+            at most once per SEAT_FOLD_INTERVAL."""
+        window = int(time.time()) // SEAT_FOLD_INTERVAL
+        try:
+            taskqueue.add(name='fold-seats-%s-%d' % (wsck, window),
+                          params={'websafeConferenceKey': wsck},
+                          url='/tasks/fold_seat_shards',
+                          countdown=SEAT_FOLD_INTERVAL)
+        except (taskqueue.TaskAlreadyExistsError,
+                taskqueue.TombstonedTaskError):
+            pass
+
+    @staticmethod
+    def _foldSeatShards(wsck):
+        """Copy the sharded seat count to Conference.seatsAvailable;
+        used by the fold_seat_shards task."""
+        c_key = ndb.Key(urlsafe=wsck)
+        conf = c_key.get()
+        if not conf or not conf.seatShards:
+            return
+        ConferenceApi._refreshSeats([conf])
+
+        @ndb.transactional()
+        def fold(seats):
+            conf = c_key.get()
+            conf.seatsAvailable = seats
+            conf.put()
+        fold(conf.seatsAvailable)
+        ConferenceApi._invalidateConference(wsck)
+        ConferenceApi._trackNearlySoldOut(
+            c_key, conf.name, conf.seatsAvailable)
+
+    def _getQuery(self, request, summary=False):
+        """Return formatted query from the submitted filters,
+            and the filters left to be applied in memory.
+        With summary, the query is projected on the summary fields
+            and on the fields of the in-memory filters."""
+        inequality_filter, filters, memory_filters = planQuery(
+            Conference, self._formatFilters(request.filters))
+        weeks, range_filters = self._formatDateRange(request)
+        if weeks:
+            # the weeks of a range are few, so the other filters are
+            #     applied in memory, and Conference(weeks, name) is the
+            #     only index date range queries need
+            memory_filters = filters + memory_filters
+            inequality_filter, filters = None, []
+        memory_filters.extend(range_filters)
+        projection = None
+        if summary and not weeks:
+            projection = self._summaryProjection(filters, memory_filters)
+        q = Conference.query(projection=projection)
 
         # If exists, sort on inequality filter first
         if not inequality_filter:
@@ -292,20 +739,113 @@ class ConferenceApi(remote.Service):
         else:
             q = q.order(ndb.GenericProperty(inequality_filter))
             q = q.order(Conference.name)
+        # key order makes the sort total, so page cursors are stable.
+        # Ascending key order is implicit in every index.
+        q = q.order(Conference.key)
 
         for filtr in filters:
-            if filtr["field"] in ["month", "maxAttendees"]:
-                filtr["value"] = int(filtr["value"])
             formatted_query = ndb.query.FilterNode(
                 filtr["field"], filtr["operator"], filtr["value"]
             )
             q = q.filter(formatted_query)
-        return q
+        if weeks:
+            # a conference overlapping the range runs in one of its weeks,
+            #     or is too long to index its weeks
+            q = q.filter(Conference.weeks.IN(weeks + [LONG_CONFERENCE_WEEK]))
+
+        recordQueryShape(
+            'Conference',
+            [f["field"] for f in filters if f["operator"] == "="] +
+            (['weeks'] if weeks else []),
+            inequality_filter,
+            [inequality_filter, 'name', '__key__'] + (projection or []))
+        return q, memory_filters
+
+    @staticmethod
+    def _summaryProjection(filters, memory_filters):
+        """
+        Return the fields a summary query projects on
+        :param filters: filters applied by the datastore
+        :param memory_filters: filters applied in memory
+        :return: sorted field names, or None if the in-memory filters
+            need a repeated field, which projection returns value by value,
+            or until CONF_SUMMARY_MIGRATION stored the fields
+            on every conference
+        """
+        state = MigrationState.get_by_id(CONF_SUMMARY_MIGRATION)
+        if not state or state.status != 'done':
+            return None
+        if any(Conference._properties[filtr["field"]]._repeated
+               for filtr in memory_filters):
+            return None
+        # the datastore refuses projecting fields filtered by equality
+        equality = set(filtr["field"] for filtr in filters
+                       if filtr["operator"] == "=")
+        fields = set(CONF_SUMMARY_FIELDS) - equality
+        fields.update(filtr["field"] for filtr in memory_filters)
+        return sorted(fields)
+
+    @staticmethod
+    def _fetchPage(query, page_size, page_token, memory_filters=None):
+        """
+        Fetch one page of the given query
+        :param query: ndb query to be paged
+        :param page_size: number of entities per page, defaults to
+            DEFAULT_PAGE_SIZE and is capped at MAX_PAGE_SIZE
+        :param page_token: websafe cursor returned with the previous page
+        :param memory_filters: filters the datastore could not apply
+        :return: (list of entities, websafe cursor of the next page or None)
+        """
+        page_size = ConferenceApi._pageSize(page_size)
+        try:
+            cursor = Cursor(urlsafe=page_token) if page_token else None
+            if memory_filters:
+                entities, next_cursor, more = fetchFilteredPage(
+                    query, page_size, cursor,
+                    compileFilters(Conference, memory_filters))
+            else:
+                entities, next_cursor, more = query.fetch_page(
+                    page_size, start_cursor=cursor)
+        except (datastore_errors.BadValueError,
+                datastore_errors.BadRequestError):
+            raise endpoints.BadRequestException("Invalid page token.")
+
+        if more and next_cursor:
+            return entities, next_cursor.urlsafe()
+        return entities, None
+
+    @staticmethod
+    def _pageSize(page_size):
+        """Return the requested page size, defaulted and capped."""
+        if not page_size or page_size < 0:
+            return DEFAULT_PAGE_SIZE
+        return min(page_size, MAX_PAGE_SIZE)
+
+    def _queryCacheKey(self, request, message_type):
+        """
+        Return the memcache key of the requested queryConferences page
+        :param request: ConferenceQueryForms
+        :param message_type: message class of the cached response
+        :return: key built from the normalized filters, page size,
+            page token and query cache version, or None without memcache
+        """
+        version = self._cacheVersion(MEMCACHE_QUERY_VERSION_KEY)
+        if version is None:
+            return None
+        # equal filter sets in any order share one cache entry
+        filters = self._formatFilters(request.filters)
+        canonical = sorted(set((filtr["field"], filtr["operator"],
+                                filtr["value"]) for filtr in filters))
+        digest = hashlib.md5(repr((
+            message_type.__name__, canonical,
+            self._pageSize(request.pageSize), request.pageToken,
+            self._formatDateRange(request)
+        ))).hexdigest()
+        return MEMCACHE_QUERY_KEY % (version, digest)
 
     def _formatFilters(self, filters):
         """Parse, check validity and format user supplied filters."""
         formatted_filters = []
-        inequality_field = None
 
         for f in filters:
             filtr = {field.name: getattr(f, field.name)
@@ -313,55 +853,169 @@ class ConferenceApi(remote.Service):
             try:
                 filtr["field"] = CONF_FIELDS[filtr["field"]]
                 filtr["operator"] = OPERATORS[filtr["operator"]]
-            except KeyError:
+                if filtr["field"] in ["month", "maxAttendees"]:
+                    filtr["value"] = int(filtr["value"])
+            except (KeyError, ValueError, TypeError):
                 raise endpoints.BadRequestException(
-                    "Filter contains invalid field or operator.")
-
-            # Every operation except "=" is an inequality
-            if filtr["operator"] != "=":
-                # check if inequality operation
-                #     has been used in previous filters
-                # disallow the filter if inequality was
-                #     performed on a different field before
-                # track the field on which
-                #     the inequality operation is performed
-                if inequality_field\
-                        and inequality_field != filtr["field"]:
-                    raise endpoints.BadRequestException(
-                        "Inequality filter is allowed on only one field.")
-                else:
-                    inequality_field = filtr["field"]
+                    "Filter contains invalid field, operator or value.")
 
             formatted_filters.append(filtr)
-        return (inequality_field, formatted_filters)
+        return formatted_filters
+
+    @staticmethod
+    def _formatDateRange(request):
+        """
+        Parse the date range of a query
+        :param request: ConferenceQueryForms; a range missing one end
+            is a single day
+        :return: (weeks the range covers, or None without a range,
+            in-memory filters keeping the conferences which overlap it)
+        """
+        if not request.fromDate and not request.toDate:
+            return None, []
+        try:
+            from_date = datetime.strptime(
+                (request.fromDate or request.toDate)[:10], "%Y-%m-%d").date()
+            to_date = datetime.strptime(
+                (request.toDate or request.fromDate)[:10], "%Y-%m-%d").date()
+        except ValueError:
+            raise endpoints.BadRequestException(
+                "Dates must be formatted as YYYY-MM-DD")
+        if to_date < from_date:
+            raise endpoints.BadRequestException(
+                "'toDate' must not be before 'fromDate'")
+        weeks = range(weekOf(from_date), weekOf(to_date) + 1)
+        if len(weeks) > MAX_RANGE_WEEKS:
+            raise endpoints.BadRequestException(
+                "Date ranges can cover at most %d weeks" % MAX_RANGE_WEEKS)
+        return weeks, [
+            {"field": "startDate", "operator": "<=", "value": to_date},
+            {"field": "lastDay", "operator": ">=",
+             "value": from_date.toordinal()},
+        ]
     # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
     # - - - Conference objects - - - - - - - - - - - - - - - - - - - - -
     def _copyConferenceToForm(self, conf, displayName):
         """Copy relevant fields from Conference to ConferenceForm."""
-        cf = ConferenceForm()
-        for field in cf.all_fields():
-            if hasattr(conf, field.name):
-                # convert Date to date string; just copy others
-                if field.name.endswith('Date'):
-                    setattr(cf, field.name, str(getattr(conf, field.name)))
-                else:
-                    setattr(cf, field.name, getattr(conf, field.name))
-            elif field.name == "websafeKey":
-                setattr(cf, field.name, conf.key.urlsafe())
+        # See also: serializers.conferenceToForm
+        cf = conferenceToForm(conf)
+        cf.websafeKey = conf.key.urlsafe()
         if displayName:
-            setattr(cf, 'organizerDisplayName', displayName)
+            cf.organizerDisplayName = displayName
         cf.check_initialized()
         return cf
 
+    def _copyConferenceToSummaryForm(self, conf, displayName, seats,
+                                     defaults=None):
+        """
+        Copy summary fields from Conference to ConferenceSummaryForm
+        :param conf: Conference, possibly projected on CONF_SUMMARY_FIELDS
+        :param displayName: organizer display name
+        :param seats: seats of sharded conferences, see _shardedSeats
+        :param defaults: values of fields the projection left out
+        :return: ConferenceSummaryForm
+        """
+        defaults = defaults or {}
+        sf = ConferenceSummaryForm()
+        for field in sf.all_fields():
+            if field.name == "websafeKey":
+                sf.websafeKey = conf.key.urlsafe()
+            elif field.name == "organizerDisplayName":
+                sf.organizerDisplayName = displayName or None
+            elif field.name == "seatsAvailable" and conf.key in seats:
+                sf.seatsAvailable = seats[conf.key]
+            else:
+                if field.name in defaults:
+                    value = defaults[field.name]
+                else:
+                    value = getattr(conf, field.name)
+                # convert Date to date string; just copy others
+                if field.name.endswith('Date') and value:
+                    value = str(value)
+                setattr(sf, field.name, value)
+        return sf
+
     def _createConferenceObject(self, request):
-        """Create or update Conference object,
+        """Create Conference object,
             returning ConferenceForm/request."""
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-        user_id = getUserId(user)
+        return self._createConferenceObjects([request])[0]
 
+    def _createConferenceObjects(self, requests):
+        """
+        Create Conference objects in batch
+        Every request is validated before anything is written;
+            then the IDs are allocated in one call, the entities are
+            written in chunks of PUT_BATCH_SIZE, and the confirmation
+            tasks are enqueued in batches of MAX_TASKS_PER_ADD.
+        :param requests: list of ConferenceForm
+        :return: list of (modified) ConferenceForm/requests
+        """
+        context = currentContext()
+        user_id = context.userId
+        if not requests:
+            return []
+        if len(requests) > MAX_CREATE_BATCH:
+            raise endpoints.BadRequestException(
+                "At most %d conferences can be created at once"
+                % MAX_CREATE_BATCH)
+
+        data_list = []
+        for i, request in enumerate(requests):
+            try:
+                data_list.append(self._conferenceData(request))
+            except endpoints.BadRequestException as e:
+                if len(requests) == 1:
+                    raise
+                raise endpoints.BadRequestException(
+                    'Conference %d: %s' % (i, e))
+
+        # Profile Key of the current user
+        p_key = context.profileKey
+        # allocate new Conference IDs with Profile key as parent
+        first, last = Conference.allocate_ids(size=len(requests),
+                                              parent=p_key)
+
+        # create Conferences (and their seat shards)
+        entities = []
+        conferences = []
+        for c_id, request, data in zip(range(first, last + 1),
+                                       requests, data_list):
+            # make Conference key from ID
+            data['key'] = ndb.Key(Conference, c_id, parent=p_key)
+            data['organizerUserId'] = request.organizerUserId = user_id
+            request.websafeKey = data['key'].urlsafe()
+            conf = Conference(**data)
+            conferences.append(conf)
+            entities.append(conf)
+            entities.extend(self._createSeatShards(conf))
+            entities.extend(postingsFor(conf))
+        for i in range(0, len(entities), PUT_BATCH_SIZE):
+            ndb.put_multi(entities[i:i + PUT_BATCH_SIZE])
+        self._invalidateConference()
+        self._applyFacetDelta(self._facetDelta(
+            [], [self._conferenceFacets(conf) for conf in conferences]))
+
+        # confirmations are sent as one digest per organizer,
+        #     tagged tasks let the digest job lease them together;
+        #     the email is kept for organizers without a Profile yet
+        email = context.requireUser().email()
+        tasks = [taskqueue.Task(
+                     payload=json.dumps({'websafeKey': request.websafeKey,
+                                         'email': email}),
+                     method='PULL', tag=user_id)
+                 for request in requests]
+        queue = taskqueue.Queue(CONFIRMATION_QUEUE)
+        for i in range(0, len(tasks), taskqueue.MAX_TASKS_PER_ADD):
+            queue.add(tasks[i:i + taskqueue.MAX_TASKS_PER_ADD])
+
+        # return (modified) ConferenceForms
+        return requests
+
+    def _conferenceData(self, request):
+        """Validate a ConferenceForm of a new conference,
+            returning the Conference fields as a dict.
+        Missing fields of the request are set to their defaults."""
         if not request.name:
             raise endpoints.BadRequestException(
                 "Conference 'name' field required")
@@ -370,6 +1024,7 @@ class ConferenceApi(remote.Service):
         data = {field.name: getattr(request, field.name)
                 for field in request.all_fields()}
         del data['organizerDisplayName']
+        del data['websafeKey']
 
         # add default values for those missing
         #     (both data model & outbound Message)
@@ -380,15 +1035,19 @@ class ConferenceApi(remote.Service):
 
         # convert dates from strings to Date objects;
         #     set month based on start_date
-        if data['startDate']:
-            data['startDate'] = datetime.strptime(
-                data['startDate'][:10], "%Y-%m-%d").date()
-            data['month'] = data['startDate'].month
-        else:
-            data['month'] = 0
-        if data['endDate']:
-            data['endDate'] = datetime.strptime(
-                data['endDate'][:10], "%Y-%m-%d").date()
+        try:
+            if data['startDate']:
+                data['startDate'] = datetime.strptime(
+                    data['startDate'][:10], "%Y-%m-%d").date()
+                data['month'] = data['startDate'].month
+            else:
+                data['month'] = 0
+            if data['endDate']:
+                data['endDate'] = datetime.strptime(
+                    data['endDate'][:10], "%Y-%m-%d").date()
+        except ValueError:
+            raise endpoints.BadRequestException(
+                "Dates must be formatted as YYYY-MM-DD")
 
         # set seatsAvailable to be same as maxAttendees on creation
         # both for data model & outbound Message
@@ -396,30 +1055,33 @@ class ConferenceApi(remote.Service):
             data["seatsAvailable"] = data["maxAttendees"]
             setattr(request, "seatsAvailable", data["maxAttendees"])
 
-        # make Profile Key from user ID
-        p_key = ndb.Key(Profile, user_id)
-        # allocate new Conference ID with Profile key as parent
-        c_id = Conference.allocate_ids(size=1, parent=p_key)[0]
-        # make Conference key from ID
-        c_key = ndb.Key(Conference, c_id, parent=p_key)
-        data['key'] = c_key
-        data['organizerUserId'] = request.organizerUserId = user_id
-
-        # create Conference & return (modified) ConferenceForm
-        Conference(**data).put()
-        taskqueue.add(params={'email': user.email(),
-                              'conferenceInfo': repr(request)},
-                      url='/tasks/send_confirmation_email'
-                      )
-        return request
+        if not 0 <= data["seatShards"] <= MAX_SEAT_SHARDS:
+            raise endpoints.BadRequestException(
+                "'seatShards' must be between 0 and %d" % MAX_SEAT_SHARDS)
+        return data
 
-    @ndb.transactional()
     def _updateConferenceObject(self, request):
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-        user_id = getUserId(user)
+        """Update Conference object, returning ConferenceForm."""
+        context = currentContext()
+        # start reading the Profile while the update runs
+        prof_future = context.getProfileAsync()
+
+        conf, old_facets = self._updateConferenceEntity(request,
+                                                        context.userId)
+        # invalidate after the commit, so the cache cannot be refilled
+        #     with the entity as it was before the update
+        self._invalidateConference(request.websafeConferenceKey)
+        self._refreshSeats([conf])
+        self._trackNearlySoldOut(conf.key, conf.name, conf.seatsAvailable)
+        self._applyFacetDelta(self._facetDelta(
+            [old_facets], [self._conferenceFacets(conf)]))
+        return self._copyConferenceToForm(
+            conf, getattr(prof_future.get_result(), 'displayName'))
 
+    @ndb.transactional()
+    def _updateConferenceEntity(self, request, user_id):
+        """Copy the provided fields of the request to the Conference.
+        Return the Conference and its facet values before the update."""
         # copy ConferenceForm/ProtoRPC Message into dict
         data = {field.name: getattr(request, field.name)
                 for field in request.all_fields()}
@@ -436,10 +1098,16 @@ class ConferenceApi(remote.Service):
         if user_id != conf.organizerUserId:
             raise endpoints.ForbiddenException(
                 'Only the owner can update the conference.')
+        old_facets = self._conferenceFacets(conf)
 
         # Not getting all the fields, so don't create a new object; just
         # copy relevant fields from ConferenceForm to Conference object
         for field in request.all_fields():
+            # the seats of a sharded conference live in its shards,
+            #     which are only changed by registration
+            if field.name in ('seatShards', 'websafeKey') or (
+                    field.name == 'seatsAvailable' and conf.seatShards):
+                continue
             data = getattr(request, field.name)
             # only copy fields where we get data
             if data not in (None, []):
@@ -451,31 +1119,228 @@ class ConferenceApi(remote.Service):
                 # write to Conference object
                 setattr(conf, field.name, data)
         conf.put()
-        prof = ndb.Key(Profile, user_id).get()
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        reindex(conf)
+        return conf, old_facets
 
     @staticmethod
-    def _cacheAnnouncement():
-        """Create Announcement & assign to memcache; used by
-        memcache cron job & putAnnouncement().
+    def _conferenceVersion(wsck):
+        """Return the cache version of the given conference,
+            or None if memcache is unavailable."""
+        return ConferenceApi._cacheVersion(
+            MEMCACHE_CONFERENCE_VERSION_KEY % wsck)
+
+    @staticmethod
+    def _cacheVersion(version_key):
+        """Return the version stored under the given memcache key,
+            or None if memcache is unavailable."""
+        version = memcache.get(version_key)
+        if version is None:
+            # start from the clock, so an evicted version counter
+            #     does not bring back entries cached before the eviction
+            memcache.add(version_key, int(time.time() * 1000))
+            version = memcache.get(version_key)
+        return version
+
+    @staticmethod
+    def _invalidateConference(wsck=None):
+        """Outdate cached responses of the given conference
+            and all cached query results."""
+        if wsck:
+            memcache.incr(MEMCACHE_CONFERENCE_VERSION_KEY % wsck)
+        memcache.incr(MEMCACHE_QUERY_VERSION_KEY)
+
+    @staticmethod
+    def _invalidateConferences(c_keys):
+        """Outdate cached responses of the given conference keys,
+            bumping their versions in a single call."""
+        memcache.offset_multi(dict(
+            (MEMCACHE_CONFERENCE_VERSION_KEY % c_key.urlsafe(), 1)
+            for c_key in c_keys))
+
+    @staticmethod
+    def _invalidateOrganizer(p_key):
+        """Outdate cached responses of the conferences organized by
+            the given Profile key, after their display name changed."""
+        ConferenceApi._invalidateConferences(
+            Conference.query(ancestor=p_key).iter(keys_only=True))
+
+    @staticmethod
+    def _trackNearlySoldOut(conf_key, name, seats):
         """
-        confs = Conference.query(ndb.AND(
-            Conference.seatsAvailable <= 5,
-            Conference.seatsAvailable > 0)
-        ).fetch(projection=[Conference.name])
+        Keep the NearlySoldOut set and the announcement up to date
+        The set is only written when the conference enters or leaves it,
+            or is renamed while in it.
+        :param conf_key: Conference key
+        :param name: Conference name
+        :param seats: seats available after the change
+        """
+        wsck = conf_key.urlsafe()
+        if not 0 < seats <= NEARLY_SOLD_OUT_SEATS:
+            name = None
+        nearly = NearlySoldOut.get_by_id(NEARLY_SOLD_OUT_ID)
+        if (nearly.conferences if nearly else {}).get(wsck) == name:
+            return
+
+        @ndb.transactional()
+        def update():
+            nearly = (NearlySoldOut.get_by_id(NEARLY_SOLD_OUT_ID) or
+                      NearlySoldOut(id=NEARLY_SOLD_OUT_ID))
+            conferences = dict(nearly.conferences or {})
+            if name:
+                conferences[wsck] = name
+            else:
+                conferences.pop(wsck, None)
+            nearly.conferences = conferences
+            nearly.put()
+            return conferences
+        ConferenceApi._setAnnouncement(update().values())
 
-        if confs:
+    @staticmethod
+    def _setAnnouncement(names):
+        """Format the announcement of the nearly sold out conferences
+            with the given names, and assign it to memcache."""
+        if names:
             # If there are almost sold out conferences,
             # format announcement and set it in memcache
             announcement = '%s %s' % (
                 'Last chance to attend! The following conferences '
                 'are nearly sold out:',
-                ', '.join(conf.name for conf in confs))
-            memcache.set(MEMCACHE_ANNOUNCEMENTS_KEY, announcement)
+                ', '.join(sorted(names)))
         else:
-            # If there are no sold out conferences,
-            # delete the memcache announcements entry
             announcement = ""
-            memcache.delete(MEMCACHE_ANNOUNCEMENTS_KEY)
-
+        memcache.set(MEMCACHE_ANNOUNCEMENTS_KEY, announcement)
         return announcement
+
+    @staticmethod
+    def _conferenceFacets(conf):
+        """Return the facet values of a conference: {field: set of values}"""
+        facets = {}
+        for field in FACET_FIELDS:
+            value = getattr(conf, field)
+            values = value if isinstance(value, list) else [value]
+            facets[field] = set(unicode(v) for v in values if v)
+        return facets
+
+    @staticmethod
+    def _facetDelta(old_facets, new_facets):
+        """
+        Return the count changes of replacing conferences
+        :param old_facets: facet values of the conferences before
+        :param new_facets: facet values of the conferences after
+        :return: {field: {value: change}}, without zero changes
+        """
+        delta = {}
+        for sign, facets_list in ((-1, old_facets), (1, new_facets)):
+            for facets in facets_list:
+                for field, values in facets.items():
+                    changes = delta.setdefault(field, {})
+                    for value in values:
+                        changes[value] = changes.get(value, 0) + sign
+        return dict((field, dict((v, c) for v, c in changes.items() if c))
+                    for field, changes in delta.items()
+                    if any(changes.values()))
+
+    @staticmethod
+    def _applyFacetDelta(delta):
+        """Add count changes to a random FacetCounts shard,
+            so concurrent writes rarely contend on one entity."""
+        if not delta:
+            return
+
+        @ndb.transactional()
+        def apply():
+            f_key = ndb.Key(FacetCounts,
+                            'shard-%d' % random.randrange(FACET_SHARDS))
+            shard = f_key.get() or FacetCounts(key=f_key)
+            # copied, as a new shard would otherwise change the default
+            all_counts = dict(shard.counts or {})
+            for field, changes in delta.items():
+                counts = all_counts[field] = dict(all_counts.get(field, {}))
+                for value, change in changes.items():
+                    counts[value] = counts.get(value, 0) + change
+                    if not counts[value]:
+                        del counts[value]
+            shard.counts = all_counts
+            shard.put()
+        apply()
+        memcache.delete(MEMCACHE_FACETS_KEY)
+
+    @staticmethod
+    def _sumFacetCounts():
+        """Return the counts of all FacetCounts shards summed up:
+            {field: {value: count}}"""
+        totals = {}
+        for shard in ndb.get_multi([
+                ndb.Key(FacetCounts, 'shard-%d' % i)
+                for i in range(FACET_SHARDS)]):
+            for field, counts in (shard.counts if shard else {}).items():
+                field_totals = totals.setdefault(field, {})
+                for value, count in counts.items():
+                    field_totals[value] = field_totals.get(value, 0) + count
+        return dict((field, dict((v, c) for v, c in counts.items() if c > 0))
+                    for field, counts in totals.items())
+
+    @staticmethod
+    def _rebuildFacetCounts():
+        """Recount the facets of all conferences with projection queries,
+            reading indexes only; used by the rebuild_facet_counts cron job.
+        Return the number of values whose count was off."""
+        totals = {}
+        for field in FACET_FIELDS:
+            counts = totals[field] = {}
+            prop = Conference._properties[field]
+            # projecting a repeated property yields one entity per value
+            for conf in Conference.query().iter(projection=[prop],
+                                                batch_size=1000):
+                value = getattr(conf, field)
+                if isinstance(value, list):
+                    value = value[0]
+                if value:
+                    value = unicode(value)
+                    counts[value] = counts.get(value, 0) + 1
+
+        current = ConferenceApi._sumFacetCounts()
+        drift = 0
+        for field in FACET_FIELDS:
+            counts = current.get(field, {})
+            drift += sum(1 for value in set(totals[field]) | set(counts)
+                         if totals[field].get(value) != counts.get(value))
+        if not drift:
+            return 0
+        logging.warning('Facet counts off for %d values, rebuilding', drift)
+
+        @ndb.transactional(xg=True)
+        def rebuild():
+            shards = [FacetCounts(id='shard-%d' % i,
+                                  counts=totals if i == 0 else {})
+                      for i in range(FACET_SHARDS)]
+            ndb.put_multi(shards)
+        rebuild()
+        memcache.delete(MEMCACHE_FACETS_KEY)
+        return drift
+
+    @staticmethod
+    def _cacheAnnouncement():
+        """Create Announcement & assign to memcache; used by
+        memcache cron job to check the NearlySoldOut set,
+            which _trackNearlySoldOut keeps up to date.
+        """
+        confs = Conference.query(ndb.AND(
+            Conference.seatsAvailable <= NEARLY_SOLD_OUT_SEATS,
+            Conference.seatsAvailable > 0)
+        ).fetch(projection=[Conference.name])
+        conferences = dict((conf.key.urlsafe(), conf.name) for conf in confs)
+
+        @ndb.transactional()
+        def check():
+            nearly = (NearlySoldOut.get_by_id(NEARLY_SOLD_OUT_ID) or
+                      NearlySoldOut(id=NEARLY_SOLD_OUT_ID))
+            if nearly.conferences != conferences:
+                logging.warning(
+                    'NearlySoldOut set out of date: %r, expected %r',
+                    nearly.conferences, conferences)
+                nearly.conferences = conferences
+                nearly.put()
+        check()
+
+        return ConferenceApi._setAnnouncement(conferences.values())
@@ -8,8 +8,72 @@ DEFAULTS = {
     "maxAttendees": 0,
     "seatsAvailable": 0,
     "topics": ["Default", "Topic"],
+    "seatShards": 0,
 }
 
+# Conferences with at most this many seats left are nearly sold out
+NEARLY_SOLD_OUT_SEATS = 5
+# Key id of the NearlySoldOut entity
+NEARLY_SOLD_OUT_ID = 'default'
+
+# Upper bound of seat counter shards per conference
+MAX_SEAT_SHARDS = 50
+# Seconds between copies of the sharded seat count
+#     to Conference.seatsAvailable
+SEAT_FOLD_INTERVAL = 10
+
+# Conferences index the weeks they run in, up to this many weeks;
+#     longer conferences index LONG_CONFERENCE_WEEK instead
+MAX_CONFERENCE_WEEKS = 53
+LONG_CONFERENCE_WEEK = -1
+# Upper bound of the weeks a date range query covers,
+#     the datastore takes at most 30 values per IN filter
+MAX_RANGE_WEEKS = 26
+
+# Searchable fields and the weight of their tokens, by kind
+SEARCH_FIELDS = {
+    'Conference': {'name': 3, 'description': 1},
+    'Session': {'name': 3, 'highlights': 1},
+}
+# Words which are neither indexed nor searched
+SEARCH_STOP_WORDS = frozenset([
+    'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'in', 'is',
+    'it', 'of', 'on', 'or', 'the', 'to', 'with',
+])
+# Terms of a search query which are looked up
+MAX_SEARCH_TERMS = 5
+# Postings read per search term, heaviest first
+MAX_POSTINGS_PER_TERM = 1000
+# Postings read per prefix term, which come in token order;
+#     the heaviest MAX_POSTINGS_PER_TERM of them are kept
+MAX_POSTINGS_PER_PREFIX = 5000
+# Tokens indexed per entity, heaviest first
+MAX_TOKENS_PER_DOCUMENT = 200
+
+# Speakers returned by autocompleteSpeakers, by default and at most
+DEFAULT_SPEAKER_SUGGESTIONS = 10
+MAX_SPEAKER_SUGGESTIONS = 50
+
+# Conference fields counted by getConferenceFacets
+FACET_FIELDS = ['city', 'topics', 'month']
+# Number of FacetCounts shards, at most 24 so a rebuild fits
+#     in one cross-group transaction
+FACET_SHARDS = 5
+# Seconds the summed facet counts are kept in memcache
+FACET_CACHE_TTL = 600
+
+# Seconds a cached conference response is kept in memcache
+CONFERENCE_CACHE_TTL = 600
+# Seconds a cached conference schedule is kept in memcache
+SCHEDULE_CACHE_TTL = 600
+# Seconds the featured speakers of a conference are kept in memcache
+FEATURED_SPEAKERS_CACHE_TTL = 3600
+# Attempts at a compare-and-set update of the featured speakers
+#     before dropping the entry, for the next read to rebuild it
+FEATURED_SPEAKERS_CAS_RETRIES = 5
+# Seconds a cached queryConferences page is kept in memcache
+QUERY_CACHE_TTL = 300
+
 # Convert operators from front-end/api form to SQL operators
 OPERATORS = {
     'EQ': '=',
@@ -28,6 +92,22 @@ CONF_FIELDS = {
     'MAX_ATTENDEES': 'maxAttendees',
 }
 
+# Fields of Conference read by the summary endpoints with projection queries
+# Sorted, so the projection matches the order of the index.yaml indexes
+CONF_SUMMARY_FIELDS = [
+    'city',
+    'endDate',
+    'maxAttendees',
+    'name',
+    'seatShards',
+    'seatsAvailable',
+    'startDate',
+]
+# Projection queries skip entities missing a projected field, such as
+#     seatShards on conferences created before it; they are used once
+#     this migration stored every field on every conference
+CONF_SUMMARY_MIGRATION = 'backfill_conference_seat_shards'
+
 # Convert field names from front-end/api to fields in Data model
 SESSION_FIELDS = {
     'NAME': 'name',
@@ -49,5 +129,59 @@ OPERATOR_LOOKUP = {
     '=': operator.eq
 }
 
+# Page sizes for cursor based pagination of list endpoints
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+# Selectivity of an inequality filter on a field without statistics,
+#     as a fraction of the entities of the kind
+DEFAULT_SELECTIVITY = {
+    '>': 1.0 / 3,
+    '>=': 1.0 / 3,
+    '<': 1.0 / 3,
+    '<=': 1.0 / 3,
+    '!=': 0.9,
+    '=': 0.1
+}
+# Number of values sampled per field for the planner statistics
+STATS_SAMPLE_SIZE = 1000
+# Seconds an instance keeps planner statistics before reloading them
+STATS_CACHE_TTL = 600
+# Upper bound of entities scanned for one page of in-memory filtered results
+MAX_SCANNED_PER_PAGE = 1000
+
+# Conferences created by one createConferences request
+MAX_CREATE_BATCH = 500
+# Entities written by one put_multi call
+PUT_BATCH_SIZE = 500
+
+# Entities exported per request of /admin/export
+EXPORT_CHUNK_SIZE = 500
+
+# Entities read per migration task
+MIGRATION_BATCH_SIZE = 200
+# Upper bound of the entities written per second by a migration
+MIGRATION_WRITES_PER_SECOND = 50
+# Push queue of the migration tasks
+MIGRATION_QUEUE = 'migrations'
+
+# Pull queue of the conference creation confirmations
+CONFIRMATION_QUEUE = 'confirmation-emails'
+# Seconds a digest has to be sent before its tasks are leased again
+CONFIRMATION_LEASE_SECONDS = 300
+# Confirmations leased at once, the most one digest lists
+CONFIRMATION_LEASE_MAX_TASKS = 1000
+# Seconds one run of the digest cron job keeps leasing
+CONFIRMATION_RUN_SECONDS = 240
+
+# Verified ID tokens kept per instance
+TOKEN_CACHE_SIZE = 1000
+# Seconds of clock skew allowed on the exp and iat claims of ID tokens
+TOKEN_CLOCK_SKEW = 300
+# Seconds before the signing keys expire when they get refreshed
+CERTS_REFRESH_MARGIN = 600
+# Seconds the signing keys are kept without a Cache-Control max-age
+DEFAULT_CERTS_MAX_AGE = 3600
+
 EMAIL_SCOPE = endpoints.EMAIL_SCOPE
 API_EXPLORER_CLIENT_ID = endpoints.API_EXPLORER_CLIENT_ID
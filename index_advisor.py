@@ -0,0 +1,347 @@
+#!/usr/bin/env python
+
+"""
+index_advisor.py
+Check the query shapes of the APIs against the composite indexes
+    in index.yaml.
+
+A query shape is the kind, whether the query has an ancestor,
+    the set of fields with equality filters, and the fields that follow
+    them in the index: the inequality field, then the sort orders
+    and the projected fields.
+
+Offline mode lists the fixed queries of the APIs, and the shapes
+    ConferenceApi._getQuery and SessionApi._getQuery emit with filters
+    on at most OFFLINE_MAX_FIELDS fields; --all lists every
+    combination of filters instead:
+        python index_advisor.py [--all] [path/to/index.yaml]
+Runtime mode reports the shapes recorded while RECORD_QUERY_SHAPES
+    is set in settings.py, served at /admin/index_advisor.
+    Its missing indexes are ranked by the recorded queries they serve.
+
+The report lists missing indexes, indexes no shape uses,
+    and the extra write operations each composite index costs per entity.
+"""
+
+import hashlib
+import itertools
+import os
+
+import yaml
+from google.appengine.api import memcache
+
+from core import CONF_FIELDS, CONF_SUMMARY_FIELDS, DEFAULTS, SESSION_FIELDS
+from models.conference import Conference
+from models.session import Session
+from models.stats import QueryShapeRecord
+from settings import MEMCACHE_QUERY_SHAPE_KEY, RECORD_QUERY_SHAPES
+
+
+INDEX_YAML = os.path.join(os.path.dirname(__file__), 'index.yaml')
+
+# Models whose query shapes are checked, by kind
+MODELS = {
+    'Conference': Conference,
+    'Session': Session,
+}
+
+# Shapes of the queries which do not go through _getQuery:
+#     (kind, ancestor, equality fields, inequality field, orders)
+FIXED_QUERY_SHAPES = [
+    # ConferenceApi._cacheAnnouncement, projected on name
+    ('Conference', False, [], 'seatsAvailable', ['name']),
+    # ConferenceApi.getConferencesCreated
+    ('Conference', True, [], None, []),
+    # ConferenceApi.getConferenceSummariesCreated
+    ('Conference', True, [], None, CONF_SUMMARY_FIELDS),
+    # ConferenceApi.queryConferenceSummaries without filters
+    ('Conference', False, [], None, ['name', '__key__'] + CONF_SUMMARY_FIELDS),
+    # SessionApi._conferenceSchedule
+    ('Session', True, [], None, []),
+    # SessionApi._cacheFeaturedSpeaker
+    ('Session', True, ['speaker'], None, []),
+    # SessionApi.autocompleteSpeakers, a key range
+    ('Speaker', False, [], '__key__', []),
+    # SessionApi.getSessionsInWishlist
+    ('WishlistEntry', True, [], None, []),
+    # search.search, by exact token and by prefix
+    ('SearchPosting', False, ['kind', 'token'], None, ['-weight']),
+    ('SearchPosting', False, ['kind'], 'token', ['token', '-weight']),
+]
+
+# Average number of values of repeated fields, for write cost estimates
+REPEATED_VALUES = {
+    'topics': len(DEFAULTS['topics']),
+    # a conference of a few days often crosses into a second week
+    'weeks': 2,
+}
+
+# Fields filtered by the user in the _getQuery shapes listed offline:
+#     every combination of filters would need hundreds of indexes,
+#     the runtime report ranks the combinations actually queried
+OFFLINE_MAX_FIELDS = 1
+
+
+def queryShape(kind, equality, inequality=None, orders=(), ancestor=False):
+    """
+    Normalize a query into its shape
+    :param kind: entity kind
+    :param equality: fields with equality filters
+    :param inequality: field with inequality filters, or None
+    :param orders: sort orders and projected fields, in order;
+        descending orders start with -
+    :param ancestor: True for ancestor queries
+    :return: (kind, ancestor, sorted equality fields, postfix fields)
+    """
+    equality = tuple(sorted(set(equality)))
+    postfix = []
+    for field in ([inequality] if inequality else []) + list(orders):
+        # sorting on an equality field or on the key is free
+        if (not field or field in equality or field in postfix or
+                field == '__key__'):
+            continue
+        postfix.append(field)
+    return (kind, bool(ancestor), equality, tuple(postfix))
+
+
+def requiredIndex(shape):
+    """Return the composite index the shape needs, in index.yaml form,
+        or None if the built-in indexes serve it."""
+    kind, ancestor, equality, postfix = shape
+    # equality filters only are merge-joined over single field indexes
+    if not postfix:
+        return None
+    # a single field filtered by inequality or sorted on
+    if not ancestor and not equality and len(postfix) == 1:
+        return None
+    properties = []
+    for f in equality + postfix:
+        if f.startswith('-'):
+            properties.append({'name': f[1:], 'direction': 'desc'})
+        else:
+            properties.append({'name': f})
+    index = {'kind': kind, 'properties': properties}
+    if ancestor:
+        index['ancestor'] = True
+    return index
+
+
+def indexServes(index, shape):
+    """Return True if the index of index.yaml can serve the shape."""
+    kind, ancestor, equality, postfix = shape
+    if index['kind'] != kind or bool(index.get('ancestor')) != ancestor:
+        return False
+    names = [('-' if p.get('direction') == 'desc' else '') + p['name']
+             for p in index.get('properties', [])]
+    return (len(names) == len(equality) + len(postfix) and
+            set(names[:len(equality)]) == set(equality) and
+            tuple(names[len(equality):]) == postfix)
+
+
+def loadIndexes(path=INDEX_YAML):
+    """Return the composite indexes declared in index.yaml."""
+    with open(path) as f:
+        return (yaml.safe_load(f) or {}).get('indexes') or []
+
+
+def conferenceQueryShapes(max_fields=None):
+    """Return the shapes ConferenceApi._getQuery can emit with filters
+        on at most max_fields fields, any number for None;
+        date range queries filter weeks only, the rest in memory."""
+    shapes = _getQueryShapes('Conference', CONF_FIELDS.values(),
+                             ['name', '__key__'], max_fields)
+    shapes.add(queryShape('Conference', ['weeks'], None,
+                          ['name', '__key__']))
+    return shapes
+
+
+def sessionQueryShapes(max_fields=None):
+    """Return the shapes SessionApi._getQuery can emit with filters
+        on at most max_fields fields, any number for None."""
+    return _getQueryShapes('Session', SESSION_FIELDS.values(), ['name'],
+                           max_fields=max_fields)
+
+
+def _getQueryShapes(kind, fields, orders, max_fields=None):
+    """Shapes of _getQuery: any set of equality fields, at most one
+        inequality field sorted on first, then the given orders,
+        filtering at most max_fields fields."""
+    shapes = set()
+    fields = sorted(fields)
+    if max_fields is None:
+        max_fields = len(fields)
+    for n in range(min(max_fields, len(fields)) + 1):
+        for equality in itertools.combinations(fields, n):
+            for inequality in [None] + fields:
+                if (inequality and inequality not in equality and
+                        n == max_fields):
+                    continue
+                shapes.add(queryShape(
+                    kind, equality, inequality,
+                    ([inequality] if inequality else []) + orders))
+    return shapes
+
+
+def staticQueryShapes(max_fields=OFFLINE_MAX_FIELDS):
+    """Return the query shapes of the APIs known offline,
+        see conferenceQueryShapes for max_fields."""
+    shapes = (conferenceQueryShapes(max_fields) |
+              sessionQueryShapes(max_fields))
+    for kind, ancestor, equality, inequality, orders in FIXED_QUERY_SHAPES:
+        shapes.add(queryShape(kind, equality, inequality, orders, ancestor))
+    return shapes
+
+
+def writeCost(index):
+    """
+    Estimate the extra write operations of a composite index per entity
+    A composite index has one row per combination of values
+        of its repeated fields.
+    :return: (index rows, write ops on insert, write ops on update)
+    """
+    model = MODELS.get(index['kind'])
+    rows = 1
+    for p in index.get('properties', []):
+        prop = model and model._properties.get(p['name'])
+        if prop is not None and prop._repeated:
+            rows *= REPEATED_VALUES.get(p['name'], 1)
+    # a new row is one write, an update deletes the old row and writes anew
+    return rows, rows, 2 * rows
+
+
+def adviseIndexes(shapes, indexes, counts=None):
+    """
+    Match query shapes against indexes
+    :param shapes: iterable of query shapes
+    :param indexes: indexes of index.yaml
+    :param counts: dict of shape: number of queries recorded, or None
+    :return: dict with
+        - missing: composite indexes needed by a shape but not declared,
+            with counts by the most queries first
+        - queries: number of queries recorded for each missing index,
+            or None without counts
+        - used: declared indexes serving at least one shape
+        - redundant: declared indexes serving no shape
+    """
+    missing = []
+    queries = []
+    used = []
+    for shape in sorted(shapes):
+        required = requiredIndex(shape)
+        if required is None:
+            continue
+        serving = [index for index in indexes if indexServes(index, shape)]
+        for index in serving:
+            if index not in used:
+                used.append(index)
+        if serving:
+            continue
+        # one missing index may serve several shapes
+        count = (counts or {}).get(shape, 0)
+        for i, index in enumerate(missing):
+            if indexServes(index, shape):
+                queries[i] += count
+                break
+        else:
+            missing.append(required)
+            queries.append(count)
+    if counts is not None:
+        ranked = sorted(zip(queries, missing), key=lambda r: -r[0])
+        queries = [count for count, index in ranked]
+        missing = [index for count, index in ranked]
+    return {
+        'missing': missing,
+        'queries': queries if counts is not None else None,
+        'used': used,
+        'redundant': [index for index in indexes if index not in used],
+    }
+
+
+def formatReport(report):
+    """Format the result of adviseIndexes as plain text."""
+    def fmt(index):
+        return '%s(%s%s)' % (
+            index['kind'], 'ancestor, ' if index.get('ancestor') else '',
+            ', '.join(('-' if p.get('direction') == 'desc' else '') +
+                      p['name'] for p in index.get('properties', [])))
+
+    def cost(index):
+        rows, insert, update = writeCost(index)
+        return ('%s\n      rows/entity: %d, extra write ops: '
+                '%d on insert, %d on update' %
+                (fmt(index), rows, insert, update))
+
+    lines = ['Missing indexes (%d):' % len(report['missing'])]
+    if report.get('queries') is None:
+        lines.extend('  - ' + cost(index) for index in report['missing'])
+    else:
+        lines.extend('  - %s\n      recorded queries: %d' % (cost(index),
+                                                              count)
+                     for index, count in zip(report['missing'],
+                                             report['queries']))
+    lines.append('Used indexes (%d):' % len(report['used']))
+    lines.extend('  - ' + cost(index) for index in report['used'])
+    lines.append('Redundant indexes (%d):' % len(report['redundant']))
+    lines.extend('  - ' + cost(index) for index in report['redundant'])
+    return '\n'.join(lines)
+
+
+def recordQueryShape(kind, equality, inequality=None, orders=(),
+                     ancestor=False):
+    """Record a query shape seen at runtime, if RECORD_QUERY_SHAPES is set.
+    Costs one memcache increment per query,
+        and one datastore write the first time a shape is seen."""
+    if not RECORD_QUERY_SHAPES:
+        return
+    shape = queryShape(kind, equality, inequality, orders, ancestor)
+    shape_id = hashlib.md5(repr(shape)).hexdigest()
+    if memcache.incr(MEMCACHE_QUERY_SHAPE_KEY % shape_id,
+                     initial_value=0) == 1:
+        QueryShapeRecord.get_or_insert(
+            shape_id, kind=kind, ancestor=shape[1],
+            equality=list(shape[2]), postfix=list(shape[3]))
+
+
+def recordedQueryShapes():
+    """Return the recorded query shapes with their counts in memcache."""
+    records = QueryShapeRecord.query().fetch()
+    counts = memcache.get_multi([MEMCACHE_QUERY_SHAPE_KEY % r.key.id()
+                                 for r in records])
+    return [((r.kind, r.ancestor, tuple(r.equality), tuple(r.postfix)),
+             int(counts.get(MEMCACHE_QUERY_SHAPE_KEY % r.key.id(), 0)))
+            for r in records]
+
+
+def staticReport(path=INDEX_YAML, max_fields=OFFLINE_MAX_FIELDS):
+    """Return the report of the query shapes known offline.
+    Missing indexes are listed for the shapes filtering at most
+        max_fields fields, but any shape of the APIs uses an index."""
+    indexes = loadIndexes(path)
+    report = adviseIndexes(staticQueryShapes(None), indexes)
+    if max_fields is not None:
+        report['missing'] = adviseIndexes(staticQueryShapes(max_fields),
+                                          indexes)['missing']
+    return formatReport(report)
+
+
+def runtimeReport():
+    """Return the report of the query shapes recorded in production."""
+    recorded = recordedQueryShapes()
+    report = adviseIndexes([shape for shape, count in recorded],
+                           loadIndexes(), dict(recorded))
+    lines = ['Recorded query shapes (%d):' % len(recorded)]
+    for (kind, ancestor, equality, postfix), count in sorted(
+            recorded, key=lambda r: -r[1]):
+        lines.append('  - %s ancestor=%s eq=%s then=%s: %d queries' % (
+            kind, ancestor, ','.join(equality), ','.join(postfix), count))
+    return '\n'.join(lines) + '\n' + formatReport(report)
+
+
+if __name__ == '__main__':
+    import sys
+    args = sys.argv[1:]
+    max_fields = OFFLINE_MAX_FIELDS
+    if '--all' in args:
+        args.remove('--all')
+        max_fields = None
+    print(staticReport(*args[:1], max_fields=max_fields))
@@ -1,13 +1,30 @@
 #!/usr/bin/env python
+import json
+import logging
+import time
+
 import webapp2
 from google.appengine.api import app_identity
 from google.appengine.api import mail
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+from backup import exportChunk, importLines, MODELS as BACKUP_MODELS
 from conference import ConferenceApi
+from core import CONF_FIELDS, SESSION_FIELDS, CONFIRMATION_QUEUE,\
+    CONFIRMATION_LEASE_SECONDS, CONFIRMATION_LEASE_MAX_TASKS,\
+    CONFIRMATION_RUN_SECONDS
+from index_advisor import runtimeReport
+from migrations import MIGRATIONS, runBatch, progressReport,\
+    startMigration, resumeMigration, stopMigration
+from models.conference import Conference
+from models.session import Session
+from planner import analyzeFieldStats
+from tokens import refreshSigningCerts
 
 
 class SetAnnouncementHandler(webapp2.RequestHandler):
     def get(self):
-        """Set Announcement in Memcache."""
+        """Check the nearly sold out set & set Announcement in Memcache."""
         # use _cacheAnnouncement() to set announcement in Memcache
         announcement = ConferenceApi._cacheAnnouncement()
         if announcement:
@@ -18,9 +35,182 @@ class SetAnnouncementHandler(webapp2.RequestHandler):
                 "<html><body><p>Delete</p></body></html>")
 
 
+class RebuildFacetCountsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Recount the conference facets & repair the FacetCounts."""
+        drift = ConferenceApi._rebuildFacetCounts()
+        return self.response.write(
+            "<html><body><p>Repaired %d counts</p></body></html>" % drift)
+
+
+class AnalyzeQueryStatsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Recompute the value statistics used by the query planner."""
+        analyzeFieldStats(Conference, CONF_FIELDS.values())
+        analyzeFieldStats(Session, SESSION_FIELDS.values())
+        return self.response.write(
+            "<html><body><p>Success</p></body></html>")
+
+
+class IndexAdvisorHandler(webapp2.RequestHandler):
+    def get(self):
+        """Report the recorded query shapes against index.yaml."""
+        self.response.headers['Content-Type'] = 'text/plain'
+        return self.response.write(runtimeReport())
+
+
+class RefreshSigningCertsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Fetch the signing keys used to verify ID tokens."""
+        refreshSigningCerts()
+        return self.response.write(
+            "<html><body><p>Success</p></body></html>")
+
+    def post(self):
+        """Fetch the signing keys, when requests found them expiring."""
+        refreshSigningCerts()
+
+
+class ExportHandler(webapp2.RequestHandler):
+    def get(self):
+        """Export a chunk of entities of a kind as JSON Lines.
+        The cursor of the next chunk is in the X-Next-Cursor header."""
+        kind = self.request.get('kind')
+        if kind not in BACKUP_MODELS:
+            self.response.set_status(400)
+            return self.response.write(
+                'kind must be one of %s' % ', '.join(sorted(BACKUP_MODELS)))
+        lines, next_cursor = exportChunk(kind,
+                                         self.request.get('cursor') or None)
+        self.response.headers['Content-Type'] = 'application/x-ndjson'
+        if next_cursor:
+            self.response.headers['X-Next-Cursor'] = next_cursor
+        for line in lines:
+            self.response.write(line)
+
+
+class ImportHandler(webapp2.RequestHandler):
+    def post(self):
+        """Import the entities of the JSON Lines in the request body."""
+        counts = importLines(self.request.body_file)
+        self.response.headers['Content-Type'] = 'text/plain'
+        return self.response.write('\n'.join(
+            '%s: %d' % (kind, counts[kind]) for kind in sorted(counts)))
+
+
+class MigrationsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Report the progress and throughput of the migrations."""
+        self.response.headers['Content-Type'] = 'text/plain'
+        return self.response.write(progressReport())
+
+    def post(self):
+        """Start, resume or stop the migration of the given name."""
+        name = self.request.get('name')
+        action = {
+            'start': startMigration,
+            'resume': resumeMigration,
+            'stop': stopMigration,
+        }.get(self.request.get('action'))
+        self.response.headers['Content-Type'] = 'text/plain'
+        if name not in MIGRATIONS or not action:
+            self.response.set_status(400)
+            return self.response.write(
+                'name must be one of %s, action one of start, resume, stop'
+                % ', '.join(sorted(MIGRATIONS)))
+        try:
+            action(name)
+        except ValueError as e:
+            self.response.set_status(409)
+            return self.response.write(str(e))
+        return self.response.write(progressReport())
+
+
+class MigrateHandler(webapp2.RequestHandler):
+    def post(self):
+        """Migrate one batch and chain the next one."""
+        runBatch(self.request.get('name'),
+                 int(self.request.get('runId')),
+                 int(self.request.get('batch')))
+
+
+class SendConfirmationDigestsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Send one email per organizer confirming the Conferences
+            created since the last run."""
+        queue = taskqueue.Queue(CONFIRMATION_QUEUE)
+        deadline = time.time() + CONFIRMATION_RUN_SECONDS
+        digests = failed = 0
+        while time.time() < deadline:
+            # without a tag, the tasks leased share the tag of the oldest
+            #     available task, the user id of a single organizer
+            tasks = queue.lease_tasks_by_tag(CONFIRMATION_LEASE_SECONDS,
+                                             CONFIRMATION_LEASE_MAX_TASKS)
+            if not tasks:
+                break
+            try:
+                self._sendDigest(tasks)
+            except Exception:
+                # the tasks stay leased, so the next organizers' digests
+                #     are sent; a later run leases these ones again
+                logging.exception('Confirmation digest of %s failed',
+                                  tasks[0].tag)
+                failed += 1
+                continue
+            queue.delete_tasks(tasks)
+            digests += 1
+        return self.response.write(
+            "<html><body><p>Sent %d digests, %d failed</p></body></html>"
+            % (digests, failed))
+
+    def _sendDigest(self, tasks):
+        """Send the digest of the Conferences of the leased tasks,
+            whose payloads hold the websafe Conference key and the
+            email of the organizer."""
+        payloads = [self._confirmationPayload(task) for task in tasks]
+        conf_keys = [ndb.Key(urlsafe=payload['websafeKey'])
+                     for payload in payloads]
+        # the organizer is the parent of the conference keys
+        results = ndb.get_multi([conf_keys[0].parent()] + conf_keys)
+        prof = results[0]
+        conferences = [conf for conf in results[1:] if conf]
+        # organizers who never opened their profile have no Profile
+        email = (prof and prof.mainEmail or
+                 next((payload['email'] for payload in payloads
+                       if payload.get('email')), None))
+        if not email or not conferences:
+            return
+
+        if len(conferences) == 1:
+            subject = 'You created a new Conference!'
+        else:
+            subject = 'You created %d new Conferences!' % len(conferences)
+        lines = ['  - %s (%s, %s - %s)' % (
+            conf.name, conf.city or 'no city',
+            conf.startDate or 'no start date',
+            conf.endDate or 'no end date') for conf in conferences]
+        mail.send_mail(
+            'noreply@%s.appspotmail.com' % (
+                app_identity.get_application_id()),     # from
+            email,                                      # to
+            subject,                                    # subj
+            'Hi, you have created the following '       # body
+            'conferences:\r\n\r\n%s' % '\r\n'.join(lines)
+        )
+
+    @staticmethod
+    def _confirmationPayload(task):
+        """Return the payload of a confirmation task as a dict.
+        Tasks enqueued before the email was added hold the key only."""
+        if task.payload.startswith('{'):
+            return json.loads(task.payload)
+        return {'websafeKey': task.payload}
+
+
 class SendConfirmationEmailHandler(webapp2.RequestHandler):
     def post(self):
-        """Send email confirming Conference creation."""
+        """Send email confirming Conference creation.
+        Kept for the tasks enqueued before confirmations were digested."""
         mail.send_mail(
             'noreply@%s.appspotmail.com' % (
                 app_identity.get_application_id()),     # from
@@ -32,7 +222,25 @@ class SendConfirmationEmailHandler(webapp2.RequestHandler):
         )
 
 
+class FoldSeatShardsHandler(webapp2.RequestHandler):
+    def post(self):
+        """Copy sharded seat counts to Conference.seatsAvailable."""
+        ConferenceApi._foldSeatShards(
+            self.request.get('websafeConferenceKey'))
+
+
 app = webapp2.WSGIApplication([
     ('/crons/set_announcement', SetAnnouncementHandler),
+    ('/crons/analyze_query_stats', AnalyzeQueryStatsHandler),
+    ('/crons/rebuild_facet_counts', RebuildFacetCountsHandler),
+    ('/admin/index_advisor', IndexAdvisorHandler),
+    ('/admin/export', ExportHandler),
+    ('/admin/import', ImportHandler),
+    ('/admin/migrations', MigrationsHandler),
+    ('/crons/send_confirmation_digests', SendConfirmationDigestsHandler),
     ('/tasks/send_confirmation_email', SendConfirmationEmailHandler),
+    ('/tasks/fold_seat_shards', FoldSeatShardsHandler),
+    ('/tasks/migrate', MigrateHandler),
+    ('/crons/refresh_signing_certs', RefreshSigningCertsHandler),
+    ('/tasks/refresh_signing_certs', RefreshSigningCertsHandler),
 ], debug=True)
@@ -0,0 +1,261 @@
+"""
+migrations.py
+Background migrations of model changes.
+
+A migration walks all entities of a kind with query cursors,
+    MIGRATION_BATCH_SIZE entities per task, and writes the entities
+    its function changed. Each task checkpoints the cursor in
+    MigrationState, then chains the task of the next batch, delayed so
+    writes stay under MIGRATION_WRITES_PER_SECOND.
+A stopped or failed migration resumes from its last checkpoint.
+    Migration functions must be idempotent: a batch may run again
+    if its task fails before the checkpoint.
+
+Migrations of conferences outdate the cached responses of the
+    conferences each batch writes, and all cached query results
+    once they are done.
+Migrations are started, resumed and stopped by posting to
+    /admin/migrations with name and action; GET reports their progress.
+"""
+
+import logging
+from datetime import datetime
+
+from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+from conference import ConferenceApi
+from core import MIGRATION_BATCH_SIZE, MIGRATION_WRITES_PER_SECOND,\
+    MIGRATION_QUEUE, CONF_SUMMARY_FIELDS, CONF_SUMMARY_MIGRATION
+from models.conference import Conference
+from models.migration import MigrationState
+from models.profile import Profile
+from models.session import Session
+from models.wishlist import WishlistEntry, wishlistEntryId
+from search import reindex
+from session import SessionApi
+
+
+# Registered migrations: name: (model, function)
+MIGRATIONS = {}
+
+
+def migration(name, model):
+    """
+    Register a migration of the entities of the given model
+    The decorated function takes an entity and returns True
+        if it changed the entity, which then gets written.
+    """
+    def register(fn):
+        MIGRATIONS[name] = (model, fn)
+        return fn
+    return register
+
+
+def startMigration(name):
+    """Start a migration from the first entity, outdating running tasks."""
+    state = _startRun(name)
+    _enqueueBatch(name, state.runId, state.batches)
+    return state
+
+
+@ndb.transactional()
+def _startRun(name):
+    state = MigrationState.get_by_id(name)
+    run_id = state.runId + 1 if state else 1
+    state = MigrationState(id=name, runId=run_id)
+    state.put()
+    return state
+
+
+def resumeMigration(name):
+    """Resume a stopped or failed migration from its checkpoint.
+    A running one is resumed too, in case its chain of tasks broke:
+        the batch task is named, so a live chain is never doubled."""
+    state = _setStatus(name, 'running', ('running', 'stopped', 'failed'))
+    _enqueueBatch(name, state.runId, state.batches)
+    return state
+
+
+def stopMigration(name):
+    """Stop a migration after its current batch."""
+    return _setStatus(name, 'stopped', ('running',))
+
+
+@ndb.transactional()
+def _setStatus(name, status, from_statuses):
+    state = MigrationState.get_by_id(name)
+    if not state or state.status not in from_statuses:
+        raise ValueError('Migration %s is not %s' % (
+            name, ' or '.join(from_statuses)))
+    state.status = status
+    state.error = None
+    state.put()
+    return state
+
+
+def _enqueueBatch(name, run_id, batch, countdown=0):
+    """Enqueue a batch once, even if the task chaining it is retried."""
+    try:
+        taskqueue.add(name='migrate-%s-%d-%d' % (name, run_id, batch),
+                      url='/tasks/migrate',
+                      params={'name': name, 'runId': run_id, 'batch': batch},
+                      queue_name=MIGRATION_QUEUE,
+                      countdown=countdown)
+    except (taskqueue.TaskAlreadyExistsError,
+            taskqueue.TombstonedTaskError):
+        pass
+
+
+def runBatch(name, run_id, batch):
+    """
+    Migrate one batch and chain the next one
+    Used by the migrate task.
+    :param name: name of the migration
+    :param run_id: run of the migration the task belongs to
+    :param batch: number of the batch the task was enqueued for
+    """
+    state = MigrationState.get_by_id(name)
+    # a newer run, or a stop
+    if not state or state.runId != run_id or state.status != 'running':
+        return
+    # a batch already checkpointed, whose task is retried because
+    #     chaining the next batch failed: chain it again
+    if state.batches == batch + 1:
+        _enqueueBatch(name, run_id, state.batches)
+        return
+    if state.batches != batch:
+        return
+    model, fn = MIGRATIONS[name]
+
+    try:
+        entities, cursor, more = model.query().fetch_page(
+            MIGRATION_BATCH_SIZE,
+            start_cursor=Cursor(urlsafe=state.cursor) if state.cursor
+            else None)
+        changed = [entity for entity in entities if fn(entity)]
+        ndb.put_multi(changed)
+        if model is Conference:
+            ConferenceApi._invalidateConferences(
+                [conf.key for conf in changed])
+    except Exception as e:
+        logging.exception('Migration %s failed at batch %d', name, batch)
+        state.status = 'failed'
+        state.error = repr(e)
+        state.put()
+        return
+
+    state.cursor = cursor.urlsafe() if more and cursor else None
+    state.batches += 1
+    state.processed += len(entities)
+    state.updated += len(changed)
+    if not state.cursor:
+        state.status = 'done'
+    state.put()
+    if state.status == 'done' and model is Conference:
+        # cached query pages may hold conferences of any batch
+        ConferenceApi._invalidateConference()
+
+    if state.status == 'running':
+        _enqueueBatch(name, run_id, state.batches,
+                      countdown=float(len(changed)) /
+                      MIGRATION_WRITES_PER_SECOND)
+
+
+def progressReport():
+    """Return the progress and throughput of every migration as text."""
+    states = dict((state.key.id(), state)
+                  for state in MigrationState.query())
+    lines = []
+    for name in sorted(MIGRATIONS):
+        state = states.get(name)
+        if not state:
+            lines.append('%s: never started' % name)
+            continue
+        elapsed = ((state.lastBatch or datetime.now()) -
+                   state.started).total_seconds()
+        lines.append(
+            '%s: %s, run %d, %d batches, %d processed, %d updated, '
+            '%.1f entities/s%s' % (
+                name, state.status, state.runId, state.batches,
+                state.processed, state.updated,
+                state.processed / elapsed if elapsed > 0 else 0,
+                ', error: %s' % state.error if state.error else ''))
+    return '\n'.join(lines)
+
+
+# - - - - Migrations - - - - - - - - - - - - - - - - - - - - - - - -
+
+@migration('backfill_conference_month', Conference)
+def backfillConferenceMonth(conf):
+    """Set month from startDate, 0 without a start date."""
+    month = conf.startDate.month if conf.startDate else 0
+    if conf.month == month:
+        return False
+    conf.month = month
+    return True
+
+
+@migration('backfill_conference_weeks', Conference)
+def backfillConferenceWeeks(conf):
+    """Write conferences again, storing their computed interval index."""
+    return True
+
+
+@migration(CONF_SUMMARY_MIGRATION, Conference)
+def backfillConferenceSeatShards(conf):
+    """Store the summary fields missing from conferences created before
+        them, such as seatShards, so projection queries return them."""
+    return any(name not in conf._values for name in CONF_SUMMARY_FIELDS)
+
+
+@migration('index_conferences_for_search', Conference)
+def indexConferencesForSearch(conf):
+    """Write the search postings of conferences."""
+    reindex(conf)
+    return False
+
+
+@migration('index_sessions_for_search', Session)
+def indexSessionsForSearch(session):
+    """Write the search postings of sessions."""
+    reindex(session)
+    return False
+
+
+@migration('backfill_session_conference_key', Session)
+def backfillSessionConferenceKey(session):
+    """Set conferenceKeyBelongTo from the parent Conference key."""
+    wsck = session.key.parent().urlsafe() if session.key.parent() else None
+    if not wsck or session.conferenceKeyBelongTo == wsck:
+        return False
+    session.conferenceKeyBelongTo = wsck
+    return True
+
+
+@migration('backfill_session_duration', Session)
+def backfillSessionDuration(session):
+    """Write sessions again, storing their computed durationMinutes."""
+    return True
+
+
+@migration('index_speakers', Session)
+def indexSpeakers(session):
+    """Add sessions to the Speaker index of their speaker."""
+    if session.speaker:
+        SessionApi._indexSpeaker(session)
+    return False
+
+
+@migration('move_wishlists', Profile)
+def moveWishlists(prof):
+    """Move sessionKeysInWhishlist into WishlistEntry children."""
+    if not prof.sessionKeysInWhishlist:
+        return False
+    ndb.put_multi([
+        WishlistEntry(id=wishlistEntryId(ndb.Key(urlsafe=wssk)),
+                      parent=prof.key, sessionKey=wssk)
+        for wssk in prof.sessionKeysInWhishlist])
+    prof.sessionKeysInWhishlist = []
+    return True
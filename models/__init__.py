@@ -14,6 +14,12 @@ class BooleanMessage(messages.Message):
     data = messages.BooleanField(1)
 
 
+class CacheStatsMessage(messages.Message):
+    """CacheStatsMessage-- outbound cache hit/miss counters message"""
+    hits = messages.IntegerField(1)
+    misses = messages.IntegerField(2)
+
+
 class ConflictException(endpoints.ServiceException):
     """ConflictException -- exception mapped to HTTP 409 response"""
     http_status = httplib.CONFLICT
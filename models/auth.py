@@ -0,0 +1,8 @@
+from google.appengine.ext import ndb
+
+
+class SigningCerts(ndb.Model):
+    """SigningCerts -- Google's ID token signing keys,
+        RSA modulus and exponent by key id"""
+    keys = ndb.JsonProperty(default={})
+    expires = ndb.FloatProperty(default=0)
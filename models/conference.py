@@ -1,6 +1,25 @@
 from google.appengine.ext import ndb
 from protorpc import messages
 
+from core import MAX_CONFERENCE_WEEKS, LONG_CONFERENCE_WEEK
+
+
+def weekOf(date):
+    """Return the number of the week of a date, weeks start on Sunday:
+        the first day of the calendar, ordinal 1, is a Monday."""
+    return date.toordinal() // 7
+
+
+def conferenceWeeks(conf):
+    """Return the weeks a conference runs in, for date range queries."""
+    if not conf.startDate:
+        return []
+    first = weekOf(conf.startDate)
+    last = weekOf(conf.endDate or conf.startDate)
+    if last - first >= MAX_CONFERENCE_WEEKS:
+        return [LONG_CONFERENCE_WEEK]
+    return range(first, max(first, last) + 1)
+
 
 class Conference(ndb.Model):
     """Conference -- Conference object"""
@@ -14,6 +33,30 @@ class Conference(ndb.Model):
     endDate = ndb.DateProperty()
     maxAttendees = ndb.IntegerProperty()
     seatsAvailable = ndb.IntegerProperty()
+    seatShards = ndb.IntegerProperty(default=0)
+    # interval index of the dates the conference runs on:
+    #     weeks it runs in, and the ordinal of its last day
+    weeks = ndb.ComputedProperty(conferenceWeeks, repeated=True)
+    lastDay = ndb.ComputedProperty(
+        lambda self: (self.endDate or self.startDate).toordinal()
+        if self.startDate else None)
+
+
+class SeatShard(ndb.Model):
+    """SeatShard -- one shard of the available seats of a conference"""
+    seatsAvailable = ndb.IntegerProperty(default=0)
+
+
+class FacetCounts(ndb.Model):
+    """FacetCounts -- one shard of the conference counts
+        by field and value: {field: {value: count}}"""
+    counts = ndb.JsonProperty(default={})
+
+
+class NearlySoldOut(ndb.Model):
+    """NearlySoldOut -- the conferences with few seats left,
+        names by websafe conference key"""
+    conferences = ndb.JsonProperty(default={})
 
 
 class ConferenceForm(messages.Message):
@@ -29,11 +72,48 @@ class ConferenceForm(messages.Message):
     endDate = messages.StringField(9)
     organizerUserId = messages.StringField(10)
     organizerDisplayName = messages.StringField(11)
+    seatShards = messages.IntegerField(12)
+    websafeKey = messages.StringField(13)
 
 
 class ConferenceForms(messages.Message):
     """ConferenceForms -- multiple Conference outbound form message"""
     items = messages.MessageField(ConferenceForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
+
+
+class ConferenceSummaryForm(messages.Message):
+    """ConferenceSummaryForm
+        -- Conference outbound summary form message for conference lists"""
+    name = messages.StringField(1)
+    city = messages.StringField(2)
+    startDate = messages.StringField(3)
+    endDate = messages.StringField(4)
+    maxAttendees = messages.IntegerField(5)
+    seatsAvailable = messages.IntegerField(6)
+    organizerDisplayName = messages.StringField(7)
+    websafeKey = messages.StringField(8)
+
+
+class ConferenceSummaryForms(messages.Message):
+    """ConferenceSummaryForms
+        -- multiple ConferenceSummaryForm outbound form message"""
+    items = messages.MessageField(ConferenceSummaryForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
+
+
+class FacetCount(messages.Message):
+    """FacetCount -- number of conferences with a field value"""
+    value = messages.StringField(1)
+    count = messages.IntegerField(2)
+
+
+class ConferenceFacetsForm(messages.Message):
+    """ConferenceFacetsForm
+        -- conference counts by city, topic and month outbound message"""
+    city = messages.MessageField(FacetCount, 1, repeated=True)
+    topics = messages.MessageField(FacetCount, 2, repeated=True)
+    month = messages.MessageField(FacetCount, 3, repeated=True)
 
 
 class ConferenceQueryForm(messages.Message):
@@ -48,3 +128,7 @@ class ConferenceQueryForms(messages.Message):
     """ConferenceQueryForms
         -- multiple ConferenceQueryForm inbound form message"""
     filters = messages.MessageField(ConferenceQueryForm, 1, repeated=True)
+    pageSize = messages.IntegerField(2)
+    pageToken = messages.StringField(3)
+    fromDate = messages.StringField(4)
+    toDate = messages.StringField(5)
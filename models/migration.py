@@ -0,0 +1,15 @@
+from google.appengine.ext import ndb
+
+
+class MigrationState(ndb.Model):
+    """MigrationState -- checkpoint and progress of a migration run,
+        keyed by migration name"""
+    runId = ndb.IntegerProperty(default=0)
+    status = ndb.StringProperty(default='running')
+    cursor = ndb.StringProperty(indexed=False)
+    batches = ndb.IntegerProperty(default=0)
+    processed = ndb.IntegerProperty(default=0)
+    updated = ndb.IntegerProperty(default=0)
+    error = ndb.TextProperty()
+    started = ndb.DateTimeProperty(auto_now_add=True)
+    lastBatch = ndb.DateTimeProperty(auto_now=True)
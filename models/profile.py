@@ -9,6 +9,7 @@ class Profile(ndb.Model):
     mainEmail = ndb.StringProperty()
     teeShirtSize = ndb.StringProperty(default='NOT_SPECIFIED')
     conferenceKeysToAttend = ndb.StringProperty(repeated=True)
+    # moved to WishlistEntry children by the move_wishlists migration
     sessionKeysInWhishlist = ndb.StringProperty(repeated=True)
 
 
@@ -0,0 +1,17 @@
+from google.appengine.ext import ndb
+from protorpc import messages
+
+
+class SearchPosting(ndb.Model):
+    """SearchPosting -- one token of a searchable entity,
+        a child of that entity keyed by the token"""
+    token = ndb.StringProperty(required=True)
+    kind = ndb.StringProperty(required=True)
+    weight = ndb.IntegerProperty(default=1)
+
+
+class SearchForm(messages.Message):
+    """SearchForm -- full-text search inbound form message"""
+    query = messages.StringField(1)
+    pageSize = messages.IntegerField(2)
+    pageToken = messages.StringField(3)
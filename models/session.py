@@ -1,7 +1,31 @@
+import re
+
 from google.appengine.ext import ndb
 from protorpc import messages
 
 
+# Durations such as 1h, 30m, 2h30m, 1 hour 30 min
+DURATION_RE = re.compile(
+    r'^(?:(\d+)\s*h(?:ours?|rs?)?)?\s*(?:(\d+)\s*m(?:in(?:utes?)?)?)?$')
+
+
+def parseDuration(duration):
+    """Return a duration string in minutes, or None if it can't be read.
+    Accepts hours and minutes (1h, 30m, 2h30m), h:mm and plain minutes."""
+    duration = (duration or '').strip().lower()
+    if not duration:
+        return None
+    if duration.isdigit():
+        return int(duration)
+    match = re.match(r'^(\d+):([0-5]\d)$', duration)
+    if match:
+        return int(match.group(1)) * 60 + int(match.group(2))
+    match = DURATION_RE.match(duration)
+    if match and (match.group(1) or match.group(2)):
+        return int(match.group(1) or 0) * 60 + int(match.group(2) or 0)
+    return None
+
+
 class Session(ndb.Model):
     """Session -- Session object"""
     organizerUserId = ndb.StringProperty()
@@ -13,6 +37,8 @@ class Session(ndb.Model):
     date = ndb.DateProperty()
     startTime = ndb.IntegerProperty()
     conferenceKeyBelongTo = ndb.StringProperty()
+    durationMinutes = ndb.ComputedProperty(
+        lambda self: parseDuration(self.duration), indexed=False)
 
 
 class SessionForm(messages.Message):
@@ -26,11 +52,13 @@ class SessionForm(messages.Message):
     date = messages.StringField(7)
     startTime = messages.StringField(8)
     organizerDisplayName = messages.StringField(9)
+    durationMinutes = messages.IntegerField(10)
 
 
 class SessionForms(messages.Message):
     """SessionForms -- multiple Session outbound form message"""
     items = messages.MessageField(SessionForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
 
 
 class SessionQueryForm(messages.Message):
@@ -65,3 +93,27 @@ class FeaturedSpeakerList(messages.Message):
     """FeaturedSpeakerList
         -- multiple  Featured speaker info. outbound message"""
     items = messages.MessageField(FeaturedSpeaker, 1, repeated=True)
+
+
+class ScheduleItemForm(messages.Message):
+    """ScheduleItemForm -- a session or conference of a user's schedule,
+        outbound message"""
+    websafeKey = messages.StringField(1)
+    kind = messages.StringField(2)
+    name = messages.StringField(3)
+    start = messages.StringField(4)
+    end = messages.StringField(5)
+
+
+class ConflictGroupForm(messages.Message):
+    """ConflictGroupForm -- overlapping items of a user's schedule,
+        outbound message"""
+    start = messages.StringField(1)
+    end = messages.StringField(2)
+    items = messages.MessageField(ScheduleItemForm, 3, repeated=True)
+
+
+class ScheduleConflictsForm(messages.Message):
+    """ScheduleConflictsForm -- conflicts in a user's schedule,
+        outbound message"""
+    items = messages.MessageField(ConflictGroupForm, 1, repeated=True)
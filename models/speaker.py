@@ -0,0 +1,30 @@
+from google.appengine.ext import ndb
+from protorpc import messages
+
+
+def normalizeSpeaker(name):
+    """Return the key name of a speaker: lowercase, single spaced."""
+    return u' '.join((name or u'').lower().split())
+
+
+class Speaker(ndb.Model):
+    """Speaker -- index of the sessions of a speaker,
+        keyed by the normalized speaker name"""
+    name = ndb.StringProperty(indexed=False)
+    sessionCount = ndb.IntegerProperty(default=0, indexed=False)
+    # websafe conference key: number of sessions of the speaker
+    conferenceCounts = ndb.JsonProperty()
+    sessionKeys = ndb.KeyProperty(kind='Session', repeated=True,
+                                  indexed=False)
+
+
+class SpeakerForm(messages.Message):
+    """SpeakerForm -- Speaker outbound form message"""
+    name = messages.StringField(1)
+    sessionCount = messages.IntegerField(2)
+    conferenceCount = messages.IntegerField(3)
+
+
+class SpeakerForms(messages.Message):
+    """SpeakerForms -- multiple Speaker outbound form message"""
+    items = messages.MessageField(SpeakerForm, 1, repeated=True)
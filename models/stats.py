@@ -0,0 +1,21 @@
+from google.appengine.ext import ndb
+
+
+class FieldStats(ndb.Model):
+    """FieldStats -- value statistics of a filterable model field,
+        used by the query planner to estimate filter selectivity"""
+    kind = ndb.StringProperty(required=True)
+    field = ndb.StringProperty(required=True)
+    count = ndb.IntegerProperty(default=0)
+    samples = ndb.PickleProperty(default=[])
+    updated = ndb.DateTimeProperty(auto_now=True)
+
+
+class QueryShapeRecord(ndb.Model):
+    """QueryShapeRecord -- a query shape seen in production,
+        recorded by the index advisor"""
+    kind = ndb.StringProperty(required=True)
+    ancestor = ndb.BooleanProperty(default=False)
+    equality = ndb.StringProperty(repeated=True)
+    postfix = ndb.StringProperty(repeated=True)
+    firstSeen = ndb.DateTimeProperty(auto_now_add=True)
@@ -0,0 +1,13 @@
+from google.appengine.ext import ndb
+
+
+def wishlistEntryId(session_key):
+    """Return the id of the wishlist entry of a session: its key path,
+        which unlike its websafe key is the same in every application."""
+    return u'/'.join(u'%s' % part for part in session_key.flat())
+
+
+class WishlistEntry(ndb.Model):
+    """WishlistEntry -- a session in a user's wishlist,
+        a child of the Profile keyed by wishlistEntryId"""
+    sessionKey = ndb.StringProperty(indexed=False)
@@ -0,0 +1,214 @@
+"""
+planner.py
+Query planner shared by the conference and session query endpoints.
+
+The datastore allows inequality filters on a single field per query.
+The planner sends every equality filter, and the inequality filters on
+the most selective field, to the datastore. The remaining inequality
+filters are compiled into one predicate (compileFilters), applied
+in memory while the results are streamed.
+Selectivity is estimated from FieldStats samples,
+    which are recomputed by the analyze_query_stats cron job.
+"""
+
+import random
+import time
+from bisect import bisect_left, bisect_right
+from operator import attrgetter
+
+from core import DEFAULT_SELECTIVITY, OPERATOR_LOOKUP,\
+    STATS_SAMPLE_SIZE, STATS_CACHE_TTL, MAX_SCANNED_PER_PAGE
+from models.stats import FieldStats
+
+
+# FieldStats per kind, cached per instance: {kind: (expires, {field: stats})}
+_statsCache = {}
+
+
+def planQuery(model, filters):
+    """
+    Split formatted filters between the datastore and memory
+    :param model: ndb model class the filters apply to
+    :param filters: list of formatted filters,
+        dicts of field, operator and value
+    :return: (inequality field sent to the datastore or None,
+        filters for the datastore,
+        filters for memory, most selective first)
+    """
+    stats = getFieldStats(model._get_kind())
+
+    # group inequality filters by field; a field is a candidate for the
+    #     datastore unless it has a != filter on a repeated property,
+    #     which the datastore reads as "any value differs"
+    #     instead of "value not in list"
+    groups = {}
+    for filtr in filters:
+        if filtr["operator"] != "=":
+            groups.setdefault(filtr["field"], []).append(filtr)
+
+    inequality_field = None
+    best = None
+    for field, group in groups.items():
+        if model._properties[field]._repeated and any(
+                filtr["operator"] == "!=" for filtr in group):
+            continue
+        selectivity = 1.0
+        for filtr in group:
+            selectivity *= estimateSelectivity(stats.get(field), filtr)
+        if best is None or selectivity < best:
+            inequality_field, best = field, selectivity
+
+    datastore_filters = []
+    memory_filters = []
+    for filtr in filters:
+        if filtr["operator"] == "=" or filtr["field"] == inequality_field:
+            datastore_filters.append(filtr)
+        else:
+            memory_filters.append(filtr)
+    memory_filters.sort(
+        key=lambda filtr: estimateSelectivity(stats.get(filtr["field"]),
+                                              filtr))
+    return inequality_field, datastore_filters, memory_filters
+
+
+def estimateSelectivity(stats, filtr):
+    """
+    Estimate the fraction of entities which pass the given filter
+    :param stats: FieldStats of the filtered field, or None
+    :param filtr: formatted filter
+    :return: float between 0 and 1
+    """
+    if not stats or not stats.samples:
+        return DEFAULT_SELECTIVITY[filtr["operator"]]
+
+    samples = stats.samples
+    n = float(len(samples))
+    lo = bisect_left(samples, filtr["value"])
+    hi = bisect_right(samples, filtr["value"])
+    matched = {
+        '<': lo,
+        '<=': hi,
+        '>': n - hi,
+        '>=': n - lo,
+        '!=': n - (hi - lo),
+        '=': hi - lo,
+    }[filtr["operator"]]
+    # never estimate zero, the sample may have missed the value
+    return max(matched, 1) / n
+
+
+def compileFilters(model, filters):
+    """
+    Compile formatted filters into a single predicate
+    Attribute access and operators are bound once, so testing an entity
+        costs one call per filter instead of looking them up on every row.
+    Filters are tested in the given order, planQuery returns them
+        most selective first, and the first failing one stops the test.
+    Works on projection results holding the filtered fields,
+        except repeated fields, which projection splits value by value.
+    :param model: ndb model class the filters apply to
+    :param filters: list of formatted filters
+    :return: function of an entity returning True if it passes all filters
+    """
+    checks = [_compileFilter(model, filtr) for filtr in filters]
+    if not checks:
+        return lambda entity: True
+    predicate = checks[-1]
+    for check in reversed(checks[:-1]):
+        predicate = _both(check, predicate)
+    return predicate
+
+
+def _both(first, second):
+    return lambda entity: first(entity) and second(entity)
+
+
+# Predicate factories by operator, taking an attribute getter and a value
+_SCALAR_CHECKS = {
+    '=': lambda get, value: lambda entity: get(entity) == value,
+    '!=': lambda get, value: lambda entity: get(entity) != value,
+    '>': lambda get, value: lambda entity: get(entity) > value,
+    '>=': lambda get, value: lambda entity: get(entity) >= value,
+    '<': lambda get, value: lambda entity: get(entity) < value,
+    '<=': lambda get, value: lambda entity: get(entity) <= value,
+}
+
+
+def _compileFilter(model, filtr):
+    """Return the predicate of one formatted filter."""
+    get = attrgetter(filtr["field"])
+    value = filtr["value"]
+    if not model._properties[filtr["field"]]._repeated:
+        return _SCALAR_CHECKS[filtr["operator"]](get, value)
+    # If the field is of a type of list,
+    #     such as type of session,
+    #     change != to ```not in```
+    if filtr["operator"] == "!=":
+        return lambda entity: value not in get(entity)
+    # other operators pass if any value does, as in the datastore
+    op = OPERATOR_LOOKUP[filtr["operator"]]
+    return lambda entity: any(op(v, value) for v in get(entity))
+
+
+def fetchFilteredPage(query, page_size, start_cursor, predicate):
+    """
+    Like Query.fetch_page, but only count entities passing a predicate
+    Stops after MAX_SCANNED_PER_PAGE entities, so a page may be short
+        and still have a next page.
+    :param predicate: compiled filters, see compileFilters
+    :return: (list of entities, cursor of the next page, more)
+    """
+    entities = []
+    scanned = 0
+    it = query.iter(start_cursor=start_cursor, produce_cursors=True,
+                    batch_size=page_size)
+    for entity in it:
+        scanned += 1
+        if predicate(entity):
+            entities.append(entity)
+        if len(entities) >= page_size or scanned >= MAX_SCANNED_PER_PAGE:
+            return entities, it.cursor_after(), it.probably_has_next()
+    return entities, None, False
+
+
+def getFieldStats(kind):
+    """Return the FieldStats of the given kind by field name."""
+    cached = _statsCache.get(kind)
+    if cached and cached[0] > time.time():
+        return cached[1]
+    stats = dict((s.field, s)
+                 for s in FieldStats.query(FieldStats.kind == kind))
+    _statsCache[kind] = (time.time() + STATS_CACHE_TTL, stats)
+    return stats
+
+
+def analyzeFieldStats(model, fields):
+    """
+    Recompute the FieldStats of the given fields
+    Each field is scanned with a projection query, reading only its index,
+        and a uniform sample of STATS_SAMPLE_SIZE values is kept.
+    :param model: ndb model class
+    :param fields: names of the filterable fields of the model
+    """
+    kind = model._get_kind()
+    for field in fields:
+        prop = model._properties[field]
+        sample = []
+        count = 0
+        for entity in model.query().iter(projection=[prop], batch_size=1000):
+            # projecting a repeated property yields one entity per value
+            value = getattr(entity, field)
+            if isinstance(value, list):
+                value = value[0]
+            count += 1
+            # reservoir sampling
+            if len(sample) < STATS_SAMPLE_SIZE:
+                sample.append(value)
+            else:
+                i = random.randint(0, count - 1)
+                if i < STATS_SAMPLE_SIZE:
+                    sample[i] = value
+        FieldStats(id='%s.%s' % (kind, field), kind=kind, field=field,
+                   count=count, samples=sorted(sample)).put()
+    _statsCache.pop(kind, None)
+
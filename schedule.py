@@ -0,0 +1,71 @@
+"""
+schedule.py
+Conflicts in a user's schedule.
+
+A user's schedule is made of the sessions in their wishlist
+    and the conferences they registered for. Each is an interval
+    of minutes since the first day of the calendar: a session from its
+    date and start time to the end of its duration, a conference from
+    its start date to the end of its end date.
+Conflict groups are the intervals connected by overlaps. The intervals
+    are sorted by start, then swept while keeping the latest end of the
+    current group, which finds the groups in O(n log n).
+"""
+
+from datetime import datetime, timedelta
+from operator import itemgetter
+
+MINUTES_PER_DAY = 24 * 60
+
+
+def sessionInterval(session):
+    """Return the (start, end) minutes of a session, or None if its date,
+        start time or duration is unknown."""
+    if (not session.date or session.startTime is None or
+            session.durationMinutes is None):
+        return None
+    start = session.date.toordinal() * MINUTES_PER_DAY + session.startTime
+    return start, start + session.durationMinutes
+
+
+def conferenceInterval(conf):
+    """Return the (start, end) minutes of a conference, whole days,
+        or None without a start date."""
+    if not conf.startDate:
+        return None
+    last_day = conf.endDate or conf.startDate
+    return (conf.startDate.toordinal() * MINUTES_PER_DAY,
+            (last_day.toordinal() + 1) * MINUTES_PER_DAY)
+
+
+def formatMinutes(minutes):
+    """Format minutes since the first day of the calendar as a datetime."""
+    day, minute = divmod(minutes, MINUTES_PER_DAY)
+    return (datetime.fromordinal(day) + timedelta(minutes=minute)).strftime(
+        '%Y-%m-%d %H:%M')
+
+
+def conflictGroups(intervals):
+    """
+    Group the intervals connected by overlaps
+    Intervals are half open: one ending when another starts is no conflict.
+    :param intervals: iterable of (start, end, item)
+    :return: list of (start, end, items) of the groups
+        of more than one interval, by start
+    """
+    groups = []
+    group = []
+    group_start = group_end = None
+    for start, end, item in sorted(intervals, key=itemgetter(0, 1)):
+        if group and start < group_end:
+            group.append(item)
+            group_end = max(group_end, end)
+            continue
+        if len(group) > 1:
+            groups.append((group_start, group_end, group))
+        group = [item]
+        group_start, group_end = start, end
+    if len(group) > 1:
+        groups.append((group_start, group_end, group))
+    return groups
+
@@ -0,0 +1,141 @@
+"""
+search.py
+Full-text search over conferences and sessions.
+
+The inverted index lives in the datastore: every token of a searchable
+    entity is a SearchPosting child of that entity, weighted by the
+    fields it occurs in (SEARCH_FIELDS). Keeping postings in the entity
+    group of their entity lets them be rewritten in the same transaction.
+
+A search matches entities having every term of the query;
+    a term ending with * matches every token it is a prefix of.
+Matches are ranked by the sum of their posting weights,
+    and paged with the offset in the ranked list as page token.
+"""
+
+import heapq
+import re
+
+import endpoints
+from google.appengine.ext import ndb
+
+from core import SEARCH_FIELDS, SEARCH_STOP_WORDS, MAX_SEARCH_TERMS,\
+    MAX_POSTINGS_PER_TERM, MAX_POSTINGS_PER_PREFIX,\
+    MAX_TOKENS_PER_DOCUMENT, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from models.search import SearchPosting
+
+
+def tokenize(text):
+    """Return the lowercase words of a text, without stop words."""
+    return [word for word in re.findall(r'\w+', text.lower(), re.UNICODE)
+            if len(word) > 1 and word not in SEARCH_STOP_WORDS]
+
+
+def postingsFor(entity):
+    """
+    Return the SearchPostings of an entity
+    :param entity: entity of a kind of SEARCH_FIELDS, with a complete key
+    :return: list of SearchPosting, at most MAX_TOKENS_PER_DOCUMENT
+    """
+    kind = entity._get_kind()
+    weights = {}
+    for field, field_weight in SEARCH_FIELDS[kind].items():
+        values = getattr(entity, field) or []
+        if not isinstance(values, list):
+            values = [values]
+        for value in values:
+            for token in tokenize(value):
+                weights[token] = weights.get(token, 0) + field_weight
+    # keep the heaviest tokens of long texts
+    tokens = sorted(weights, key=lambda t: (-weights[t], t))
+    return [SearchPosting(id=token, parent=entity.key, token=token,
+                          kind=kind, weight=weights[token])
+            for token in tokens[:MAX_TOKENS_PER_DOCUMENT]]
+
+
+def reindex(entity):
+    """
+    Rewrite the SearchPostings of an entity after it changed
+    Only postings whose token or weight changed are written.
+    Can be called inside a transaction on the entity group.
+    """
+    postings = postingsFor(entity)
+    old = dict((p.key, p) for p in
+               SearchPosting.query(ancestor=entity.key).fetch())
+    changed = [p for p in postings
+               if p.key not in old or old[p.key].weight != p.weight]
+    stale = set(old) - set(p.key for p in postings)
+    ndb.put_multi(changed)
+    ndb.delete_multi(stale)
+
+
+def search(kind, query, page_size=None, page_token=None):
+    """
+    Search the entities of a kind
+    :param kind: kind of SEARCH_FIELDS
+    :param query: search terms, ending with * for prefix matching
+    :param page_size: number of results per page, defaults to
+        DEFAULT_PAGE_SIZE and is capped at MAX_PAGE_SIZE
+    :param page_token: page token returned with the previous page
+    :return: (keys of the results, ranked, page token of the next page
+        or None)
+    """
+    if not page_size or page_size < 0:
+        page_size = DEFAULT_PAGE_SIZE
+    page_size = min(page_size, MAX_PAGE_SIZE)
+    # the page token is the offset of the page in the ranked results
+    try:
+        offset = int(page_token or 0)
+    except ValueError:
+        offset = -1
+    if offset < 0:
+        raise endpoints.BadRequestException("Invalid page token.")
+
+    terms = re.findall(r'\w+\*?', query.lower(), re.UNICODE)
+    terms = [t for t in terms if t.rstrip('*') and (
+        t.endswith('*') or t not in SEARCH_STOP_WORDS)][:MAX_SEARCH_TERMS]
+    if not terms:
+        return [], None
+
+    futures = [_termQuery(kind, term).fetch_async(
+        MAX_POSTINGS_PER_PREFIX if term.endswith('*')
+        else MAX_POSTINGS_PER_TERM) for term in terms]
+    scores = None
+    for future in futures:
+        # best weight of the entity for the term,
+        #     a prefix may match several of its tokens
+        term_scores = {}
+        for posting in future.get_result():
+            doc = posting.key.parent()
+            term_scores[doc] = max(term_scores.get(doc, 0), posting.weight)
+        # prefix postings come in token order, not by weight
+        if len(term_scores) > MAX_POSTINGS_PER_TERM:
+            term_scores = dict(heapq.nlargest(
+                MAX_POSTINGS_PER_TERM, term_scores.items(),
+                key=lambda item: item[1]))
+        if scores is None:
+            scores = term_scores
+        else:
+            scores = dict((doc, score + term_scores[doc])
+                          for doc, score in scores.items()
+                          if doc in term_scores)
+
+    ranked = sorted(scores, key=lambda doc: (-scores[doc], doc.flat()))
+    next_offset = offset + page_size
+    return (ranked[offset:next_offset],
+            str(next_offset) if next_offset < len(ranked) else None)
+
+
+def _termQuery(kind, term):
+    """Return the query of the postings of a term, heaviest first,
+        or of a prefix term, by token then heaviest first."""
+    if term.endswith('*'):
+        prefix = term[:-1]
+        return SearchPosting.query(
+            SearchPosting.kind == kind,
+            SearchPosting.token >= prefix,
+            SearchPosting.token < prefix + u'\ufffd').order(
+            SearchPosting.token, -SearchPosting.weight)
+    return SearchPosting.query(
+        SearchPosting.kind == kind,
+        SearchPosting.token == term).order(-SearchPosting.weight)
@@ -0,0 +1,88 @@
+"""
+serializers.py
+Copiers of entities into their outbound form messages.
+
+A copier is built once per model and form pair, when this module is
+    imported: the fields the form shares with the model are read with
+    a single attrgetter, and the fields needing a conversion (dates,
+    start times, enums) have their converter bound ahead of time.
+Copying an entity then costs no reflection on the fields of the form.
+Fields which don't come from the model, such as websafeKey or
+    organizerDisplayName, are set by the caller on the returned form.
+"""
+
+from itertools import izip
+from operator import attrgetter
+
+from models.conference import Conference, ConferenceForm
+from models.profile import Profile, ProfileForm, TeeShirtSize
+from models.session import Session, SessionForm, TypeOfSession
+
+
+def formCopier(model, form_class, converters=None):
+    """
+    Build the copier of entities of a model into a form message
+    :param model: ndb model class
+    :param form_class: protorpc message class
+    :param converters: dict of field name: function converting
+        the value of the entity into the value of the form
+    :return: function of an entity returning a new form_class message
+        holding the fields the form shares with the model
+    """
+    converters = converters or {}
+    names = tuple(field.name for field in form_class.all_fields()
+                  if field.name in model._properties)
+    get = attrgetter(*names)
+    if len(names) == 1:
+        single = get
+        get = lambda entity: (single(entity),)
+    converted = tuple((i, converters[name])
+                      for i, name in enumerate(names) if name in converters)
+
+    def copy(entity):
+        values = list(get(entity))
+        for i, convert in converted:
+            values[i] = convert(values[i])
+        return form_class(**dict(izip(names, values)))
+    return copy
+
+
+def recoverIntToTime(timeInteger):
+    """
+    recover a time property from an integer
+    Usage: Session database model -> SessionForm
+    :param timeInteger
+    :return: strptime(hour, minute, AM/PM).time()
+    """
+    hour = int(timeInteger / 60)
+    loc = "AM"
+    if hour > 12:
+        hour = hour - 12
+        loc = "PM"
+    minute = timeInteger % 60
+    return " ".join([str(hour), str(minute), loc])
+
+
+# Enum values by name
+SESSION_TYPES = dict((t.name, t) for t in TypeOfSession)
+TEE_SHIRT_SIZES = dict((t.name, t) for t in TeeShirtSize)
+
+# Dates are sent as strings
+conferenceToForm = formCopier(Conference, ConferenceForm, {
+    'startDate': str,
+    'endDate': str,
+})
+
+# startTime is stored as minutes since midnight, so it is easy to query,
+#     and typeOfSession as the names of TypeOfSession values
+sessionToForm = formCopier(Session, SessionForm, {
+    'date': str,
+    'startTime': recoverIntToTime,
+    'typeOfSession': lambda types: [SESSION_TYPES[str(t)] for t in types],
+})
+
+# teeShirtSize is stored as the name of a TeeShirtSize value
+profileToForm = formCopier(Profile, ProfileForm, {
+    'teeShirtSize': lambda size: TEE_SHIRT_SIZES[size],
+})
+
@@ -1,24 +1,38 @@
-import json
 from datetime import datetime
 from itertools import ifilter
 
 import endpoints
 from google.appengine.api import memcache
 from google.appengine.ext import ndb
+from google.net.proto.ProtocolBuffer import ProtocolBufferDecodeError
 from protorpc import messages
 from protorpc import message_types
+from protorpc import protojson
 from protorpc import remote
 
+from conference import ConferenceApi
 from core import EMAIL_SCOPE, API_EXPLORER_CLIENT_ID,\
-    SESSION_FIELDS, OPERATORS, OPERATOR_LOOKUP
-from models import BooleanMessage, ConflictException
-from models.profile import Profile
+    SESSION_FIELDS, OPERATORS, SCHEDULE_CACHE_TTL,\
+    FEATURED_SPEAKERS_CACHE_TTL, FEATURED_SPEAKERS_CAS_RETRIES,\
+    DEFAULT_SPEAKER_SUGGESTIONS, MAX_SPEAKER_SUGGESTIONS
+from models import BooleanMessage
+from models.search import SearchForm
 from models.session import Session, SessionForm, SessionForms,\
-    SessionQueryForms, TypeOfSession, FeaturedSpeakerList, FeaturedSpeaker
-
-from settings import WEB_CLIENT_ID
-from utils import getProfileFromUser
-from utils import getUserId
+    SessionQueryForms, TypeOfSession, FeaturedSpeakerList, FeaturedSpeaker,\
+    ScheduleItemForm, ConflictGroupForm, ScheduleConflictsForm, parseDuration
+from models.speaker import Speaker, SpeakerForm, SpeakerForms,\
+    normalizeSpeaker
+from models.wishlist import WishlistEntry, wishlistEntryId
+
+from index_advisor import recordQueryShape
+from planner import planQuery, compileFilters
+from schedule import conflictGroups, conferenceInterval, sessionInterval,\
+    formatMinutes
+from search import postingsFor, search
+from serializers import sessionToForm
+from settings import WEB_CLIENT_ID, MEMCACHE_SCHEDULE_KEY,\
+    MEMCACHE_SCHEDULE_VERSION_KEY, MEMCACHE_FEATURED_SPEAKERS_KEY
+from utils import currentContext
 
 
 # - - - - Request messages - - - - - - - - - - - - - - - - - - -
@@ -51,6 +65,17 @@ SESSION_GET_BY_SPEAKER_REQUEST = endpoints.ResourceContainer(
     speaker=messages.StringField(1),
 )
 
+# Attributes:
+#     - prefix: beginning of a speaker's name, in any case
+#     - limit: number of speakers to return
+# Usage:
+#     - Suggest speakers while their name is typed
+SPEAKER_AUTOCOMPLETE_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    prefix=messages.StringField(1),
+    limit=messages.IntegerField(2),
+)
+
 # Attributes:
 #     - typeOfSession: Type of session
 #         one of [NOT_SPECIFIED, LECTURE, KEYNOTE, WORKSHOP, DEMO, SOCIAL]
@@ -72,6 +97,17 @@ SESSION_POST_WISHLIST_REQUEST = endpoints.ResourceContainer(
     websafeSessionKey=messages.StringField(1),
 )
 
+# Attributes:
+#     - pageSize: number of sessions per page
+#     - pageToken: nextPageToken of the previous page
+# Usage:
+#     - Get one page of the sessions in the user's wishlist
+WISHLIST_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    pageSize=messages.IntegerField(1),
+    pageToken=messages.StringField(2),
+)
+
 
 @endpoints.api(name='sessions',
                version='v1',
@@ -87,62 +123,112 @@ class SessionApi(remote.Service):
             - getConferenceSessions(websafeConferenceKey):
                 retrieve all sessions of the given conference key
                     and return it as a response
+                The schedule is cached in memcache.
+                See also: _conferenceSchedule
             - getConferenceSessionsByType(websafeConferenceKey,
                 typeOfSession):
                 retrieve all sessions which are of the given type
-                    in the given conference
+                    in the given conference, from the cached schedule
             - getSessionsBySpeaker():
                 return all sessions given by the particular speaker,
-                    across all conferences
+                    across all conferences, in any case or spacing
+                    of the name. The session keys are read from
+                    the Speaker index and the sessions in one batch.
+            - autocompleteSpeakers(prefix, limit):
+                return the speakers whose name starts with the prefix,
+                    in any case, with their session counts
             - createSession(websafeConferenceKey):
                 create a new session in the given conference
                     with ```request.fields``` and return the result
                 If a session with the speaker already exist,
-                    append the speaker and the list of their sessions
-                    to memcache with this key: "featured_speakers"
-                See also: _cacheSession(speaker, confKey)
+                    store the speaker and the list of their sessions
+                    in the featured speakers of the conference
+                See also: _cacheFeaturedSpeaker(c_key, speaker),
+                    _indexSpeaker(session)
             - addSessionToWishlist(websafeSessionKey):
-                a current user add the given conference in their wishlist
-            - getSessionsInWishlist():
-                get all the sessions that the user has added to their wishlist
+                a current user add the given session in their wishlist
+                Wishlist entries are WishlistEntry children of the profile,
+                    keyed by the session, so adding is a single write
+                    and adding twice is harmless.
+            - removeSessionFromWishlist(websafeSessionKey):
+                a current user remove the given session from their wishlist,
+                    a single delete, harmless if it is not there
+                See also: _sessionKey
+            - getSessionsInWishlist(pageSize, pageToken):
+                get one page of the sessions that the user has added
+                    to their wishlist
+                See also: _wishlistEntryKey, ConferenceApi._fetchPage
+            - getScheduleConflicts():
+                get the groups of overlapping sessions in the user's
+                    wishlist, and of overlapping conferences the user
+                    registered for
+                See also: _scheduleAsync, schedule.conflictGroups
             - querySessions(): query sessions with a form which is consist of
                 field operator, and value.
                 Example:
                     START_TIME < 02 15 PM and TYPE_OF_SESSION != WORKSHOP
-            - getFeaturedSpeaker():
+            - searchSessions():
+                full-text search of session names and highlights,
+                    ranked by relevance and paged. A term ending with *
+                    matches as a prefix.
+                See also: search.search
+            - getFeaturedSpeaker(websafeConferenceKey):
                 get featured speakers who have more than one session
-                    in a given conference
+                    in the given conference
                     and list of their sessions' names
-                retrieve data from memcache with this key: "featured_speakers"
-                See also: _cacheSession(speaker, confKey)
+                retrieve data from memcache, one entry per conference
+                See also: _cacheFeaturedSpeaker(c_key, speaker),
+                    _featuredSpeakers(c_key)
 
         helper:
+            _conferenceSchedule(wsck):
+                return all sessions of a conference with an ancestor query,
+                    cached under a version bumped by _createSessionObject
             _copySessionToForm(session):
                 convert data(session) from database into Session form message
+                with the copier serializers.sessionToForm, which also
+                    recovers startTime from its integer in database
+            _scheduleAsync():
+                return a future of the sessions in the user's wishlist
+                    and the conferences they registered for
+            _intervals(entities, interval_fn):
+                return the schedule intervals of sessions or conferences
+            _copyToScheduleItemForm(entity, interval):
+                convert a session or conference of the schedule
+                    into a ScheduleItemForm
+            _sessionKey(wssk):
+                return the Session key of a websafe key,
+                    BadRequestException if it is malformed
+            _wishlistEntryKey(s_key):
+                return the key of the current user's wishlist entry
+                    of a session
             _createSessionObject(request):
                 convert data from inbound from message,
                     so it fits in Session model.
                 Create a new session entity
-            _cacheSession(speaker, confKey):
+            _featuredSpeakers(c_key):
+                return the speakers with more than one session
+                    in a conference and their sessions' names,
+                    read with an ancestor query
+            _cacheFeaturedSpeaker(c_key, speaker):
+                update the featured speakers of a conference in memcache
+                    with gets and cas, retried on concurrent updates
+            _indexSpeaker(session):
+                add a session to the Speaker entity of its speaker
+            _copySpeakerToForm(speaker):
+                convert a Speaker entity into a Speaker form message
             _getQuery(request):
                 retrieve data from database using formatted filters.
-                See also: _formatFilters
+                Inequality filters on more than one field are split
+                    between the datastore and memory by the query planner.
+                See also: _formatFilters, planner.planQuery,
+                    planner.compileFilters
             _formatFilters(filters):
                 Format multiple filters into a list of python dictionary.
                 The method _getQuery takes this return list.
-                Use _lambaFilter to do in-memory filtering
-                See also: _lambaFilter
-            _lambaFilter(x, filter):
-                x is from
-                    ```ifilter(lambda x: _lambaFilter(x, filter), sessions)```
-                Provide a lamba function for list filtering
             _convertTimeToInt(timeData):
                 Convert Time object(hour, minute, AM/PM) to integer,
                     so it can be compared to other time column in database
-            _recoverIntToTime(timeInteger):
-                Recover Time object(hour, minute, AM/PM)
-                    from integer in database,
-                    so it fits in Session outbound form message
     """
 
     # - - - - API endpoints - - - - - - - - - - - - - - - - - - - - - - - - - -
@@ -151,13 +237,7 @@ class SessionApi(remote.Service):
                       http_method='GET', name='getConferenceSessions')
     def getConferenceSessions(self, request):
         # Given a conference, return all sessions
-        c_key = ndb.Key(urlsafe=request.websafeConferenceKey)
-        q = Session.query()
-        sessions = q.filter(Session.conferenceKeyBelongTo == c_key.urlsafe())
-        return SessionForms(
-            items=[self._copySessionToForm(sf)
-                   for sf in sessions]
-        )
+        return self._conferenceSchedule(request.websafeConferenceKey)
 
     @endpoints.method(SESSION_GET_BY_TYPE_REQUEST, SessionForms,
                       path='conference/{websafeConferenceKey}/'
@@ -166,13 +246,12 @@ class SessionApi(remote.Service):
     def getConferenceSessionsByType(self, request):
         # Given a conference, return all sessions
         #     of a specified type (eg lecture, keynote, workshop)
-        c_key = ndb.Key(urlsafe=request.websafeConferenceKey)
-        q = Session.query()
-        q = q.filter(Session.conferenceKeyBelongTo == c_key.urlsafe())
-        sessions = q.filter(Session.typeOfSession == request.typeOfSession)
+        # The cached schedule is filtered, instead of querying by type
+        schedule = self._conferenceSchedule(request.websafeConferenceKey)
         return SessionForms(
-            items=[self._copySessionToForm(sf)
-                   for sf in sessions]
+            items=[sf for sf in schedule.items
+                   if request.typeOfSession in
+                   [t.name for t in sf.typeOfSession]]
         )
 
     @endpoints.method(SESSION_GET_BY_SPEAKER_REQUEST, SessionForms,
@@ -181,11 +260,36 @@ class SessionApi(remote.Service):
     def getSessionsBySpeaker(self, request):
         # Given a speaker, return all sessions given
         #     by this particular speaker, across all conferences
-        q = Session.query()
-        sessions = q.filter(Session.speaker == request.speaker)
+        # See also: _indexSpeaker
+        speaker_id = normalizeSpeaker(request.speaker)
+        speaker = Speaker.get_by_id(speaker_id) if speaker_id else None
+        if not speaker:
+            return SessionForms(items=[])
+        sessions = ndb.get_multi(speaker.sessionKeys)
         return SessionForms(
             items=[self._copySessionToForm(sf)
-                   for sf in sessions]
+                   for sf in sessions if sf]
+        )
+
+    @endpoints.method(SPEAKER_AUTOCOMPLETE_REQUEST, SpeakerForms,
+                      path='speakers',
+                      http_method='GET', name='autocompleteSpeakers')
+    def autocompleteSpeakers(self, request):
+        """Return speakers whose name starts with the given prefix."""
+        prefix = normalizeSpeaker(request.prefix)
+        limit = request.limit
+        if not limit or limit < 0:
+            limit = DEFAULT_SPEAKER_SUGGESTIONS
+        limit = min(limit, MAX_SPEAKER_SUGGESTIONS)
+        if not prefix:
+            return SpeakerForms(items=[])
+        # a range of the key index, no composite index needed
+        speakers = Speaker.query(
+            Speaker.key >= ndb.Key(Speaker, prefix),
+            Speaker.key < ndb.Key(Speaker, prefix + u'\ufffd')
+        ).fetch(limit)
+        return SpeakerForms(
+            items=[self._copySpeakerToForm(speaker) for speaker in speakers]
         )
 
     @endpoints.method(SESSION_POST_REQUEST, SessionForm,
@@ -203,49 +307,67 @@ class SessionApi(remote.Service):
     def addSessionToWishlist(self, request):
         # Adds the session to the user's list of sessions
         #     which the user is interested in attending to
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-
-        # get a profile object
-        prof = getProfileFromUser(user)
-
         wssk = request.websafeSessionKey
-        session = ndb.Key(urlsafe=wssk).get()
+        session = self._sessionKey(wssk).get()
         if not session:
             raise endpoints.NotFoundException(
                 'No session found with key: %s' % wssk)
 
-        if wssk in prof.sessionKeysInWhishlist:
-                raise ConflictException(
-                    "You have already added this session")
+        # the entry is keyed by the session, so adding it again
+        #     rewrites the same entity
+        WishlistEntry(key=self._wishlistEntryKey(session.key),
+                      sessionKey=wssk).put()
+        return BooleanMessage(data=True)
 
-        # append this web safe session key to the list
-        prof.sessionKeysInWhishlist.append(wssk)
-        prof.put()
-        retval = True
-        return BooleanMessage(data=retval)
-
-    @endpoints.method(message_types.VoidMessage, SessionForms,
+    @endpoints.method(SESSION_POST_WISHLIST_REQUEST, BooleanMessage,
+                      path='wishlist/session/{websafeSessionKey}',
+                      http_method='DELETE',
+                      name='removeSessionFromWishlist')
+    def removeSessionFromWishlist(self, request):
+        # Removes the session from the user's wishlist
+        self._wishlistEntryKey(
+            self._sessionKey(request.websafeSessionKey)).delete()
+        return BooleanMessage(data=True)
+
+    @endpoints.method(WISHLIST_GET_REQUEST, SessionForms,
                       path='wishlist',
                       http_method='GET', name='getSessionsInWishlist')
     def getSessionsInWishlist(self, request):
-        # Get all the sessions that the user has added to their wishlist
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-        prof = getProfileFromUser(user)
-
-        # Get a list of session keys
-        session_keys = [ndb.Key(urlsafe=wssk)
-                        for wssk in prof.sessionKeysInWhishlist]
-        sessions = ndb.get_multi(session_keys)
+        # Get one page of the sessions that the user has added
+        #     to their wishlist
+        # See also: ConferenceApi._fetchPage
+        entries, next_token = ConferenceApi._fetchPage(
+            WishlistEntry.query(ancestor=currentContext().profileKey),
+            request.pageSize, request.pageToken)
+        sessions = ndb.get_multi([ndb.Key(urlsafe=entry.sessionKey)
+                                  for entry in entries])
 
         # return set of SessionForm objects per Session
         return SessionForms(items=[self._copySessionToForm(session)
-                                   for session in sessions]
+                                   for session in sessions if session],
+                            nextPageToken=next_token
                             )
 
+    @endpoints.method(message_types.VoidMessage, ScheduleConflictsForm,
+                      path='schedule/conflicts',
+                      http_method='GET', name='getScheduleConflicts')
+    def getScheduleConflicts(self, request):
+        # Get the groups of sessions in the wishlist which overlap,
+        #     and of registered conferences which overlap
+        # A session overlaps its own conference,
+        #     so sessions and conferences are grouped apart
+        # See also: schedule.conflictGroups
+        sessions, conferences = self._scheduleAsync().get_result()
+        groups = (
+            conflictGroups(self._intervals(sessions, sessionInterval)) +
+            conflictGroups(self._intervals(conferences, conferenceInterval)))
+        return ScheduleConflictsForm(items=[
+            ConflictGroupForm(
+                start=formatMinutes(start), end=formatMinutes(end),
+                items=[self._copyToScheduleItemForm(entity, interval)
+                       for entity, interval in items])
+            for start, end, items in groups])
+
     @endpoints.method(SessionQueryForms, SessionForms,
                       path='querySessions',
                       http_method='POST', name='querySessions')
@@ -254,76 +376,150 @@ class SessionApi(remote.Service):
         sessions = self._getQuery(request)
 
         # return individual SessionForm object per Session
-        # See also: _getQuery, _formatFilters, _lambdaFilter
+        # See also: _getQuery, _formatFilters
         return SessionForms(
             items=[self._copySessionToForm(session)
                    for session in sessions]
         )
 
-    @endpoints.method(message_types.VoidMessage, FeaturedSpeakerList,
-                      path='get-featured-speaker',
+    @endpoints.method(SearchForm, SessionForms,
+                      path='searchSessions',
+                      http_method='POST', name='searchSessions')
+    def searchSessions(self, request):
+        """Search session names and highlights, best matches first."""
+        keys, next_token = search('Session', request.query or '',
+                                  request.pageSize, request.pageToken)
+        return SessionForms(
+            items=[self._copySessionToForm(session)
+                   for session in ndb.get_multi(keys) if session],
+            nextPageToken=next_token
+        )
+
+    @endpoints.method(SESSION_GET_REQUEST, FeaturedSpeakerList,
+                      path='conference/{websafeConferenceKey}/'
+                           'featured-speaker',
                       http_method='GET', name='getFeaturedSpeaker')
-    def getFeaturedSpeaker(self):
-        # Get a json object of featured speakers
+    def getFeaturedSpeaker(self, request):
+        # Get featured speakers of the given conference
         #     and a list of their session
         # Featured Speaker: speakers who have more than one session
         #                   in a conference
-        featured = memcache.get("featured_speakers")
-        if not featured:
-            return FeaturedSpeakerList(items=[])
-
-        # We store jsonify string to mecache
-        featured_json = json.loads(featured)
+        c_key = ndb.Key(urlsafe=request.websafeConferenceKey)
+        cache_key = MEMCACHE_FEATURED_SPEAKERS_KEY % c_key.urlsafe()
+        featured = memcache.get(cache_key)
+        if featured is None:
+            # add, so a concurrent update is not overwritten
+            featured = self._featuredSpeakers(c_key)
+            memcache.add(cache_key, featured,
+                         time=FEATURED_SPEAKERS_CACHE_TTL)
 
         # return list of FeaturedSpeaker
         # FeaturedSpeaker has two attr. speaker(name), sessionNames
         return FeaturedSpeakerList(
             items=[FeaturedSpeaker(
-                speaker=speaker, sessionNames=featured_json[speaker])
-                for speaker in featured_json]
+                speaker=speaker, sessionNames=featured[speaker])
+                for speaker in sorted(featured)]
         )
     # - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
     # - - - - Helper methods - - - - - - - - - - - - - - - - - -
+    def _conferenceSchedule(self, wsck):
+        """
+        Return all sessions of a conference, cached in memcache
+        Sessions are children of their conference, so the ancestor query
+            is strongly consistent, and the cache version is bumped
+            by _createSessionObject.
+        :param wsck: websafe conference key
+        :return: SessionForms
+        """
+        # read the version first, so a schedule read before a new session
+        #     is stored under a version which is already outdated
+        version = ConferenceApi._cacheVersion(
+            MEMCACHE_SCHEDULE_VERSION_KEY % wsck)
+        cache_key = MEMCACHE_SCHEDULE_KEY % (wsck, version)
+        if version is not None:
+            cached = memcache.get(cache_key)
+            if cached:
+                return protojson.decode_message(SessionForms, cached)
+
+        c_key = ndb.Key(urlsafe=wsck)
+        schedule = SessionForms(
+            items=[self._copySessionToForm(session)
+                   for session in Session.query(ancestor=c_key)]
+        )
+        if version is not None:
+            memcache.set(cache_key, protojson.encode_message(schedule),
+                         time=SCHEDULE_CACHE_TTL)
+        return schedule
+
+    @ndb.tasklet
+    def _scheduleAsync(self):
+        """Return a future of the sessions in the user's wishlist
+            and the conferences they registered for.
+        The wishlist and the profile are read in parallel,
+            then the sessions and the conferences in one batch each."""
+        ctx = currentContext()
+        entries, prof = yield (
+            WishlistEntry.query(ancestor=ctx.profileKey).fetch_async(
+                batch_size=1000),
+            ctx.getProfileAsync())
+        sessions, conferences = yield (
+            ndb.get_multi_async([ndb.Key(urlsafe=entry.sessionKey)
+                                 for entry in entries]),
+            ndb.get_multi_async([ndb.Key(urlsafe=wsck)
+                                 for wsck in prof.conferenceKeysToAttend]))
+        raise ndb.Return([session for session in sessions if session],
+                         [conf for conf in conferences if conf])
+
+    @staticmethod
+    def _intervals(entities, interval_fn):
+        """Return the (start, end, (entity, (start, end))) intervals
+            of the entities, leaving out those without an interval."""
+        intervals = []
+        for entity in entities:
+            interval = interval_fn(entity)
+            if interval:
+                intervals.append(interval + ((entity, interval),))
+        return intervals
+
+    @staticmethod
+    def _copyToScheduleItemForm(entity, interval):
+        """Copy a Session or Conference and its interval
+            to ScheduleItemForm."""
+        return ScheduleItemForm(websafeKey=entity.key.urlsafe(),
+                                kind=entity._get_kind(), name=entity.name,
+                                start=formatMinutes(interval[0]),
+                                end=formatMinutes(interval[1]))
+
+    @staticmethod
+    def _sessionKey(wssk):
+        """Return the Session key of a websafe key,
+            raising BadRequestException if it is malformed."""
+        try:
+            s_key = ndb.Key(urlsafe=wssk)
+        except (TypeError, ProtocolBufferDecodeError):
+            s_key = None
+        if not s_key or s_key.kind() != Session._get_kind():
+            raise endpoints.BadRequestException(
+                'Invalid session key: %s' % wssk)
+        return s_key
+
+    @staticmethod
+    def _wishlistEntryKey(s_key):
+        """Return the key of the current user's wishlist entry
+            of the given session key."""
+        return ndb.Key(WishlistEntry, wishlistEntryId(s_key),
+                       parent=currentContext().profileKey)
+
     def _copySessionToForm(self, session):
-        """Copy relevant fields from Conference to ConferenceForm."""
-        sf = SessionForm()
-        for field in sf.all_fields():
-            if hasattr(session, field.name):
-                if field.name == "websafeKey":
-                    # URL safe session key
-                    setattr(sf, field.name, session.key.urlsafe())
-                elif field.name == "date":
-                    # date type has to be stored as DateProperty
-                    setattr(sf, field.name, str(getattr(session, field.name)))
-                elif field.name == "startTime":
-                    # startTime has to be stored as Integer,
-                    #     so it is easy to Query,
-                    #     such as Filter Sessions before 07 00 PM,
-                    #     since 07 00 PM is converted to 1140
-                    # See also _recoverIntToTime
-                    setattr(sf, field.name,
-                            self._recoverIntToTime(
-                                getattr(session, field.name)
-                            )
-                            )
-                elif field.name == "typeOfSession":
-                    # type of session is of list type
-                    tmp = []
-                    for type in getattr(session, field.name):
-                        tmp.append(getattr(TypeOfSession, str(type)))
-                    setattr(sf, field.name, tmp)
-                else:
-                    setattr(sf, field.name, getattr(session, field.name))
-        return sf
+        """Copy relevant fields from Session to SessionForm."""
+        # See also: serializers.sessionToForm
+        return sessionToForm(session)
 
     def _createSessionObject(self, request):
         """Create Session object,
             returning SessionForm/request."""
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-        user_id = getUserId(user)
+        user_id = currentContext().userId
 
         # Copy SessionForm/ProtoRPC Message into dict
         data = {field.name: getattr(request, field.name)
@@ -340,6 +536,11 @@ class SessionApi(remote.Service):
         # Delete properties which are not in the Session data model
         del data['websafeConferenceKey']
         del data['organizerDisplayName']
+        del data['durationMinutes']
+
+        if data['duration'] and parseDuration(data['duration']) is None:
+            raise endpoints.BadRequestException(
+                "Invalid duration, expected e.g. 1h, 30m or 2h30m")
 
         if data['date']:
             data['date'] = datetime.strptime(data['date'], "%Y-%m-%d").date()
@@ -359,6 +560,7 @@ class SessionApi(remote.Service):
         s_key = ndb.Key(Session, s_id, parent=conf.key)
         data['key'] = s_key
         data['organizerUserId'] = request.organizerUserId = user_id
+        request.durationMinutes = parseDuration(data['duration'])
         data['conferenceKeyBelongTo'] = wsck
 
         # store a list of types of session to database
@@ -368,15 +570,20 @@ class SessionApi(remote.Service):
         if len(type_of_session) > 0:
             data['typeOfSession'] = type_of_session
 
-        Session(**data).put()
+        session = Session(**data)
+        ndb.put_multi([session] + postingsFor(session))
+        # outdate the cached schedule of the conference
+        memcache.incr(MEMCACHE_SCHEDULE_VERSION_KEY % wsck)
 
         if data["speaker"]:
+            # See also: _indexSpeaker
+            self._indexSpeaker(session)
             # If the inbound session form has speaker value
-            #     call _cacheSession to determine
+            #     call _cacheFeaturedSpeaker to determine
             #     if the speaker is a feature speaker,
-            #     and if so, save the info. to memcache as a jsonified string
-            # See also: _cacheSession
-            self._cacheSession(data["speaker"], data['conferenceKeyBelongTo'])
+            #     and if so, save the info. to memcache
+            # See also: _cacheFeaturedSpeaker
+            self._cacheFeaturedSpeaker(conf.key, data["speaker"])
 
         # return the result as an outbound session form message
         sf = SessionForm()
@@ -390,120 +597,118 @@ class SessionApi(remote.Service):
         return sf
 
     @staticmethod
-    def _cacheSession(speaker, confKey):
-        # Check if the given speaker already exist,
-        #     if so, append the speaker's name and the list of session
-        #     to memcache with the key, ```featured_speakers```
-        sessions = Session.query(ndb.AND(
-            Session.speaker == speaker,
-            Session.conferenceKeyBelongTo == confKey
-        )).fetch(projection=[Session.name])
-
-        if len(sessions) > 1:
-            featured_speakers = memcache.get("featured_speakers")
-            if not featured_speakers:
-                memcache.set("featured_speakers", json.dumps(
-                    [{speaker: [session.name for session in sessions]}]
-                ))
+    def _featuredSpeakers(c_key):
+        """
+        Return the featured speakers of a conference
+        :param c_key: conference key
+        :return: dict of speaker: names of their sessions,
+            for speakers with more than one session
+        """
+        names = {}
+        for session in Session.query(ancestor=c_key):
+            if session.speaker:
+                names.setdefault(session.speaker, []).append(session.name)
+        return dict((speaker, session_names)
+                    for speaker, session_names in names.items()
+                    if len(session_names) > 1)
+
+    @staticmethod
+    def _cacheFeaturedSpeaker(c_key, speaker):
+        """
+        Update the featured speakers of a conference after a new session
+        The entry is updated with gets and cas, so concurrent session
+            creations don't overwrite each other, and retried when
+            another update came in between.
+        :param c_key: conference key
+        :param speaker: speaker of the new session
+        """
+        # ancestor queries are strongly consistent,
+        #     so the new session is counted
+        names = [session.name for session in Session.query(
+            Session.speaker == speaker, ancestor=c_key)]
+        if len(names) < 2:
+            return
+
+        cache_key = MEMCACHE_FEATURED_SPEAKERS_KEY % c_key.urlsafe()
+        client = memcache.Client()
+        for _ in range(FEATURED_SPEAKERS_CAS_RETRIES):
+            featured = client.gets(cache_key)
+            if featured is None:
+                # rebuild the entry, add fails if another request did first
+                if client.add(cache_key, SessionApi._featuredSpeakers(c_key),
+                              time=FEATURED_SPEAKERS_CACHE_TTL):
+                    return
             else:
-                # If the memcache already exist,
-                #     append a new info to the value already exists
-                featured_speakers_dict = json.loads(featured_speakers)
-                featured_speakers_dict[speaker] =\
-                    [session.name for session in sessions]
-                memcache.set("featured_speakers",
-                             json.dumps(featured_speakers_dict))
+                featured[speaker] = names
+                if client.cas(cache_key, featured,
+                              time=FEATURED_SPEAKERS_CACHE_TTL):
+                    return
+        # too many concurrent updates, the next read rebuilds the entry
+        client.delete(cache_key)
+
+    @staticmethod
+    @ndb.transactional()
+    def _indexSpeaker(session):
+        """
+        Add a session to the Speaker entity of its speaker
+        Idempotent, so it also backfills the index of existing sessions.
+        :param session: stored session with a speaker
+        :return: True if the session was added
+        """
+        speaker_id = normalizeSpeaker(session.speaker)
+        if not speaker_id:
+            return False
+        speaker = Speaker.get_by_id(speaker_id) or Speaker(
+            id=speaker_id, name=session.speaker, conferenceCounts={})
+        if session.key in speaker.sessionKeys:
+            return False
+        wsck = session.key.parent().urlsafe()
+        speaker.sessionKeys.append(session.key)
+        speaker.sessionCount = len(speaker.sessionKeys)
+        speaker.conferenceCounts[wsck] = \
+            speaker.conferenceCounts.get(wsck, 0) + 1
+        speaker.put()
+        return True
+
+    @staticmethod
+    def _copySpeakerToForm(speaker):
+        """Copy relevant fields from Speaker to SpeakerForm."""
+        return SpeakerForm(
+            name=speaker.name,
+            sessionCount=speaker.sessionCount,
+            conferenceCount=len(speaker.conferenceCounts or {}),
+        )
 
     def _getQuery(self, request):
-        """Return formatted query from the submitted filters."""
+        """Return formatted query from the submitted filters,
+            streamed through the filters left to be applied in memory."""
         q = Session.query()
-        inequality_filters, filters = self._formatFilters(request.filters)
-
-        if len(inequality_filters) <= 1:
-            # if there is no inequality filter
-            if len(inequality_filters) == 1:
-                # If an inequality_filter exists,
-                #     sort on the inequality filter first
-                q = q.order(ndb.GenericProperty(
-                    inequality_filters[0]["field"]
-                )
-                )
-            q = q.order(Session.name)
-            for filtr in filters:
-                if filtr["field"] == "startTime":
-                    # convert startTime to integer,
-                    #     since it is stored as integer type
-                    filtr["value"] = int(filtr["value"])
-                formatted_query = ndb.query.FilterNode(
-                    filtr["field"], filtr["operator"], filtr["value"])
-                q = q.filter(formatted_query)
-            return q
-        else:
-            # If there are more than two inequality filters,
-            #     we need to handle inequality filters separately,
-            #     and do in-memory filtering to get data we want
-            inequality_filter_key_set = [x["field"]
-                                         for x in inequality_filters]
-            # Do equality filters first
-            for filtr in filters:
-                if filtr["field"] not in inequality_filter_key_set:
-                    if filtr["field"] == "startTime":
-                        filtr["value"] = int(filtr["value"])
-                    formatted_query = ndb.query.FilterNode(
-                        filtr["field"], filtr["operator"], filtr["value"])
-                    q = q.filter(formatted_query)
-            first_time = True
-            for inequality_filter in inequality_filters:
-                if first_time:
-                    # Execute the first equality filter
-                    if inequality_filter["field"] == "startTime":
-                        inequality_filter["value"] =\
-                            int(inequality_filter["value"])
-                    formatted_query = ndb.query.FilterNode(
-                        inequality_filter["field"],
-                        inequality_filter["operator"],
-                        inequality_filter["value"]
-                    )
-                    first_time = False
-                    sessions = q.filter(formatted_query)
-                else:
-                    # From the second inequality filter
-                    #     we need to preform list filtering
-                    if inequality_filter["field"] == "startTime":
-                        inequality_filter["value"] =\
-                            int(inequality_filter["value"])
-                    # Perform lambda function filtering for each session object
-                    # lambda function returns true
-                    #     if the session object satisfy the given filter
-                    # See also: _lambaFilter
-                    sessions = ifilter(
-                        lambda x: self._lambaFilter(x, inequality_filter),
-                        sessions
-                    )
-            return sessions
-
-    def _lambaFilter(self, x, inequality_filter):
-        if isinstance(getattr(x, inequality_filter["field"]), list):
-            # If the filter value is of a type of list,
-            #     such as type of session,
-            #     change != to ```not in```
-            return inequality_filter["value"]\
-                   not in getattr(x, inequality_filter["field"])
-        else:
-            # By using OPERATOR LOOKUP Table we can get python operators
-            # Example:
-            #     - != : operator.ne
-            #     - > : operator.gt
-            return OPERATOR_LOOKUP[
-                inequality_filter["operator"]
-            ](getattr(x, inequality_filter["field"]),
-              inequality_filter["value"]
-              )
+        inequality_field, filters, memory_filters = planQuery(
+            Session, self._formatFilters(request.filters))
+
+        # If an inequality filter is applied by the datastore,
+        #     sort on its field first
+        if inequality_field:
+            q = q.order(ndb.GenericProperty(inequality_field))
+        q = q.order(Session.name)
+        for filtr in filters:
+            formatted_query = ndb.query.FilterNode(
+                filtr["field"], filtr["operator"], filtr["value"])
+            q = q.filter(formatted_query)
+
+        recordQueryShape(
+            'Session',
+            [f["field"] for f in filters if f["operator"] == "="],
+            inequality_field, [inequality_field, 'name'])
+
+        # See also: planner.compileFilters
+        if memory_filters:
+            return ifilter(compileFilters(Session, memory_filters), q)
+        return q
 
     def _formatFilters(self, filters):
         """Parse, check validity and format user supplied filters."""
         formatted_filters = []
-        inequality_filters = []
 
         for f in filters:
             filtr = {field.name: getattr(f, field.name)
@@ -520,23 +725,12 @@ class SessionApi(remote.Service):
                     filtr['value'] =\
                         datetime.strptime(filtr['value'], "%Y-%m-%d").date()
 
-            except KeyError:
+            except (KeyError, ValueError, TypeError):
                 raise endpoints.BadRequestException(
-                    "Filter contains invalid field or operator.")
-
-            # Every operation except "=" is an inequality
-            if filtr["operator"] != "=":
-                # check if inequality operation
-                #     has been used in previous filters
-                # disallow the filter if inequality was performed
-                #     on a different field before
-                # track the field
-                #     on which the inequality operation is performed
-                # store inequality filters separately
-                inequality_filters.append(filtr)
+                    "Filter contains invalid field, operator or value.")
 
             formatted_filters.append(filtr)
-        return (inequality_filters, formatted_filters)
+        return formatted_filters
 
     def _convertTimeToInt(self, timeData):
         """
@@ -549,18 +743,3 @@ class SessionApi(remote.Service):
             return timeData.hour * 60 + timeData.minute
         except:
             raise endpoints.BadRequestException("Invalid time format")
-
-    def _recoverIntToTime(self, timeInteger):
-        """
-        recover a time property from an integer
-        Usage: Session database model -> SessionForm
-        :param timeInteger
-        :return: strptime(hour, minute, AM/PM).time()
-        """
-        hour = int(timeInteger / 60)
-        loc = "AM"
-        if hour > 12:
-            hour = hour - 12
-            loc = "PM"
-        minute = timeInteger % 60
-        return " ".join([str(hour), str(minute), loc])
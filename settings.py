@@ -15,3 +15,22 @@ created/forked from conference.py by wesc on 2014 may 24
 WEB_CLIENT_ID =\
     '<your client id from google developer console>'
 MEMCACHE_ANNOUNCEMENTS_KEY = 'conferenceANNOUNCEMENTS'
+MEMCACHE_CONFERENCE_KEY = 'conference:%s:%s'
+MEMCACHE_CONFERENCE_VERSION_KEY = 'conferenceVersion:%s'
+MEMCACHE_QUERY_KEY = 'conferenceQuery:%s:%s'
+MEMCACHE_QUERY_VERSION_KEY = 'conferenceQueryVersion'
+MEMCACHE_QUERY_HITS_KEY = 'conferenceQueryHits'
+MEMCACHE_QUERY_MISSES_KEY = 'conferenceQueryMisses'
+MEMCACHE_QUERY_SHAPE_KEY = 'queryShape:%s'
+MEMCACHE_SIGNING_CERTS_KEY = 'signingCerts'
+MEMCACHE_FACETS_KEY = 'conferenceFacets'
+MEMCACHE_SCHEDULE_KEY = 'conferenceSchedule:%s:%s'
+MEMCACHE_SCHEDULE_VERSION_KEY = 'conferenceScheduleVersion:%s'
+MEMCACHE_FEATURED_SPEAKERS_KEY = 'featuredSpeakers:%s'
+
+# Google's ID token signing keys, in JWK form
+GOOGLE_CERTS_URL = 'https://www.googleapis.com/oauth2/v3/certs'
+
+# Record the shapes of the queries run by the APIs,
+#     for the index advisor report at /admin/index_advisor
+RECORD_QUERY_SHAPES = False
@@ -414,6 +414,7 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
      */
     $scope.queryConferences = function () {
         $scope.submitted = false;
+        $scope.nextPageToken = null;
         if ($scope.selectedTab == 'ALL') {
             $scope.queryConferencesAll();
         } else if ($scope.selectedTab == 'YOU_HAVE_CREATED') {
@@ -424,12 +425,23 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
     };
 
     /**
-     * Invokes the conference.queryConferences API.
+     * Holds the token of the next page of queryConferences results.
+     * @type {string}
      */
-    $scope.queryConferencesAll = function () {
+    $scope.nextPageToken = null;
+
+    /**
+     * Invokes the conference.queryConferenceSummaries API.
+     *
+     * @param pageToken the nextPageToken of the previous response; the results are appended if given.
+     */
+    $scope.queryConferencesAll = function (pageToken) {
         var sendFilters = {
             filters: []
         }
+        if (pageToken) {
+            sendFilters.pageToken = pageToken;
+        }
         for (var i = 0; i < $scope.filters.length; i++) {
             var filter = $scope.filters[i];
             if (filter.field && filter.operator && filter.value) {
@@ -441,7 +453,7 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
             }
         }
         $scope.loading = true;
-        gapi.client.conference.queryConferences(sendFilters).
+        gapi.client.conference.queryConferenceSummaries(sendFilters).
             execute(function (resp) {
                 $scope.$apply(function () {
                     $scope.loading = false;
@@ -458,7 +470,10 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
                         $scope.alertStatus = 'success';
                         $log.info($scope.messages);
 
-                        $scope.conferences = [];
+                        if (!pageToken) {
+                            $scope.conferences = [];
+                        }
+                        $scope.nextPageToken = resp.nextPageToken || null;
                         angular.forEach(resp.items, function (conference) {
                             $scope.conferences.push(conference);
                         });
@@ -469,11 +484,11 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
     }
 
     /**
-     * Invokes the conference.getConferencesCreated method.
+     * Invokes the conference.getConferenceSummariesCreated method.
      */
     $scope.getConferencesCreated = function () {
         $scope.loading = true;
-        gapi.client.conference.getConferencesCreated().
+        gapi.client.conference.getConferenceSummariesCreated().
             execute(function (resp) {
                 $scope.$apply(function () {
                     $scope.loading = false;
@@ -511,7 +526,7 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
      */
     $scope.getConferencesAttend = function () {
         $scope.loading = true;
-        gapi.client.conference.getConferencesToAttend().
+        gapi.client.conference.getConferenceSummariesToAttend().
             execute(function (resp) {
                 $scope.$apply(function () {
                     if (resp.error) {
@@ -0,0 +1,142 @@
+"""
+testing.py
+Local App Engine stubs for the tests and the benchmarks.
+
+The App Engine SDK has to be on the path:
+    PYTHONPATH=path/to/google_appengine python -m unittest discover tests
+    PYTHONPATH=path/to/google_appengine python benchmarks.py
+The bundled libraries of the SDK (endpoints, protorpc, webapp2, yaml)
+    are added to the path when this module is imported.
+"""
+
+import os
+import sys
+import threading
+import time
+
+try:
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+except ImportError:
+    pass
+
+from google.appengine.api import apiproxy_rpc, apiproxy_stub_map, users
+from google.appengine.datastore import datastore_stub_util
+from google.appengine.ext import ndb, testbed
+
+import utils
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def activateStubs(requireIndexes=False):
+    """
+    Activate a testbed with the stubs of the APIs the app uses
+    The datastore is strongly consistent, and queue.yaml is read
+        so the pull and push queues of the app exist.
+    :param requireIndexes: raise NeedIndexError, as in production,
+        on queries no index of index.yaml serves
+    :return: active Testbed, to be deactivated by the caller
+    """
+    tb = testbed.Testbed()
+    tb.activate()
+    tb.setup_env(app_id='testbed-conference', overwrite=True)
+    tb.init_datastore_v3_stub(
+        consistency_policy=datastore_stub_util.
+        PseudoRandomHRConsistencyPolicy(probability=1),
+        # without requireIndexes, the stub would add the indexes
+        #     of the queries it runs to index.yaml
+        require_indexes=requireIndexes,
+        root_path=ROOT if requireIndexes else None)
+    tb.init_memcache_stub()
+    tb.init_taskqueue_stub(root_path=ROOT)
+    tb.init_mail_stub()
+    tb.init_urlfetch_stub()
+    tb.init_app_identity_stub()
+    tb.init_user_stub()
+    ndb.get_context().clear_cache()
+    return tb
+
+
+def actAs(email, request_id='testing'):
+    """
+    Make the calling thread serve a request of the given user
+    :return: the RequestContext of the request
+    """
+    os.environ['REQUEST_LOG_ID'] = request_id
+    context = utils.RequestContext(request_id)
+    context._user = users.User(email)
+    context._userResolved = True
+    utils._local.context = context
+    return context
+
+
+class RpcCounter(object):
+    """Count the API calls made while installed, by service.method."""
+
+    def __init__(self):
+        self.calls = {}
+        self._lock = threading.Lock()
+
+    def install(self):
+        apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+            'rpc_counter', self._count)
+        return self
+
+    def uninstall(self):
+        hooks = apiproxy_stub_map.apiproxy.GetPreCallHooks()
+        hooks._ListOfHooks__content = [
+            hook for hook in hooks._ListOfHooks__content
+            if hook[0] != 'rpc_counter']
+
+    def _count(self, service, call, request, response):
+        with self._lock:
+            name = '%s.%s' % (service, call)
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+    def reset(self):
+        self.calls = {}
+
+    def total(self):
+        return sum(self.calls.values())
+
+
+class _DelayedRPC(apiproxy_rpc.RPC):
+    """RPC answered by a stub after a delay, in its own thread,
+        so RPCs made before waiting overlap as they do in production."""
+
+    def __init__(self, delay, *args, **kwargs):
+        super(_DelayedRPC, self).__init__(*args, **kwargs)
+        self._delay = delay
+        self._thread = None
+
+    def _MakeCallImpl(self):
+        super(_DelayedRPC, self)._MakeCallImpl()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.start()
+
+    def _run(self):
+        time.sleep(self._delay)
+        try:
+            self.stub.MakeSyncCall(self.package, self.call,
+                                   self.request, self.response)
+        except Exception:
+            _, self._exception, self._traceback = sys.exc_info()
+
+    def _WaitImpl(self):
+        self._thread.join()
+        self._state = apiproxy_rpc.RPC.FINISHING
+        self._Callback()
+        return True
+
+
+def delayRpcs(delay, services=('datastore_v3', 'memcache')):
+    """
+    Delay the answers of the stubs of the given services,
+        simulating the network round trip of production
+    :param delay: seconds per RPC
+    """
+    for service in services:
+        stub = apiproxy_stub_map.apiproxy.GetStub(service)
+        stub.CreateRPC = (lambda stub=stub:
+                          _DelayedRPC(delay, stub=stub))
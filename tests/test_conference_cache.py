@@ -0,0 +1,83 @@
+"""
+test_conference_cache.py
+getConference responses cached in memcache, and the writes
+    which outdate them.
+"""
+
+import unittest
+
+# sets up the path of the SDK, before importing from it
+import testing
+from google.appengine.ext import ndb
+
+from conference import ConferenceApi, CONF_GET_REQUEST
+from models.conference import Conference
+from models.profile import Profile, ProfileMiniForm, TeeShirtSize
+from user import UserApi
+
+
+class ConferenceCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.testbed = testing.activateStubs()
+        self.email = 'ada@example.com'
+        self.p_key = ndb.Key(Profile, self.email)
+        self.conferences = [
+            Conference(parent=self.p_key, name=name,
+                       organizerUserId=self.email)
+            for name in ('PyCon', 'DjangoCon')]
+        ndb.put_multi(self.conferences)
+        self.api = ConferenceApi()
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def displayNames(self):
+        names = []
+        for conf in self.conferences:
+            # a request of its own, reading memcache first
+            ndb.get_context().clear_cache()
+            request = CONF_GET_REQUEST.combined_message_class(
+                websafeConferenceKey=conf.key.urlsafe())
+            names.append(
+                self.api.getConference(request).organizerDisplayName)
+        return names
+
+    def saveProfile(self, **fields):
+        testing.actAs(self.email)
+        UserApi().saveProfile(ProfileMiniForm(**fields))
+
+    def testRenameOutdatesOrganizerConferences(self):
+        Profile(key=self.p_key, displayName='Ada',
+                mainEmail=self.email).put()
+        self.assertEqual(self.displayNames(), ['Ada', 'Ada'])
+
+        self.saveProfile(displayName='Ada Lovelace')
+
+        self.assertEqual(self.displayNames(),
+                         ['Ada Lovelace', 'Ada Lovelace'])
+
+    def testOtherChangesKeepTheCache(self):
+        Profile(key=self.p_key, displayName='Ada',
+                mainEmail=self.email).put()
+        self.displayNames()
+        versions = [ConferenceApi._conferenceVersion(conf.key.urlsafe())
+                    for conf in self.conferences]
+
+        self.saveProfile(displayName='Ada', teeShirtSize=TeeShirtSize.XL_W)
+
+        self.assertEqual(
+            [ConferenceApi._conferenceVersion(conf.key.urlsafe())
+             for conf in self.conferences], versions)
+
+    def testOrganizerWithoutProfile(self):
+        self.assertEqual(self.displayNames(), [None, None])
+
+        # the Profile is created on the first request of the organizer
+        self.saveProfile(displayName='Ada')
+
+        self.assertEqual(self.displayNames(), ['Ada', 'Ada'])
+
+
+if __name__ == '__main__':
+    unittest.main()
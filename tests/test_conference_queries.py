@@ -0,0 +1,84 @@
+"""
+test_conference_queries.py
+Conferences overlapping a date range, queried along with filters,
+    against the indexes of index.yaml only, as in production.
+"""
+
+import unittest
+from datetime import date
+
+# sets up the path of the SDK, before importing from it
+import testing
+from google.appengine.ext import ndb
+
+from conference import ConferenceApi
+from models.conference import Conference, ConferenceQueryForm,\
+    ConferenceQueryForms
+from models.profile import Profile
+
+
+def _query(fromDate, toDate, *filters):
+    return ConferenceQueryForms(
+        fromDate=fromDate, toDate=toDate,
+        filters=[ConferenceQueryForm(field=field, operator=operator,
+                                     value=value)
+                 for field, operator, value in filters])
+
+
+class DateRangeQueryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.testbed = testing.activateStubs(requireIndexes=True)
+        organizer = ndb.Key(Profile, 'ada@example.com')
+        ndb.put_multi([
+            Conference(parent=organizer, name=name, city=city,
+                       topics=topics, startDate=start, endDate=end,
+                       month=start.month, maxAttendees=seats)
+            for name, city, topics, start, end, seats in (
+                ('PyCon', 'Montreal', ['Python'],
+                 date(2016, 5, 28), date(2016, 6, 5), 1000),
+                ('DjangoCon', 'Philadelphia', ['Python', 'Web'],
+                 date(2016, 7, 17), date(2016, 7, 22), 400),
+                ('JSConf', 'Montreal', ['Web'],
+                 date(2016, 6, 3), date(2016, 6, 3), 200),
+                ('GopherCon', 'Denver', ['Go'],
+                 date(2016, 7, 11), date(2016, 7, 13), 1500),
+            )])
+        self.api = ConferenceApi()
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def names(self, request):
+        return [conf.name
+                for conf in self.api.queryConferences(request).items]
+
+    def summaryNames(self, request):
+        return [conf.name
+                for conf in self.api.queryConferenceSummaries(request).items]
+
+    def testRangeOnly(self):
+        self.assertEqual(self.names(_query('2016-06-01', '2016-06-30')),
+                         ['JSConf', 'PyCon'])
+        self.assertEqual(self.names(_query('2016-07-13', None)),
+                         ['GopherCon'])
+
+    def testRangeWithFilters(self):
+        june = ('2016-06-01', '2016-07-31')
+        for filters, expected in (
+                ([('CITY', 'EQ', 'Montreal')], ['JSConf', 'PyCon']),
+                ([('TOPIC', 'EQ', 'Python')], ['DjangoCon', 'PyCon']),
+                ([('MONTH', 'EQ', '7')], ['DjangoCon', 'GopherCon']),
+                ([('MAX_ATTENDEES', 'GT', '300')],
+                 ['DjangoCon', 'GopherCon', 'PyCon']),
+                ([('CITY', 'EQ', 'Montreal'), ('TOPIC', 'EQ', 'Web'),
+                  ('MAX_ATTENDEES', 'LT', '1000')], ['JSConf']),
+                ([('CITY', 'NE', 'Montreal'), ('MAX_ATTENDEES', 'GT', '300'),
+                  ('MONTH', 'GTEQ', '7')], ['DjangoCon', 'GopherCon'])):
+            request = _query(*(june + tuple(filters)))
+            self.assertEqual(self.names(request), expected, filters)
+            self.assertEqual(self.summaryNames(request), expected, filters)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,163 @@
+"""
+test_confirmations.py
+Digests of the conference creation confirmations, sent by the
+    send_confirmation_digests cron job from the pull queue.
+"""
+
+import json
+import logging
+import time
+import unittest
+
+# sets up the path of the SDK, before importing from it
+import testing
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+import main
+from conference import ConferenceApi
+from core import CONFIRMATION_QUEUE
+from models.conference import Conference, ConferenceForm
+from models.profile import Profile
+
+DIGESTS_URL = '/crons/send_confirmation_digests'
+
+
+class ConfirmationDigestsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.testbed = testing.activateStubs()
+        self.mail = self.testbed.get_stub('mail')
+        self.queue = taskqueue.Queue(CONFIRMATION_QUEUE)
+        self.sendMail = main.mail.send_mail
+        self.leaseSeconds = main.CONFIRMATION_LEASE_SECONDS
+
+    def tearDown(self):
+        main.mail.send_mail = self.sendMail
+        main.CONFIRMATION_LEASE_SECONDS = self.leaseSeconds
+        logging.disable(logging.NOTSET)
+        self.testbed.deactivate()
+
+    def createConferences(self, email, names):
+        """Create conferences of an organizer the way createConference
+            does, with a confirmation task tagged by organizer."""
+        prof = Profile(id=email, mainEmail=email, displayName=email)
+        conferences = [Conference(parent=prof.key, name=name,
+                                  organizerUserId=email)
+                       for name in names]
+        ndb.put_multi([prof] + conferences)
+        self.queue.add([taskqueue.Task(
+            payload=json.dumps({'websafeKey': conf.key.urlsafe(),
+                                'email': email}),
+            method='PULL', tag=email) for conf in conferences])
+
+    def pendingTasks(self):
+        return self.testbed.get_stub('taskqueue').get_filtered_tasks(
+            queue_names=CONFIRMATION_QUEUE)
+
+    def testSendsOneDigestPerOrganizerAndDeletesTasks(self):
+        self.createConferences('ada@example.com', ['PyCon', 'DjangoCon'])
+        self.createConferences('bob@example.com', ['GopherCon'])
+
+        response = main.app.get_response(DIGESTS_URL)
+
+        self.assertEqual(response.status_int, 200)
+        self.assertIn('Sent 2 digests, 0 failed', response.body)
+        messages = dict((message.to, message)
+                        for message in self.mail.get_sent_messages())
+        self.assertEqual(sorted(messages),
+                         ['ada@example.com', 'bob@example.com'])
+        ada = messages['ada@example.com']
+        self.assertEqual(ada.subject, 'You created 2 new Conferences!')
+        body = ada.body.decode()
+        self.assertIn('PyCon', body)
+        self.assertIn('DjangoCon', body)
+        self.assertEqual(messages['bob@example.com'].subject,
+                         'You created a new Conference!')
+        self.assertEqual(self.pendingTasks(), [])
+
+    def testOrganizerWithoutProfile(self):
+        # createConference doesn't create the Profile of the organizer
+        testing.actAs('new@example.com')
+        ConferenceApi()._createConferenceObject(ConferenceForm(name='PyCon'))
+        self.assertIsNone(ndb.Key(Profile, 'new@example.com').get())
+
+        response = main.app.get_response(DIGESTS_URL)
+
+        self.assertIn('Sent 1 digests, 0 failed', response.body)
+        messages = self.mail.get_sent_messages()
+        self.assertEqual([message.to for message in messages],
+                         ['new@example.com'])
+        self.assertIn('PyCon', messages[0].body.decode())
+        self.assertEqual(self.pendingTasks(), [])
+
+    def testTaskWithKeyOnly(self):
+        # tasks enqueued before the email was added to the payload
+        prof = Profile(id='ada@example.com', mainEmail='ada@example.com')
+        conf = Conference(parent=prof.key, name='PyCon')
+        ndb.put_multi([prof, conf])
+        self.queue.add(taskqueue.Task(payload=conf.key.urlsafe(),
+                                      method='PULL', tag='ada@example.com'))
+
+        response = main.app.get_response(DIGESTS_URL)
+
+        self.assertIn('Sent 1 digests, 0 failed', response.body)
+        self.assertEqual([message.to
+                          for message in self.mail.get_sent_messages()],
+                         ['ada@example.com'])
+
+    def testFailedSendLeavesTasksLeased(self):
+        self.createConferences('ada@example.com', ['PyCon', 'DjangoCon'])
+
+        def failingSend(*args, **kwargs):
+            raise main.mail.Error('mail service unavailable')
+        main.mail.send_mail = failingSend
+        main.CONFIRMATION_LEASE_SECONDS = 1
+        # the failed digest is logged
+        logging.disable(logging.ERROR)
+
+        response = main.app.get_response(DIGESTS_URL)
+
+        self.assertEqual(response.status_int, 200)
+        self.assertIn('Sent 0 digests, 1 failed', response.body)
+        self.assertEqual(self.mail.get_sent_messages(), [])
+        # the tasks are kept, leased until a later run retries them
+        self.assertEqual(len(self.pendingTasks()), 2)
+        self.assertEqual(self.queue.lease_tasks(60, 10), [])
+
+        # once the lease expires, the next run sends the digest
+        main.mail.send_mail = self.sendMail
+        time.sleep(1.1)
+        response = main.app.get_response(DIGESTS_URL)
+        self.assertIn('Sent 1 digests, 0 failed', response.body)
+        self.assertEqual(len(self.mail.get_sent_messages()), 1)
+        self.assertEqual(self.pendingTasks(), [])
+
+    def testFailedDigestDoesNotBlockOthers(self):
+        # the failing digest is the oldest, leased first
+        self.createConferences('ada@example.com', ['PyCon'])
+        self.createConferences('bob@example.com', ['GopherCon'])
+        self.createConferences('eve@example.com', ['RustConf'])
+
+        sendMail = self.sendMail
+
+        def failingSend(sender, to, *args, **kwargs):
+            if to == 'ada@example.com':
+                raise main.mail.Error('mail service unavailable')
+            return sendMail(sender, to, *args, **kwargs)
+        main.mail.send_mail = failingSend
+        logging.disable(logging.ERROR)
+
+        response = main.app.get_response(DIGESTS_URL)
+
+        self.assertIn('Sent 2 digests, 1 failed', response.body)
+        self.assertEqual(sorted(message.to
+                                for message in self.mail.get_sent_messages()),
+                         ['bob@example.com', 'eve@example.com'])
+        # only the tasks of the failed digest are kept, leased
+        self.assertEqual([json.loads(task.payload)['email']
+                          for task in self.pendingTasks()],
+                         ['ada@example.com'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+"""
+test_durations.py
+Session durations, read from free text into minutes.
+"""
+
+import unittest
+
+# sets up the path of the SDK, before importing from it
+import testing
+from google.appengine.api import datastore
+
+from models.session import Session, parseDuration
+
+
+class ParseDurationTest(unittest.TestCase):
+
+    def testHoursAndMinutes(self):
+        for duration, minutes in (
+                ('1h', 60), ('30m', 30), ('2h30m', 150), ('2h 30m', 150),
+                ('1 hour 30 min', 90), ('2 hours', 120), ('3hrs', 180),
+                ('45 minutes', 45), ('1 minute', 1), ('0h15m', 15),
+                ('1H30M', 90), ('  1h  ', 60)):
+            self.assertEqual(parseDuration(duration), minutes, duration)
+
+    def testClockAndPlainMinutes(self):
+        for duration, minutes in (('1:30', 90), ('0:05', 5), ('12:00', 720),
+                                  ('90', 90), ('0', 0)):
+            self.assertEqual(parseDuration(duration), minutes, duration)
+
+    def testUnreadable(self):
+        for duration in (None, '', '   ', 'a while', 'h', 'm', 'hm',
+                         '1.5h', '1:75', '1:5', '-30', '30s', '1h30',
+                         'one hour'):
+            self.assertIsNone(parseDuration(duration), duration)
+
+
+class DurationMinutesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.testbed = testing.activateStubs()
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def testComputedFromDuration(self):
+        session = Session(name='Keynote', duration='1h30m')
+        self.assertEqual(session.durationMinutes, 90)
+        session.duration = '45m'
+        self.assertEqual(session.durationMinutes, 45)
+        session.duration = None
+        self.assertIsNone(session.durationMinutes)
+
+    def testStored(self):
+        key = Session(name='Keynote', duration='2:15').put()
+        # the stored value, read without the model
+        self.assertEqual(datastore.Get(key.to_old_key())['durationMinutes'],
+                         135)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+"""
+test_migrations.py
+Migration batches chained by tasks, and the cached conferences
+    they outdate.
+"""
+
+import unittest
+from datetime import date
+
+# sets up the path of the SDK, before importing from it
+import testing
+from google.appengine.ext import ndb
+
+import migrations
+from conference import ConferenceApi, CONF_GET_REQUEST
+from core import MIGRATION_QUEUE
+from models.conference import Conference, ConferenceQueryForm,\
+    ConferenceQueryForms
+from models.migration import MigrationState
+from models.profile import Profile
+
+MIGRATION = 'backfill_conference_month'
+
+
+class MigrationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.testbed = testing.activateStubs()
+        self.taskqueue = self.testbed.get_stub('taskqueue')
+        self.batchSize = migrations.MIGRATION_BATCH_SIZE
+        migrations.MIGRATION_BATCH_SIZE = 2
+        organizer = ndb.Key(Profile, 'ada@example.com')
+        # conferences created before month was stored
+        self.conferences = [
+            Conference(parent=organizer, name='Conference %d' % i,
+                       startDate=date(2016, 5, 1 + i))
+            for i in range(5)]
+        ndb.put_multi(self.conferences)
+        self.api = ConferenceApi()
+
+    def tearDown(self):
+        migrations.MIGRATION_BATCH_SIZE = self.batchSize
+        self.testbed.deactivate()
+
+    def runTasks(self):
+        """Run the migration tasks, including those they chain."""
+        batches = 0
+        while True:
+            tasks = self.taskqueue.get_filtered_tasks(
+                queue_names=MIGRATION_QUEUE)
+            if not tasks:
+                return batches
+            self.taskqueue.FlushQueue(MIGRATION_QUEUE)
+            for task in tasks:
+                params = task.extract_params()
+                migrations.runBatch(params['name'], int(params['runId']),
+                                    int(params['batch']))
+                batches += 1
+
+    def queryMay(self):
+        ndb.get_context().clear_cache()
+        return self.api.queryConferences(ConferenceQueryForms(filters=[
+            ConferenceQueryForm(field='MONTH', operator='EQ', value='5')]))
+
+    def getConference(self, conf):
+        ndb.get_context().clear_cache()
+        return self.api.getConference(CONF_GET_REQUEST.combined_message_class(
+            websafeConferenceKey=conf.key.urlsafe()))
+
+    def testMigratesEveryBatch(self):
+        migrations.startMigration(MIGRATION)
+        self.assertEqual(self.runTasks(), 3)
+
+        state = MigrationState.get_by_id(MIGRATION)
+        self.assertEqual((state.status, state.batches, state.processed,
+                          state.updated), ('done', 3, 5, 5))
+        self.assertEqual([conf.month for conf in ndb.get_multi(
+            [conf.key for conf in self.conferences])], [5] * 5)
+
+    def testOutdatesCachedConferences(self):
+        # cached before the migration
+        self.assertEqual(self.queryMay().items, [])
+        self.assertIsNone(self.getConference(self.conferences[0]).month)
+
+        migrations.startMigration(MIGRATION)
+        self.runTasks()
+
+        self.assertEqual(len(self.queryMay().items), 5)
+        self.assertEqual(self.getConference(self.conferences[0]).month, 5)
+
+    def testRetriedBatchChainsTheNextOne(self):
+        state = migrations.startMigration(MIGRATION)
+        self.taskqueue.FlushQueue(MIGRATION_QUEUE)
+        migrations.runBatch(MIGRATION, state.runId, 0)
+        # chaining batch 1 failed: its task isn't there
+        self.taskqueue.FlushQueue(MIGRATION_QUEUE)
+
+        # the task of batch 0 is retried
+        migrations.runBatch(MIGRATION, state.runId, 0)
+
+        self.assertEqual(self.runTasks(), 2)
+        state = MigrationState.get_by_id(MIGRATION)
+        self.assertEqual((state.status, state.processed), ('done', 5))
+
+
+if __name__ == '__main__':
+    unittest.main()
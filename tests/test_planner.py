@@ -0,0 +1,184 @@
+"""
+test_planner.py
+Planning of multi-inequality queries and the filters compiled for memory.
+"""
+
+import unittest
+from datetime import date
+
+# sets up the path of the SDK, before importing from it
+import testing
+
+import planner
+from core import DEFAULT_SELECTIVITY
+from models.session import Session
+from models.stats import FieldStats
+from planner import compileFilters, estimateSelectivity, planQuery
+
+
+def _filter(field, operator, value):
+    return {"field": field, "operator": operator, "value": value}
+
+
+class CompileFiltersTest(unittest.TestCase):
+
+    def setUp(self):
+        self.session = Session(name='Keynote', speaker='Guido',
+                               typeOfSession=['LECTURE', 'KEYNOTE'],
+                               date=date(2016, 5, 28), startTime=600)
+
+    def passes(self, *filters):
+        return compileFilters(Session, list(filters))(self.session)
+
+    def testNoFilters(self):
+        self.assertTrue(self.passes())
+
+    def testScalarOperators(self):
+        for operator, value, expected in (
+                ('=', 600, True), ('=', 601, False),
+                ('!=', 601, True), ('!=', 600, False),
+                ('>', 599, True), ('>', 600, False),
+                ('>=', 600, True), ('>=', 601, False),
+                ('<', 601, True), ('<', 600, False),
+                ('<=', 600, True), ('<=', 599, False)):
+            self.assertEqual(
+                self.passes(_filter('startTime', operator, value)),
+                expected, (operator, value))
+
+    def testAllFiltersMustPass(self):
+        self.assertTrue(self.passes(
+            _filter('startTime', '<', 720),
+            _filter('date', '>=', date(2016, 5, 1))))
+        self.assertFalse(self.passes(
+            _filter('startTime', '<', 720),
+            _filter('date', '>=', date(2016, 6, 1))))
+
+    def testRepeatedNotEqualIsNotIn(self):
+        self.assertFalse(self.passes(
+            _filter('typeOfSession', '!=', 'LECTURE')))
+        self.assertTrue(self.passes(
+            _filter('typeOfSession', '!=', 'WORKSHOP')))
+
+    def testRepeatedPassesIfAnyValueDoes(self):
+        self.assertTrue(self.passes(_filter('typeOfSession', '=', 'KEYNOTE')))
+        self.assertFalse(self.passes(
+            _filter('typeOfSession', '=', 'WORKSHOP')))
+        # 'LECTURE' is greater than 'KEYNOTE'
+        self.assertTrue(self.passes(_filter('typeOfSession', '>', 'KEYNOTE')))
+        self.assertFalse(self.passes(
+            _filter('typeOfSession', '>', 'LECTURE')))
+
+    def testRepeatedWithoutValues(self):
+        self.session.typeOfSession = []
+        self.assertTrue(self.passes(
+            _filter('typeOfSession', '!=', 'LECTURE')))
+        self.assertFalse(self.passes(_filter('typeOfSession', '=', 'LECTURE')))
+
+    def testNoneValues(self):
+        # None sorts before any value, as in the datastore indexes
+        self.session.startTime = None
+        self.assertTrue(self.passes(_filter('startTime', '<', 720)))
+        self.assertFalse(self.passes(_filter('startTime', '>=', 0)))
+        self.assertTrue(self.passes(_filter('startTime', '!=', 600)))
+        self.assertTrue(self.passes(_filter('startTime', '=', None)))
+
+    def testFirstFailingFilterStops(self):
+        class Projected(object):
+            startTime = 600
+        predicate = compileFilters(Session, [_filter('startTime', '>', 720),
+                                             _filter('speaker', '=', 'Guido')])
+        # the speaker is not read, it would raise on this entity
+        self.assertFalse(predicate(Projected()))
+
+
+class PlanQueryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.testbed = testing.activateStubs()
+        planner._statsCache.clear()
+        # startTime: every 10 minutes of a day; speaker: 10 of them
+        FieldStats(id='Session.startTime', kind='Session',
+                   field='startTime', count=144,
+                   samples=range(0, 1440, 10)).put()
+        FieldStats(id='Session.speaker', kind='Session', field='speaker',
+                   count=100,
+                   samples=sorted('Speaker %d' % (i % 10)
+                                  for i in range(100))).put()
+
+    def tearDown(self):
+        planner._statsCache.clear()
+        self.testbed.deactivate()
+
+    def testDefaultSelectivityWithoutStats(self):
+        for operator in DEFAULT_SELECTIVITY:
+            self.assertEqual(
+                estimateSelectivity(None, _filter('name', operator, 'a')),
+                DEFAULT_SELECTIVITY[operator])
+        self.assertEqual(estimateSelectivity(
+            FieldStats(samples=[]), _filter('name', '<', 'a')),
+            DEFAULT_SELECTIVITY['<'])
+
+    def testSelectivityFromSamples(self):
+        stats = FieldStats(samples=[1, 2, 2, 3])
+        for operator, expected in (('<', 0.25), ('<=', 0.75),
+                                   ('>', 0.25), ('>=', 0.75),
+                                   ('!=', 0.5), ('=', 0.5)):
+            self.assertEqual(
+                estimateSelectivity(stats, _filter('x', operator, 2)),
+                expected, operator)
+        # a value the sample missed is never estimated to match nothing
+        self.assertEqual(
+            estimateSelectivity(stats, _filter('x', '>', 3)), 0.25)
+
+    def testMostSelectiveFieldGoesToDatastore(self):
+        early = _filter('startTime', '<', 60)
+        other = _filter('speaker', '!=', 'Speaker 1')
+        name = _filter('name', '=', 'Keynote')
+        field, datastore, memory = planQuery(Session, [other, early, name])
+        self.assertEqual(field, 'startTime')
+        self.assertEqual(datastore, [early, name])
+        self.assertEqual(memory, [other])
+
+        late = _filter('startTime', '>', 60)
+        field, datastore, memory = planQuery(Session, [other, late])
+        self.assertEqual(field, 'speaker')
+        self.assertEqual(datastore, [other])
+        self.assertEqual(memory, [late])
+
+    def testFiltersOfAFieldMultiply(self):
+        # together, the filters on startTime keep a single value
+        after = _filter('startTime', '>=', 600)
+        before = _filter('startTime', '<=', 600)
+        other = _filter('speaker', '<', 'Speaker 5')
+        field, datastore, memory = planQuery(Session, [other, after, before])
+        self.assertEqual(field, 'startTime')
+        self.assertEqual(datastore, [after, before])
+
+    def testRepeatedNotEqualStaysInMemory(self):
+        not_workshop = _filter('typeOfSession', '!=', 'WORKSHOP')
+        late = _filter('startTime', '>', 60)
+        field, datastore, memory = planQuery(Session, [not_workshop, late])
+        self.assertEqual(field, 'startTime')
+        self.assertEqual(datastore, [late])
+        self.assertEqual(memory, [not_workshop])
+
+        field, datastore, memory = planQuery(Session, [not_workshop])
+        self.assertIsNone(field)
+        self.assertEqual(datastore, [])
+        self.assertEqual(memory, [not_workshop])
+
+    def testMemoryFiltersMostSelectiveFirst(self):
+        name = _filter('name', '<', 'M')
+        day = _filter('date', '!=', date(2016, 5, 28))
+        speaker = _filter('speaker', '=', 'Speaker 1')
+        late = _filter('startTime', '>', 1380)
+        field, datastore, memory = planQuery(
+            Session, [day, name, late, speaker])
+        self.assertEqual(field, 'startTime')
+        self.assertEqual(datastore, [late, speaker])
+        # default 1/3 for name, 0.9 for date
+        self.assertEqual(memory, [name, day])
+
+
+if __name__ == '__main__':
+    unittest.main()
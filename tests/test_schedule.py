@@ -0,0 +1,174 @@
+"""
+test_schedule.py
+Intervals of sessions and conferences, and the groups of conflicts
+    returned by getScheduleConflicts.
+"""
+
+import unittest
+from datetime import date
+
+# sets up the path of the SDK, before importing from it
+import testing
+from google.appengine.ext import ndb
+from protorpc import message_types
+
+from models.conference import Conference
+from models.profile import Profile
+from models.session import Session
+from models.wishlist import WishlistEntry, wishlistEntryId
+from schedule import MINUTES_PER_DAY, conferenceInterval, conflictGroups,\
+    formatMinutes, sessionInterval
+from session import SessionApi
+
+DAY = date(2016, 5, 28).toordinal() * MINUTES_PER_DAY
+
+
+class IntervalsTest(unittest.TestCase):
+
+    def testSessionInterval(self):
+        session = Session(name='Keynote', date=date(2016, 5, 28),
+                          startTime=9 * 60, duration='1h30m')
+        self.assertEqual(sessionInterval(session),
+                         (DAY + 9 * 60, DAY + 10 * 60 + 30))
+
+    def testSessionAtMidnight(self):
+        session = Session(name='Opening', date=date(2016, 5, 28),
+                          startTime=0, duration='15')
+        self.assertEqual(sessionInterval(session), (DAY, DAY + 15))
+
+    def testSessionWithoutInterval(self):
+        for session in (
+                Session(name='No date', startTime=600, duration='1h'),
+                Session(name='No time', date=date(2016, 5, 28),
+                        duration='1h'),
+                Session(name='No duration', date=date(2016, 5, 28),
+                        startTime=600),
+                Session(name='Unreadable duration', date=date(2016, 5, 28),
+                        startTime=600, duration='a while')):
+            self.assertIsNone(sessionInterval(session), session.name)
+
+    def testConferenceInterval(self):
+        conf = Conference(name='PyCon', startDate=date(2016, 5, 28),
+                          endDate=date(2016, 5, 30))
+        self.assertEqual(conferenceInterval(conf),
+                         (DAY, DAY + 3 * MINUTES_PER_DAY))
+        # a conference without an end date lasts its first day
+        conf.endDate = None
+        self.assertEqual(conferenceInterval(conf),
+                         (DAY, DAY + MINUTES_PER_DAY))
+        conf.startDate = None
+        self.assertIsNone(conferenceInterval(conf))
+
+    def testFormatMinutes(self):
+        self.assertEqual(formatMinutes(DAY), '2016-05-28 00:00')
+        self.assertEqual(formatMinutes(DAY + 19 * 60 + 5),
+                         '2016-05-28 19:05')
+        # the end of a day is the start of the next one
+        self.assertEqual(formatMinutes(DAY + MINUTES_PER_DAY),
+                         '2016-05-29 00:00')
+
+
+class ConflictGroupsTest(unittest.TestCase):
+
+    def testNoIntervals(self):
+        self.assertEqual(conflictGroups([]), [])
+
+    def testNoConflicts(self):
+        # touching intervals don't overlap
+        self.assertEqual(conflictGroups([(0, 10, 'a'), (10, 20, 'b'),
+                                         (30, 40, 'c')]), [])
+
+    def testGroupsAreConnectedByOverlaps(self):
+        # a overlaps b and b overlaps c, but a doesn't overlap c
+        intervals = [(20, 30, 'c'), (0, 10, 'a'), (5, 25, 'b'),
+                     (100, 110, 'd'), (50, 60, 'e'), (105, 120, 'f')]
+        self.assertEqual(conflictGroups(intervals), [
+            (0, 30, ['a', 'b', 'c']),
+            (100, 120, ['d', 'f']),
+        ])
+
+    def testContainedInterval(self):
+        # b ends before a, c overlaps a only
+        self.assertEqual(conflictGroups([(0, 100, 'a'), (10, 20, 'b'),
+                                         (90, 110, 'c')]),
+                         [(0, 110, ['a', 'b', 'c'])])
+
+    def testSameStart(self):
+        self.assertEqual(conflictGroups([(0, 30, 'b'), (0, 10, 'a')]),
+                         [(0, 30, ['a', 'b'])])
+
+    def testMatchesPairwiseOverlaps(self):
+        import random
+        rnd = random.Random(0)
+        intervals = []
+        for i in range(300):
+            start = rnd.randrange(5000)
+            intervals.append((start, start + rnd.randrange(1, 60), i))
+        groups = conflictGroups(intervals)
+        group_of = dict((item, g) for g, (_, _, items) in enumerate(groups)
+                        for item in items)
+        for a in intervals:
+            for b in intervals:
+                if a is not b and a[0] < b[1] and b[0] < a[1]:
+                    self.assertEqual(group_of[a[2]], group_of[b[2]])
+        for start, end, items in groups:
+            self.assertGreater(len(items), 1)
+            self.assertEqual(start, min(intervals[i][0] for i in items))
+            self.assertEqual(end, max(intervals[i][1] for i in items))
+
+
+class ScheduleConflictsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.testbed = testing.activateStubs()
+        self.email = 'ada@example.com'
+        testing.actAs(self.email)
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def testConflicts(self):
+        prof = Profile(id=self.email, mainEmail=self.email)
+        organizer = ndb.Key(Profile, 'bob@example.com')
+        pycon = Conference(parent=organizer, name='PyCon',
+                           startDate=date(2016, 5, 28),
+                           endDate=date(2016, 5, 30))
+        sprints = Conference(parent=organizer, name='Sprints',
+                             startDate=date(2016, 5, 30))
+        later = Conference(parent=organizer, name='Later',
+                           startDate=date(2016, 6, 10))
+        ndb.put_multi([pycon, sprints, later])
+        prof.conferenceKeysToAttend = [conf.key.urlsafe()
+                                       for conf in (pycon, sprints, later)]
+        sessions = [
+            Session(parent=pycon.key, name='Keynote', duration='1h',
+                    date=date(2016, 5, 28), startTime=9 * 60),
+            Session(parent=pycon.key, name='Tutorial', duration='2h',
+                    date=date(2016, 5, 28), startTime=9 * 60 + 30),
+            Session(parent=pycon.key, name='Lunch', duration='1h',
+                    date=date(2016, 5, 28), startTime=12 * 60),
+            # without a start time, left out
+            Session(parent=pycon.key, name='Open space', duration='1h',
+                    date=date(2016, 5, 28)),
+        ]
+        ndb.put_multi(sessions)
+        ndb.put_multi([prof] + [
+            WishlistEntry(id=wishlistEntryId(session.key), parent=prof.key,
+                          sessionKey=session.key.urlsafe())
+            for session in sessions])
+
+        groups = SessionApi().getScheduleConflicts(
+            message_types.VoidMessage()).items
+
+        self.assertEqual(
+            [(group.start, group.end,
+              [(item.kind, item.name) for item in group.items])
+             for group in groups],
+            [('2016-05-28 09:00', '2016-05-28 11:30',
+              [('Session', 'Keynote'), ('Session', 'Tutorial')]),
+             ('2016-05-28 00:00', '2016-05-31 00:00',
+              [('Conference', 'PyCon'), ('Conference', 'Sprints')])])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+"""
+test_serializers.py
+The precompiled copiers give the forms the reflective copies gave
+    before them, field by field.
+"""
+
+import unittest
+from datetime import date
+
+# sets up the path of the SDK, before importing from it
+import testing
+from google.appengine.ext import ndb
+
+from conference import ConferenceApi
+from models.conference import Conference, ConferenceForm
+from models.profile import Profile, ProfileForm, TeeShirtSize
+from models.session import Session, SessionForm, TypeOfSession
+from serializers import recoverIntToTime
+from session import SessionApi
+from user import UserApi
+
+
+# - - - - Reflective copies the copiers replaced - - - - - - - - - - -
+
+def reflectiveConferenceForm(conf, displayName):
+    cf = ConferenceForm()
+    for field in cf.all_fields():
+        if hasattr(conf, field.name):
+            # convert Date to date string; just copy others
+            if field.name.endswith('Date'):
+                setattr(cf, field.name, str(getattr(conf, field.name)))
+            else:
+                setattr(cf, field.name, getattr(conf, field.name))
+        elif field.name == "websafeKey":
+            setattr(cf, field.name, conf.key.urlsafe())
+    if displayName:
+        setattr(cf, 'organizerDisplayName', displayName)
+    cf.check_initialized()
+    return cf
+
+
+def reflectiveSessionForm(session):
+    sf = SessionForm()
+    for field in sf.all_fields():
+        if hasattr(session, field.name):
+            if field.name == "date":
+                setattr(sf, field.name, str(getattr(session, field.name)))
+            elif field.name == "startTime":
+                setattr(sf, field.name,
+                        recoverIntToTime(getattr(session, field.name)))
+            elif field.name == "typeOfSession":
+                setattr(sf, field.name,
+                        [getattr(TypeOfSession, str(t))
+                         for t in getattr(session, field.name)])
+            else:
+                setattr(sf, field.name, getattr(session, field.name))
+    return sf
+
+
+def reflectiveProfileForm(prof):
+    pf = ProfileForm()
+    for field in pf.all_fields():
+        if hasattr(prof, field.name):
+            # convert t-shirt string to Enum; just copy others
+            if field.name == 'teeShirtSize':
+                setattr(pf, field.name,
+                        getattr(TeeShirtSize, getattr(prof, field.name)))
+            else:
+                setattr(pf, field.name, getattr(prof, field.name))
+    pf.check_initialized()
+    return pf
+
+
+class CopierParityTest(unittest.TestCase):
+
+    def setUp(self):
+        self.testbed = testing.activateStubs()
+        self.organizer = ndb.Key(Profile, 'ada@example.com')
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def assertSameForm(self, expected, actual):
+        for field in expected.all_fields():
+            self.assertEqual(getattr(expected, field.name),
+                             getattr(actual, field.name), field.name)
+        self.assertEqual(expected, actual)
+
+    def testConferenceForm(self):
+        conferences = [
+            Conference(parent=self.organizer, name='PyCon',
+                       description='Python', topics=['Python', 'Web'],
+                       city='Montreal', startDate=date(2016, 5, 28),
+                       month=5, endDate=date(2016, 6, 5),
+                       maxAttendees=100, seatsAvailable=42,
+                       organizerUserId='ada@example.com', seatShards=4),
+            # only the required name, dates are copied as 'None'
+            Conference(parent=self.organizer, name='Bare'),
+        ]
+        ndb.put_multi(conferences)
+        api = ConferenceApi()
+        for conf in conferences:
+            for displayName in ('Ada', ''):
+                self.assertSameForm(
+                    reflectiveConferenceForm(conf, displayName),
+                    api._copyConferenceToForm(conf, displayName))
+
+    def testSessionForm(self):
+        sessions = [
+            Session(name='Keynote', highlights=['intro', 'demo'],
+                    speaker='Guido', duration='1h30m',
+                    typeOfSession=['LECTURE', 'WORKSHOP'],
+                    date=date(2016, 5, 28), startTime=19 * 60 + 5,
+                    organizerUserId='ada@example.com'),
+            Session(name='Morning', typeOfSession=[], startTime=0),
+        ]
+        api = SessionApi()
+        for session in sessions:
+            self.assertSameForm(reflectiveSessionForm(session),
+                                api._copySessionToForm(session))
+
+    def testProfileForm(self):
+        profiles = [
+            Profile(id='ada@example.com', displayName='Ada',
+                    mainEmail='ada@example.com', teeShirtSize='XL_W',
+                    conferenceKeysToAttend=['a', 'b']),
+            Profile(id='bob@example.com'),
+        ]
+        api = UserApi()
+        for prof in profiles:
+            self.assertSameForm(reflectiveProfileForm(prof),
+                                api._copyProfileToForm(prof))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+"""
+test_tokens.py
+Verification of ID tokens signed by local fake keys.
+"""
+
+import base64
+import json
+import time
+import unittest
+
+# sets up the path of the SDK, before importing from it
+import testing
+from Crypto.Hash import SHA256
+from Crypto.PublicKey import RSA
+from Crypto.Signature import PKCS1_v1_5
+from Crypto.Util.number import bytes_to_long, long_to_bytes
+
+import tokens
+from core import TOKEN_CLOCK_SKEW
+from models.auth import SigningCerts
+from settings import GOOGLE_CERTS_URL
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip('=')
+
+
+def _b64decode(data):
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+def _b64int(value):
+    return _b64encode(long_to_bytes(value))
+
+
+class VerifyIdTokenTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.key = RSA.generate(1024)
+
+    def setUp(self):
+        self.testbed = testing.activateStubs()
+        tokens._tokenCache.clear()
+        tokens._signingKeys.update(keys={}, expires=0)
+        SigningCerts(id=GOOGLE_CERTS_URL,
+                     keys={'fake': (_b64int(self.key.n),
+                                    _b64int(self.key.e))},
+                     expires=time.time() + 3600).put()
+        self.now = int(time.time())
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def sign(self, claims=None, header=None, **changes):
+        """Return a JWT of valid claims, with the given changes."""
+        if claims is None:
+            claims = {'iss': 'accounts.google.com',
+                      'aud': tokens.AUDIENCES[0],
+                      'sub': '1234567890',
+                      'iat': self.now,
+                      'exp': self.now + 3600}
+            claims.update(changes)
+        if header is None:
+            header = {'alg': 'RS256', 'kid': 'fake'}
+        signed = '%s.%s' % (_b64encode(json.dumps(header)),
+                            _b64encode(json.dumps(claims)))
+        signature = PKCS1_v1_5.new(self.key).sign(SHA256.new(signed))
+        return '%s.%s' % (signed, _b64encode(signature))
+
+    def testValidToken(self):
+        self.assertEqual(tokens.verifyIdToken(self.sign()), '1234567890')
+
+    def testValidTokenIsCached(self):
+        token = self.sign()
+        tokens.verifyIdToken(token)
+        self.assertIn(token, tokens._tokenCache)
+
+    def withSignature(self, token, signature):
+        return '%s.%s' % (token.rsplit('.', 1)[0], _b64encode(signature))
+
+    def testBadSignature(self):
+        token = self.sign()
+        signature = _b64decode(token.rsplit('.', 1)[1])
+        # one less than a valid signature, so still smaller than the modulus
+        wrong = long_to_bytes(bytes_to_long(signature) - 1, len(signature))
+        self.assertIsNone(tokens.verifyIdToken(
+            self.withSignature(token, wrong)))
+
+    def testOversizedSignature(self):
+        token = self.sign()
+        # not smaller than the modulus
+        self.assertIsNone(tokens.verifyIdToken(
+            self.withSignature(token, '\xff' * 128)))
+        self.assertIsNone(tokens.verifyIdToken(
+            self.withSignature(token, long_to_bytes(self.key.n))))
+        # not of the size of the modulus
+        self.assertIsNone(tokens.verifyIdToken(
+            self.withSignature(token, '\x01' + '\x00' * 128)))
+        self.assertIsNone(tokens.verifyIdToken(
+            self.withSignature(token, '')))
+
+    def testTamperedClaims(self):
+        header, payload, signature = self.sign().split('.')
+        forged = _b64encode(json.dumps({
+            'iss': 'accounts.google.com', 'aud': tokens.AUDIENCES[0],
+            'sub': 'someone else', 'iat': self.now,
+            'exp': self.now + 3600}))
+        self.assertIsNone(tokens.verifyIdToken(
+            '.'.join([header, forged, signature])))
+
+    def testWrongAudience(self):
+        self.assertIsNone(tokens.verifyIdToken(
+            self.sign(aud='another-client-id')))
+
+    def testWrongIssuer(self):
+        self.assertIsNone(tokens.verifyIdToken(
+            self.sign(iss='accounts.example.com')))
+
+    def testExpired(self):
+        self.assertIsNone(tokens.verifyIdToken(
+            self.sign(exp=self.now - TOKEN_CLOCK_SKEW - 1)))
+
+    def testExpiredWithinClockSkew(self):
+        self.assertEqual(tokens.verifyIdToken(
+            self.sign(exp=self.now - TOKEN_CLOCK_SKEW + 60)), '1234567890')
+
+    def testUnknownKeyScheduleRefresh(self):
+        token = self.sign(header={'alg': 'RS256', 'kid': 'rotated'})
+        self.assertIsNone(tokens.verifyIdToken(token))
+        tasks = self.testbed.get_stub('taskqueue').get_filtered_tasks(
+            url='/tasks/refresh_signing_certs')
+        self.assertEqual(len(tasks), 1)
+
+    def testWrongAlgorithm(self):
+        self.assertIsNone(tokens.verifyIdToken(
+            self.sign(header={'alg': 'none', 'kid': 'fake'})))
+
+    def testMalformed(self):
+        for token in ('', 'not a token', 'a.b', 'a.b.c.d', '!!.??.**',
+                      '%s.%s.' % (_b64encode('{'), _b64encode('{}'))):
+            self.assertIsNone(tokens.verifyIdToken(token), token)
+
+    def testNonObjectJson(self):
+        self.assertIsNone(tokens.verifyIdToken(self.sign(claims=[])))
+        self.assertIsNone(tokens.verifyIdToken(self.sign(header=[])))
+        self.assertIsNone(tokens.verifyIdToken(self.sign(claims='sub')))
+
+
+if __name__ == '__main__':
+    unittest.main()
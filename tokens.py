@@ -0,0 +1,183 @@
+"""
+tokens.py
+Local verification of Google ID tokens.
+
+ID tokens are JWTs signed with RS256 by Google's signing keys.
+They are verified against the keys in SigningCerts, which a task
+    refreshes when they get close to the expiry of their Cache-Control
+    header. Requests never fetch the keys themselves.
+Verified tokens are kept in a bounded LRU cache until they expire.
+"""
+
+import base64
+import binascii
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from Crypto.Hash import SHA256
+from Crypto.PublicKey import RSA
+from Crypto.Signature import PKCS1_v1_5
+from Crypto.Util.number import bytes_to_long
+from google.appengine.api import memcache, taskqueue, urlfetch
+
+from core import API_EXPLORER_CLIENT_ID, TOKEN_CACHE_SIZE,\
+    TOKEN_CLOCK_SKEW, CERTS_REFRESH_MARGIN, DEFAULT_CERTS_MAX_AGE
+from models.auth import SigningCerts
+from settings import WEB_CLIENT_ID, GOOGLE_CERTS_URL,\
+    MEMCACHE_SIGNING_CERTS_KEY
+
+
+ISSUERS = ('accounts.google.com', 'https://accounts.google.com')
+AUDIENCES = (WEB_CLIENT_ID, API_EXPLORER_CLIENT_ID)
+
+# Per instance caches, shared by the request threads
+_lock = threading.Lock()
+# token: (user id, expiry), least recently used first
+_tokenCache = OrderedDict()
+# {'keys': {key id: RSA key}, 'expires': timestamp}
+_signingKeys = {'keys': {}, 'expires': 0}
+
+
+def verifyIdToken(token):
+    """
+    Return the Google user id of a valid ID token, without network calls
+    :param token: ID token from the Authorization header
+    :return: user id, or None if the token is not valid
+        or the signing keys are not loaded yet
+    """
+    now = time.time()
+    with _lock:
+        cached = _tokenCache.pop(token, None)
+        if cached and cached[1] > now:
+            _tokenCache[token] = cached
+            return cached[0]
+
+    claims = _verifyJwt(token, now)
+    if not claims:
+        return None
+
+    with _lock:
+        _tokenCache[token] = (claims['sub'], claims['exp'])
+        while len(_tokenCache) > TOKEN_CACHE_SIZE:
+            _tokenCache.popitem(last=False)
+    return claims['sub']
+
+
+def _verifyJwt(token, now):
+    """Return the claims of a JWT signed by one of the signing keys,
+        issued by Google for this app and not expired; None otherwise."""
+    try:
+        header, payload, signature = [
+            _b64decode(part) for part in token.split('.')]
+        header = json.loads(header)
+        claims = json.loads(payload)
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(header, dict) or not isinstance(claims, dict):
+        return None
+
+    if header.get('alg') != 'RS256':
+        return None
+    key = getSigningKeys().get(header.get('kid'))
+    if key is None:
+        # the keys may have rotated since the last refresh
+        scheduleCertsRefresh()
+        return None
+
+    # PKCS1_v1_5 raises on signatures not of the size of the modulus
+    #     or not smaller than it
+    if (len(signature) != key.size() // 8 + 1 or
+            bytes_to_long(signature) >= key.n):
+        return None
+    signed = token.rsplit('.', 1)[0]
+    if not PKCS1_v1_5.new(key).verify(SHA256.new(signed), signature):
+        return None
+
+    if (claims.get('iss') not in ISSUERS or
+            claims.get('aud') not in AUDIENCES or
+            not claims.get('sub') or
+            claims.get('exp', 0) + TOKEN_CLOCK_SKEW < now or
+            claims.get('iat', 0) - TOKEN_CLOCK_SKEW > now):
+        return None
+    return claims
+
+
+def _b64decode(data):
+    """Decode unpadded base64url."""
+    data = str(data)
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+def getSigningKeys():
+    """
+    Return the signing keys by key id
+    Keys are read from the instance, then memcache, then the datastore.
+    A refresh task is scheduled when they are about to expire.
+    :return: dict of key id: RSA key
+    """
+    now = time.time()
+    if _signingKeys['expires'] - CERTS_REFRESH_MARGIN > now:
+        return _signingKeys['keys']
+
+    certs = memcache.get(MEMCACHE_SIGNING_CERTS_KEY)
+    if certs is None:
+        entity = SigningCerts.get_by_id(GOOGLE_CERTS_URL)
+        if entity:
+            certs = {'keys': entity.keys, 'expires': entity.expires}
+            memcache.set(MEMCACHE_SIGNING_CERTS_KEY, certs)
+    if certs is None or certs['expires'] - CERTS_REFRESH_MARGIN <= now:
+        scheduleCertsRefresh()
+    if certs:
+        keys = dict((kid, _rsaKey(n, e))
+                    for kid, (n, e) in certs['keys'].items())
+        with _lock:
+            _signingKeys['keys'] = keys
+            _signingKeys['expires'] = certs['expires']
+    return _signingKeys['keys']
+
+
+def _rsaKey(n, e):
+    """Build an RSA public key from base64url modulus and exponent."""
+    # RSA.construct takes longs only, even for an exponent like 65537
+    return RSA.construct((long(binascii.hexlify(_b64decode(n)), 16),
+                          long(binascii.hexlify(_b64decode(e)), 16)))
+
+
+def scheduleCertsRefresh():
+    """Enqueue refreshSigningCerts, at most once per refresh margin."""
+    window = int(time.time()) // CERTS_REFRESH_MARGIN
+    try:
+        taskqueue.add(name='refresh-signing-certs-%d' % window,
+                      url='/tasks/refresh_signing_certs')
+    except (taskqueue.TaskAlreadyExistsError,
+            taskqueue.TombstonedTaskError):
+        pass
+
+
+def refreshSigningCerts():
+    """
+    Fetch Google's signing keys and store them until the expiry
+        given by max-age of their Cache-Control header.
+    Used by the refresh_signing_certs task and cron job.
+    :return: number of keys stored
+    """
+    resp = urlfetch.fetch(GOOGLE_CERTS_URL)
+    if resp.status_code != 200:
+        raise urlfetch.Error(
+            'Fetching signing keys failed: %s' % resp.status_code)
+
+    max_age = re.search(r'max-age=(\d+)',
+                        resp.headers.get('Cache-Control', ''))
+    expires = time.time() + (
+        int(max_age.group(1)) if max_age else DEFAULT_CERTS_MAX_AGE)
+    keys = dict((jwk['kid'], (jwk['n'], jwk['e']))
+                for jwk in json.loads(resp.content).get('keys', [])
+                if jwk.get('kty') == 'RSA')
+
+    SigningCerts(id=GOOGLE_CERTS_URL, keys=keys, expires=expires).put()
+    memcache.set(MEMCACHE_SIGNING_CERTS_KEY,
+                 {'keys': keys, 'expires': expires})
+    return len(keys)
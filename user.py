@@ -3,9 +3,11 @@ from protorpc import message_types
 from protorpc import remote
 
 import utils
+from conference import ConferenceApi
 from core import EMAIL_SCOPE, API_EXPLORER_CLIENT_ID
+from serializers import profileToForm
 from settings import WEB_CLIENT_ID
-from models.profile import ProfileForm, TeeShirtSize, ProfileMiniForm
+from models.profile import ProfileForm, ProfileMiniForm
 
 
 @endpoints.api(name='user',
@@ -28,7 +30,8 @@ class UserApi(remote.Service):
 
         helper:
             _copyProfileToForm:
-                convert data from database into Conference form message
+                convert data from database into Profile form message
+                with the copier serializers.profileToForm
             _doProfile: convert data from inbound from message,
                 so it fits in profile model.
                 Create/Update  a profile entity
@@ -51,32 +54,28 @@ class UserApi(remote.Service):
     # - - - Helper methods - - - - - - - - - - - - - - - - - - - -
     def _copyProfileToForm(self, prof):
         """Copy relevant fields from Profile to ProfileForm."""
-        pf = ProfileForm()
-        for field in pf.all_fields():
-            if hasattr(prof, field.name):
-                # convert t-shirt string to Enum; just copy others
-                if field.name == 'teeShirtSize':
-                    setattr(pf, field.name,
-                            getattr(TeeShirtSize, getattr(prof, field.name)))
-                else:
-                    setattr(pf, field.name, getattr(prof, field.name))
+        # See also: serializers.profileToForm
+        pf = profileToForm(prof)
         pf.check_initialized()
         return pf
 
     def _doProfile(self, save_request=None):
         """Get user Profile and return to user, possibly updating it first."""
         # get user Profile
-        user = endpoints.get_current_user()
-        prof = utils.getProfileFromUser(user)
+        prof = utils.currentContext().getProfile()
 
         # if saveProfile(), process user-modifyable fields
         if save_request:
+            displayName = prof.displayName
             for field in ('displayName', 'teeShirtSize'):
                 if hasattr(save_request, field):
                     val = getattr(save_request, field)
                     if val:
                         setattr(prof, field, str(val))
                 prof.put()
+            # getConference caches the organizer's display name
+            if prof.displayName != displayName:
+                ConferenceApi._invalidateOrganizer(prof.key)
 
         # return ProfileForm
         return self._copyProfileToForm(prof)
@@ -1,12 +1,13 @@
-import json
+import logging
 import os
-import time
+import threading
 import uuid
 
-from google.appengine.api import urlfetch
+import endpoints
 from google.appengine.ext import ndb
 
 from models.profile import Profile, TeeShirtSize
+from tokens import verifyIdToken
 
 
 def getUserId(user, id_type="email"):
@@ -24,28 +25,14 @@ def getUserId(user, id_type="email"):
         return user.email()
 
     if id_type == "oauth":
-        """A workaround implementation for getting userid."""
-        auth = os.getenv('HTTP_AUTHORIZATION')
-        bearer, token = auth.split()
-        token_type = 'id_token'
+        # access tokens are checked by the OAuth service,
+        #     which sets the user id in the environment
         if 'OAUTH_USER_ID' in os.environ:
-            token_type = 'access_token'
-        url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
-               % (token_type, token))
-        user = {}
-        wait = 1
-        for i in range(3):
-            resp = urlfetch.fetch(url)
-            if resp.status_code == 200:
-                user = json.loads(resp.content)
-                break
-            elif resp.status_code == 400 and 'invalid_token' in resp.content:
-                url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
-                       % ('access_token', token))
-            else:
-                time.sleep(wait)
-                wait = wait + i
-        return user.get('user_id', '')
+            return os.environ['OAUTH_USER_ID']
+        # ID tokens are verified locally against the cached signing keys
+        auth = os.getenv('HTTP_AUTHORIZATION', '')
+        bearer, _, token = auth.partition(' ')
+        return verifyIdToken(token.strip()) or ''
 
     if id_type == "custom":
         # implement your own user_id creation and getting algorythm
@@ -58,25 +45,107 @@ def getUserId(user, id_type="email"):
             return str(uuid.uuid1().get_hex())
 
 
-def getProfileFromUser(user):
+class RequestContext(object):
+    """RequestContext -- identity and Profile of the current request.
+    Resolved lazily, once, and shared by the helpers of every API,
+        so a request reads the Profile at most once.
+    Attributes:
+        user: current user object from API endpoint, or None
+        userId: user id of the current user
+        profileKey: key of the current user's Profile
+        profileReads: number of Profile reads issued by this request
     """
-    Return user Profile from datastore, creating new one if non-existent.
-    :param user: A current user object from API endpoint.
-        Example: user = endpoints.get_current_user()
-    :return: Profile object
+
+    def __init__(self, request_id=None):
+        self.requestId = request_id
+        self.profileReads = 0
+        self._user = None
+        self._userResolved = False
+        self._userId = None
+        self._profileFuture = None
+
+    @property
+    def user(self):
+        if not self._userResolved:
+            self._user = endpoints.get_current_user()
+            self._userResolved = True
+        return self._user
+
+    def requireUser(self):
+        """Return the current user, raising if there is none."""
+        if not self.user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        return self.user
+
+    @property
+    def userId(self):
+        if self._userId is None:
+            self._userId = getUserId(self.requireUser())
+        return self._userId
+
+    @property
+    def profileKey(self):
+        return ndb.Key(Profile, self.userId)
+
+    def getProfileAsync(self):
+        """
+        Return a future of the current user's Profile,
+            creating a new one if non-existent.
+        Only the first call of the request reads it.
+        """
+        if self._profileFuture is None:
+            self._profileFuture = self._loadProfileAsync()
+        return self._profileFuture
+
+    def getProfile(self):
+        """Return the current user's Profile, see getProfileAsync."""
+        return self.getProfileAsync().get_result()
+
+    def reloadProfile(self):
+        """
+        Read the current user's Profile again, for transactions
+        The reloaded Profile is shared with the rest of the request.
+        """
+        self._profileFuture = self._loadProfileAsync()
+        return self._profileFuture.get_result()
+
+    @ndb.tasklet
+    def _loadProfileAsync(self):
+        user = self.requireUser()
+        p_key = self.profileKey
+        self.profileReads += 1
+        if self.profileReads > 1:
+            logging.info('Profile read %d times in request %s',
+                         self.profileReads, self.requestId)
+        profile = yield p_key.get_async()
+
+        if not profile:
+            profile = Profile(
+                key=p_key,
+                displayName=user.nickname(),
+                mainEmail=user.email(),
+                teeShirtSize=str(TeeShirtSize.NOT_SPECIFIED),
+            )
+            yield profile.put_async()
+
+        # return Profile
+        raise ndb.Return(profile)
+
+
+# RequestContext of the request served by each thread
+_local = threading.local()
+
+
+def currentContext():
+    """
+    Return the RequestContext of the current request
+    Threads serve one request at a time,
+        so the context is kept per thread until the request id changes.
+    :return: RequestContext object
     """
-    user_id = getUserId(user)
-    p_key = ndb.Key(Profile, user_id)
-    profile = p_key.get()
-
-    if not profile:
-        profile = Profile(
-            key=p_key,
-            displayName=user.nickname(),
-            mainEmail=user.email(),
-            teeShirtSize=str(TeeShirtSize.NOT_SPECIFIED),
-        )
-        profile.put()
-
-    # return Profile
-    return profile
+    request_id = os.environ.get('REQUEST_LOG_ID')
+    context = getattr(_local, 'context', None)
+    # without a request id, never share a context between requests
+    if context is None or not request_id or context.requestId != request_id:
+        context = _local.context = RequestContext(request_id)
+    return context